@@ -0,0 +1,595 @@
+#!/usr/bin/env python3
+"""Benchmarks of the in-memory parts of the sync, on synthetic contacts
+
+Nothing here talks to Google, the contacts are made up by synthetic_people.
+
+    python bench.py memory -n 100000
+    python bench.py hot              # compare with bench-baselines.json
+    python bench.py hot --save       # make the current times the baselines
+    python bench.py codec            # json vs orjson on 1000 contact pages
+"""
+
+import gc
+import os
+import sys
+import json
+import time
+import copy
+import random
+import string
+import argparse
+import tracemalloc
+import dateutil.parser
+
+import sync
+import dupes
+from jsoncodec import CODECS
+from changeset import ChangeSet
+from contacts import (
+    Contacts, SYNC_TAG, MAX_BATCH_CREATE, iso_key, info_person_fields,
+)
+
+
+# the listing fields of a (not full) get_info
+INFO_FIELDS = info_person_fields
+
+# where bench.py hot keeps its baselines
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'bench-baselines.json')
+
+
+GIVEN = [
+    'James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael',
+    'Linda', 'William', 'Elizabeth', 'David', 'Barbara', 'Richard', 'Susan',
+    'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen', 'Aroha',
+    'Wiremu', 'Mei', 'Hiroshi', 'Priya', 'Arjun', 'Sofia', 'Lucas', 'Ana',
+]
+FAMILY = [
+    'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller',
+    'Davis', 'Rodriguez', 'Martinez', 'Hernandez', 'Lopez', 'Wilson',
+    'Anderson', 'Taylor', 'Thomas', 'Moore', 'Jackson', 'Martin', 'Lee',
+    'Ngata', 'Tanaka', 'Patel', 'Singh', 'Nguyen', 'Kim', 'Müller', 'Rossi',
+]
+DOMAINS = ['gmail.com', 'yahoo.com', 'outlook.com', 'example.org', 'work.co']
+COMPANIES = ['Acme', 'Globex', 'Initech', 'Umbrella', 'Hooli', 'Stark']
+
+
+def _field_meta(rnd, primary=False):
+    """The metadata the API puts on every field of a person"""
+    m = {'source': {'type': 'CONTACT', 'id': '%x' % rnd.getrandbits(48)}}
+    if primary:
+        m['primary'] = True
+    return m
+
+
+def _update_time(rnd):
+    """An updateTime, with the server's varying number of fraction digits"""
+    t = '20%02d-%02d-%02dT%02d:%02d:%02d' % (
+        rnd.randint(15, 25), rnd.randint(1, 12), rnd.randint(1, 28),
+        rnd.randint(0, 23), rnd.randint(0, 59), rnd.randint(0, 59)
+    )
+    digits = rnd.choice([0, 3, 6, 6, 6])
+    if digits:
+        t += '.' + ''.join(rnd.choices(string.digits, k=digits))
+    return t + 'Z'
+
+
+def synthetic_people(n, seed=0, fields=None, ngroups=20):
+    """Return n people bodies, like people.connections.list returns them
+
+    The fields follow what a real address book looks like: everybody has a
+    name, most have an email and a phone, fewer have addresses, birthdays and
+    the rest.  About 1 in 50 names is repeated and 5% have no sync tag yet.
+
+    Parameters
+    ----------
+    n: int
+        How many people
+    seed: int
+        For the random number generator, the same seed gives the same people
+    fields: list
+        Only include these personFields (as a listing with personFields would)
+        or all of them if None
+    ngroups: int
+        How many labels (contactGroups/g0...) people can be members of
+
+    Returns
+    -------
+    list:
+        Of person dicts
+    """
+    rnd = random.Random(seed)
+    people = []
+    for i in range(n):
+        given, family = rnd.choice(GIVEN), rnd.choice(FAMILY)
+        if rnd.random() > 0.02:
+            # most names are unique
+            family += '-%d' % i
+        p = {
+            'resourceName': 'people/c%d' % (10**12 + i),
+            'etag': '%%%x' % rnd.getrandbits(96),
+            'metadata': {
+                'sources': [{
+                    'type': 'CONTACT',
+                    'id': '%x' % rnd.getrandbits(48),
+                    'etag': '#%x' % rnd.getrandbits(48),
+                    'updateTime': _update_time(rnd),
+                }],
+                'objectType': 'PERSON',
+            },
+            'names': [{
+                'metadata': _field_meta(rnd, True),
+                'displayName': f'{given} {family}',
+                'familyName': family,
+                'givenName': given,
+                'displayNameLastFirst': f'{family}, {given}',
+                'unstructuredName': f'{given} {family}',
+            }],
+        }
+        if rnd.random() < 0.95:
+            p['clientData'] = [{
+                'metadata': _field_meta(rnd),
+                'key': SYNC_TAG,
+                'value': ''.join(rnd.choices(string.ascii_lowercase, k=20)),
+            }]
+        nemail = rnd.choices([0, 1, 2, 3], [15, 60, 20, 5])[0]
+        if nemail:
+            p['emailAddresses'] = [{
+                'metadata': _field_meta(rnd, j == 0),
+                'value': f'{given}.{family}{j}@{rnd.choice(DOMAINS)}'.lower(),
+                'type': rnd.choice(['home', 'work', 'other']),
+                'formattedType': 'Home',
+            } for j in range(nemail)]
+        nphone = rnd.choices([0, 1, 2, 3], [20, 55, 20, 5])[0]
+        if nphone:
+            p['phoneNumbers'] = [{
+                'metadata': _field_meta(rnd, j == 0),
+                'value': '+64 21 %03d %04d' % (
+                    rnd.randint(0, 999), rnd.randint(0, 9999)
+                ),
+                'canonicalForm': '+6421%07d' % rnd.randint(0, 9999999),
+                'type': rnd.choice(['mobile', 'home', 'work']),
+                'formattedType': 'Mobile',
+            } for j in range(nphone)]
+        if rnd.random() < 0.3:
+            p['organizations'] = [{
+                'metadata': _field_meta(rnd, True),
+                'name': rnd.choice(COMPANIES),
+                'title': rnd.choice(['Engineer', 'Manager', 'Director']),
+            }]
+        if rnd.random() < 0.2:
+            p['addresses'] = [{
+                'metadata': _field_meta(rnd, True),
+                'formattedValue': '%d Some Street\nTown 1234' % rnd.randint(
+                    1, 300
+                ),
+                'streetAddress': '%d Some Street' % rnd.randint(1, 300),
+                'city': 'Town',
+                'postalCode': '1234',
+                'country': 'New Zealand',
+                'type': 'home',
+            }]
+        if rnd.random() < 0.15:
+            p['birthdays'] = [{
+                'metadata': _field_meta(rnd, True),
+                'date': {
+                    'year': rnd.randint(1940, 2015),
+                    'month': rnd.randint(1, 12),
+                    'day': rnd.randint(1, 28),
+                },
+            }]
+        if rnd.random() < 0.1:
+            p['biographies'] = [{
+                'metadata': _field_meta(rnd, True),
+                'value': ' '.join(rnd.choices(GIVEN + FAMILY, k=30)),
+                'contentType': 'TEXT_PLAIN',
+            }]
+        if rnd.random() < 0.1:
+            p['urls'] = [{
+                'metadata': _field_meta(rnd, True),
+                'value': f'https://{family.lower()}.example.org/',
+            }]
+        if rnd.random() < 0.05:
+            p['nicknames'] = [{
+                'metadata': _field_meta(rnd, True),
+                'value': given[:3],
+            }]
+        p['memberships'] = [{
+            'metadata': {'source': {'type': 'CONTACT', 'id': '1'}},
+            'contactGroupMembership': {
+                'contactGroupId': 'myContacts',
+                'contactGroupResourceName': 'contactGroups/myContacts',
+            },
+        }]
+        for g in rnd.sample(
+            range(ngroups), rnd.choices([0, 1, 2, 3], [50, 30, 15, 5])[0]
+        ):
+            p['memberships'].append({
+                'metadata': {'source': {'type': 'CONTACT', 'id': '1'}},
+                'contactGroupMembership': {
+                    'contactGroupId': 'g%d' % g,
+                    'contactGroupResourceName': 'contactGroups/g%d' % g,
+                },
+            })
+        if fields is not None:
+            p = {
+                k: v for k, v in p.items()
+                if k in fields or k in ('resourceName', 'etag')
+            }
+        people.append(p)
+    return people
+
+
+_PEOPLE = {}
+
+
+def _people(n, fields=None, seed=0):
+    """synthetic_people, made once per n, fields (a tuple) and seed
+
+    For the benchmarks, don't modify what it returns.
+    """
+    if (n, fields, seed) not in _PEOPLE:
+        _PEOPLE[(n, fields, seed)] = synthetic_people(
+            n, seed=seed, fields=fields and list(fields)
+        )
+    return _PEOPLE[(n, fields, seed)]
+
+
+def synthetic_groups(ngroups=20, seed=0):
+    """Return ngroups tagged labels, like contactGroups.list returns them"""
+    rnd = random.Random(seed)
+    return [{
+        'resourceName': 'contactGroups/g%d' % g,
+        'etag': '%x' % rnd.getrandbits(64),
+        'metadata': {'updateTime': _update_time(rnd)},
+        'groupType': 'USER_CONTACT_GROUP',
+        'name': 'Label %d' % g,
+        'clientData': [{
+            'key': SYNC_TAG,
+            'value': ''.join(rnd.choices(string.ascii_lowercase, k=20)),
+        }],
+    } for g in range(ngroups)]
+
+
+class SyntheticContacts(Contacts):
+    """A Contacts whose listings come from memory instead of the server"""
+
+    def __init__(self, people, groups=()):
+        self.people = people
+        self.groups = list(groups)
+        self.full = False
+        self.members = None
+        self.scope = None
+        self.last_written = {}
+        self.last_written_groups = {}
+
+    def iter_contacts(self, fields=None, sync_token=False):
+        return iter(self.people)
+
+    def get_contactGroups(self, verbose=False):
+        return self.groups
+
+
+def dict_info(people):
+    """Build info the way it used to be, a dict per contact with a datetime
+
+    Only here to compare with.
+    """
+    info = {}
+    for p in people:
+        tagls = [
+            kv['value']
+            for kv in p.get('clientData', {})
+            if kv.get('key', None) == SYNC_TAG
+        ]
+        info[p['resourceName']] = {
+            'etag': p['etag'],
+            'tag': tagls[0] if tagls else None,
+            'updated': dateutil.parser.isoparse(
+                p['metadata']['sources'][0]['updateTime']
+            ),
+            'name': p['names'][0]['displayName'],
+        }
+    return info
+
+
+def measure(fn):
+    """Return (seconds, bytes) that fn took and kept allocated"""
+    gc.collect()
+    t = time.perf_counter()
+    kept = fn()
+    secs = time.perf_counter() - t
+    del kept
+
+    gc.collect()
+    tracemalloc.start()
+    kept = fn()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return secs, size
+
+
+def synthetic_ring(n, deleted=0.01, added=0.01, updated=0.01, seed=0):
+    """Return two synced accounts of n contacts, as a ring would have them
+
+    A fraction of the contacts were deleted from the second account, added to
+    it (the copies made this run, see sync.changed_since) or updated since
+    the last run.
+
+    Returns
+    -------
+    (dict, str, ChangeSet):
+        The accounts keyed by email, the last run (iso_key) and the changes
+        with the copies added this run
+    """
+    rnd = random.Random(seed)
+    people = _people(n, tuple(INFO_FIELDS), seed)
+    groups = synthetic_groups(seed=seed)
+    last = max(iso_key(p['metadata']['sources'][0]['updateTime'])
+               for p in people)
+    a = SyntheticContacts(people, groups)
+    a.get_info()
+
+    other = []
+    for p in people:
+        if rnd.random() < deleted:
+            continue
+        p = dict(p)
+        if rnd.random() < updated:
+            p['metadata'] = {'sources': [{'updateTime': '2099-01-01T00:00:00Z'}]}
+        other.append(p)
+    b = SyntheticContacts(other, groups)
+    b.get_info()
+    changes = ChangeSet()
+    for p in other:
+        if rnd.random() < added:
+            changes.add(b, p['resourceName'])
+    return {'a@x.com': a, 'b@x.com': b}, last, changes
+
+
+def hot_strip_body(n):
+    people = _people(n)
+    acc = SyntheticContacts(people)
+    # strip_body changes the bodies, give it its own copies
+    return lambda: copy.deepcopy(people), lambda ps: [
+        acc._Contacts__strip_body(p) for p in ps
+    ]
+
+
+def hot_get_info(n):
+    acc = SyntheticContacts(_people(n, tuple(INFO_FIELDS)),
+                            synthetic_groups())
+    return lambda: acc, lambda acc: acc.get_info()
+
+
+def hot_duplicates(n):
+    acc = SyntheticContacts(_people(n, tuple(INFO_FIELDS)))
+    acc.get_info()
+    return lambda: [i.name for i in acc.info.values()], sync.duplicates
+
+
+def hot_missing_tags(n):
+    con, last, changes = synthetic_ring(n)
+    return lambda: con, sync.missing_tags
+
+
+def hot_changed_since(n):
+    con, last, changes = synthetic_ring(n)
+    since = dict.fromkeys(con, last)
+    return lambda: con, lambda con: sync.changed_since(con, since, changes)
+
+
+def hot_memberships(n):
+    con, last, changes = synthetic_ring(n)
+    a, b = con.values()
+    bodies = _people(n, ('names', 'memberships'))
+
+    def run(bodies):
+        sync.group_tables.clear()
+        return [
+            sync.translate_memberships(p, sync.membership_table(a, b))
+            for p in bodies
+        ]
+    return lambda: bodies, run
+
+
+def hot_dupes(n):
+    people = _people(n, tuple(dupes.DUPE_FIELDS))
+    return lambda: people, dupes.find_duplicates
+
+
+# the hot paths of a sync, each returns (setup, run) for n contacts: run is
+# timed on what setup returns
+HOT = {
+    'strip_body': hot_strip_body,
+    'get_info': hot_get_info,
+    'duplicates': hot_duplicates,
+    'missing_tags': hot_missing_tags,
+    'changed_since': hot_changed_since,
+    'memberships': hot_memberships,
+    'dupes': hot_dupes,
+}
+
+
+def time_hot(name, n, repeat=None):
+    """Return the best of repeat times of the hot path name on n contacts
+
+    By default small n are repeated more, their times are noisier.  Like
+    timeit, the garbage collector is off while timing.
+    """
+    if repeat is None:
+        repeat = min(50, max(3, 100000 // n))
+    setup, run = HOT[name](n)
+    best = None
+    for _ in range(repeat):
+        arg = setup()
+        gc.disable()
+        try:
+            t = time.perf_counter()
+            run(arg)
+            secs = time.perf_counter() - t
+        finally:
+            gc.enable()
+        best = secs if best is None else min(best, secs)
+    return best
+
+
+def bench_hot(sizes, names, save=False, tolerance=2.0, baselines=BASELINES):
+    """Time the hot paths and compare them with the baselines
+
+    Parameters
+    ----------
+    sizes: list
+        Numbers of contacts per account to time each hot path with
+    names: list
+        Of hot paths (keys of HOT)
+    save: bool
+        Store the times as the new baselines instead of comparing
+    tolerance: float
+        A time more than this many times its baseline is a regression.  A loop
+        gone quadratic is way past it at 100k contacts
+
+    Returns
+    -------
+    int:
+        The number of regressions
+
+    """
+    base = {}
+    if os.path.exists(baselines):
+        with open(baselines) as f:
+            base = json.load(f)
+
+    regressions = 0
+    print(f"{'':16}{'contacts':>10}{'seconds':>10}{'us each':>10}"
+          f"{'baseline':>10}")
+    for name in names:
+        for n in sizes:
+            secs = time_hot(name, n)
+            key = f'{name} {n}'
+            old = base.get(key)
+            flag = ''
+            if old is not None:
+                flag = f'{old:10.4f}'
+                # under a millisecond is noise
+                if not save and secs > old * tolerance and secs - old > 1e-3:
+                    flag += f'  REGRESSION x{secs / old:.1f}'
+                    regressions += 1
+            print(f"{name:16}{n:10d}{secs:10.4f}{secs / n * 1e6:10.2f}{flag}")
+            if save:
+                base[key] = float(f'{secs:.3g}')
+
+    if save:
+        with open(baselines, 'w') as f:
+            json.dump(base, f, indent=1, sort_keys=True)
+            f.write('\n')
+        print(f"saved to {baselines}")
+    elif regressions:
+        print(f"{regressions} regression(s), more than x{tolerance} baseline")
+    return regressions
+
+
+def bench_memory(n):
+    """Compare the memory and time it takes to build info for n contacts"""
+    people = synthetic_people(n, fields=INFO_FIELDS)
+
+    def records():
+        acc = SyntheticContacts(people)
+        acc.get_info()
+        return acc
+
+    print(f"info for {n} contacts")
+    print(f"{'':16}{'seconds':>10}{'MB':>10}{'bytes each':>12}")
+    for name, fn in [
+        ('Info records', records),
+        ('dicts+datetime', lambda: dict_info(people)),
+    ]:
+        secs, size = measure(fn)
+        print(f"{name:16}{secs:10.3f}{size / 2**20:10.1f}{size // n:12d}")
+
+
+def bench_codec(n, pages):
+    """Compare the JSON codecs on listing pages and create requests
+
+    A page is what a full listing of n people returns, a create request
+    what add_many sends for MAX_BATCH_CREATE stripped bodies.
+    """
+    acc = SyntheticContacts([])
+    page = {
+        'connections': synthetic_people(n),
+        'nextPageToken': 'x' * 120,
+        'totalPeople': n * pages,
+        'totalItems': n * pages,
+    }
+    text = json.dumps(page).encode()
+    create = {
+        'contacts': [
+            {'contactPerson': acc._Contacts__strip_body(copy.deepcopy(p))}
+            for p in page['connections'][:MAX_BATCH_CREATE]
+        ],
+        'readMask': 'clientData,metadata',
+    }
+    csize = len(json.dumps(create))
+
+    def best(fn, repeat=pages):
+        secs = None
+        for _ in range(repeat):
+            gc.disable()
+            try:
+                t = time.perf_counter()
+                fn()
+                took = time.perf_counter() - t
+            finally:
+                gc.enable()
+            secs = took if secs is None else min(secs, took)
+        return secs
+
+    print(f"{n} contact page {len(text) / 2**20:.1f}MB, "
+          f"{MAX_BATCH_CREATE} contact create {csize / 2**10:.0f}KB")
+    print(f"{'':10}{'decode MB/s':>12}{'pages/s':>10}{'encode MB/s':>12}"
+          f"{'creates/s':>10}")
+    for name, (loads, dumps) in CODECS.items():
+        dec = best(lambda: loads(text))
+        enc = best(lambda: dumps(create))
+        print(f"{name:10}{len(text) / dec / 2**20:12.1f}{1 / dec:10.1f}"
+              f"{csize / enc / 2**20:12.1f}{1 / enc:10.1f}")
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    sub = p.add_subparsers(dest='bench', required=True)
+    m = sub.add_parser('memory', help='Memory and time to build Contacts.info')
+    m.add_argument('-n', type=int, default=100000, help='Number of contacts')
+    h = sub.add_parser(
+        'hot', help='Time the hot loops of a sync, checking for regressions'
+    )
+    h.add_argument('-n', type=int, nargs='+', default=[1000, 10000, 100000],
+                   help='Numbers of contacts per account')
+    h.add_argument('--only', nargs='+', choices=list(HOT), default=list(HOT),
+                   help='Only time these')
+    h.add_argument('--save', action='store_true',
+                   help='Save the times as the baselines')
+    h.add_argument('--tolerance', type=float, default=2.0,
+                   help='Slower than this times the baseline is a regression')
+    c = sub.add_parser(
+        'codec', help='JSON decode/encode throughput of the codecs'
+    )
+    c.add_argument('-n', type=int, default=1000,
+                   help='Number of contacts per page')
+    c.add_argument('--pages', type=int, default=20,
+                   help='Times each is repeated, the best is kept')
+    args = p.parse_args()
+
+    if args.bench == 'memory':
+        bench_memory(args.n)
+    elif args.bench == 'codec':
+        bench_codec(args.n, args.pages)
+    elif args.bench == 'hot':
+        sys.exit(1 if bench_hot(
+            args.n, args.only, save=args.save, tolerance=args.tolerance
+        ) else 0)
+    sys.exit(0)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import zlib
+import sqlite3
+import threading
+
+from jsoncodec import get_codec
+
+
+# Once the cache is bigger than its limit, drop the least recently used
+# bodies until it is down to this fraction of it
+EVICT_TO = 0.9
+
+
+class BodyCache():
+    """Keep the stripped bodies of contacts on disk, by account, rn and etag
+
+    A body read from the server is good for as long as the contact keeps the
+    etag it was read at, so Contacts.get can use a cached one instead of
+    asking again.  The bodies are kept (compressed) in an sqlite database,
+    with when each was last used, and the least recently used are dropped
+    when the cache grows bigger than max_bytes.
+
+    Safe to use from several threads.
+
+    """
+
+    def __init__(self, path, max_bytes=64 * 2**20):
+        """
+        Parameters
+        ----------
+        path: pathlib.Path
+            The database, made if it doesn't exist
+        max_bytes: int
+            How big the (compressed) bodies may get
+        """
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.loads, self.dumps = get_codec()
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS bodies ("
+            "account TEXT, rn TEXT, etag TEXT, data BLOB, used INTEGER, "
+            "PRIMARY KEY (account, rn))"
+        )
+        # ticks once for each body used, the LRU clock
+        self.clock = self.db.execute(
+            "SELECT COALESCE(MAX(used), 0) FROM bodies"
+        ).fetchone()[0]
+        # (used, account, rn) of the hits, saved by close
+        self.used = []
+        self.unsaved = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, account, rn, etag):
+        """Return (body, photo url) of rn as cached at etag, or None"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT data FROM bodies "
+                "WHERE account = ? AND rn = ? AND etag = ?",
+                (account, rn, etag),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.clock += 1
+            self.used.append((self.clock, account, rn))
+        body, url = self.loads(zlib.decompress(row[0]))
+        return body, url
+
+    def put(self, account, rn, etag, body, url):
+        """Cache the stripped body (and photo url) of rn at etag"""
+        data = zlib.compress(self.dumps([body, url]).encode())
+        with self.lock:
+            self.clock += 1
+            self.db.execute(
+                "INSERT OR REPLACE INTO bodies VALUES (?, ?, ?, ?, ?)",
+                (account, rn, etag, data, self.clock),
+            )
+            self.unsaved += 1
+            if self.unsaved >= 1000:
+                self.db.commit()
+                self.unsaved = 0
+
+    def close(self):
+        """Save the cache, evicting the least recently used if it's too big"""
+        with self.lock:
+            self.db.executemany(
+                "UPDATE bodies SET used = ? WHERE account = ? AND rn = ?",
+                self.used,
+            )
+            total = self.db.execute(
+                "SELECT COALESCE(SUM(LENGTH(data)), 0) FROM bodies"
+            ).fetchone()[0]
+            if total > self.max_bytes:
+                drop = []
+                for rowid, size in self.db.execute(
+                    "SELECT rowid, LENGTH(data) FROM bodies ORDER BY used"
+                ):
+                    if total <= self.max_bytes * EVICT_TO:
+                        break
+                    drop.append((rowid,))
+                    total -= size
+                self.db.executemany("DELETE FROM bodies WHERE rowid = ?", drop)
+            self.db.commit()
+            self.db.close()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import threading
+
+
+class ChangeSet():
+    """What a run changes in each account, as it finds out
+
+    One is made per run and handed to each phase (groups, contacts, labels,
+    the audit's repairs), which record the tags they delete, the people they
+    tag, add and update, and ask it what has been done already, in constant
+    time: somebody added this run is modified but needs no syncing, somebody
+    deleted mustn't be copied anywhere.  It also keeps each account's tag to
+    rn map, made from its info the first time it's asked for and kept up to
+    date with what is recorded.  The ContactGroups have a ChangeSet of their
+    own, groups.
+
+    The copies are recorded from the Scheduler's workers as they are made,
+    so recording takes a lock.
+
+    """
+
+    def __init__(self, groups=False):
+        """
+        Parameters
+        ----------
+        groups: bool
+            If this is the ChangeSet of the ContactGroups (info_group)
+        """
+        self.is_groups = groups
+        # maps Contacts to the dict mapping its tags to rn
+        self.rns = {}
+        # maps Contacts to the set of rns new this run (made or found)
+        self.added = {}
+        # maps Contacts to a dict mapping the rns tagged this run to their tag
+        self.tagged = {}
+        # maps Contacts to the set of rns updated this run
+        self.updated = {}
+        # maps Contacts to the set of tags deleted from it this run
+        self.deleted = {}
+        self.lock = threading.Lock()
+        self.groups = None if groups else ChangeSet(groups=True)
+
+    def _rns(self, acc):
+        """Return acc's tag to rn map, making it if need be"""
+        if acc not in self.rns:
+            info = acc.info_group if self.is_groups else acc.info
+            self.rns[acc] = {
+                v.tag: rn for rn, v in info.items() if v.tag is not None
+            }
+        return self.rns[acc]
+
+    def rn(self, acc, tag):
+        """Return the rn of acc's tag, None if it hasn't got it"""
+        return self._rns(acc).get(tag)
+
+    def has(self, acc, tag):
+        """Return whether acc has somebody with tag"""
+        return tag in self._rns(acc)
+
+    def listed(self, acc, rn):
+        """Record acc's rn was listed (with its tag) after the map was made"""
+        info = acc.info_group if self.is_groups else acc.info
+        with self.lock:
+            if info[rn].tag is not None:
+                self._rns(acc)[info[rn].tag] = rn
+
+    def delete(self, acc, tags):
+        """Record tags are being deleted from acc"""
+        with self.lock:
+            self.deleted.setdefault(acc, set([])).update(tags)
+            rns = self._rns(acc)
+            for tag in tags:
+                rns.pop(tag, None)
+
+    def add(self, acc, rn, tag=None):
+        """Record rn is new in acc, giving its tag if it is in acc's info"""
+        with self.lock:
+            self.added.setdefault(acc, set([])).add(rn)
+            if tag is not None:
+                self._rns(acc)[tag] = rn
+
+    def tag(self, acc, rn, tag):
+        """Record acc's rn was given tag"""
+        with self.lock:
+            self.tagged.setdefault(acc, {})[rn] = tag
+            self._rns(acc)[tag] = rn
+
+    def update(self, acc, rn):
+        """Record acc's rn is being updated"""
+        with self.lock:
+            self.updated.setdefault(acc, set([])).add(rn)
+
+    def new(self, acc):
+        """Return the set of rns new in acc this run"""
+        return self.added.get(acc, set([]))
+
+    def is_new(self, acc, rn):
+        """Return whether acc's rn is new this run"""
+        return rn in self.added.get(acc, ())
+
+    def is_tagged(self, acc, rn):
+        """Return the tag acc's rn was given this run, or None"""
+        return self.tagged.get(acc, {}).get(rn)
+
+    def is_updated(self, acc, rn):
+        """Return whether acc's rn was updated this run"""
+        return rn in self.updated.get(acc, ())
+
+    def is_deleted(self, tag, acc=None):
+        """Return whether tag is being deleted (from acc, or any account)"""
+        if acc is not None:
+            return tag in self.deleted.get(acc, ())
+        return any(tag in tags for tags in self.deleted.values())
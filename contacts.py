@@ -1,17 +1,30 @@
 #!/usr/bin/env python3
 
+import sys
+import copy
+import time
+import base64
+import threading
+import collections
+import concurrent.futures
 import pickle
 import os.path
+import datetime
 import dateutil.parser
 
 from time import sleep
 
+import httplib2
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import MAX_BATCH_LIMIT
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 import google.auth.exceptions
 
+from jsoncodec import CodecJsonModel
+
 
 # If modifying these scopes, delete the file token.pickle.
 SCOPES = ['https://www.googleapis.com/auth/contacts']
@@ -80,10 +93,160 @@ all_update_person_fields = [
     'userDefined'
 ]
 
+# the fields update changes when syncing contacts, labels (memberships) are
+# synced with modify_members instead
+content_update_person_fields = [
+    f for f in all_update_person_fields if f != 'memberships'
+]
+
+# the personFields get_info lists (unless it is listing everything)
+info_person_fields = [
+    'names', 'organizations', 'clientData', 'metadata', 'memberships'
+]
+
+# modify_members takes at most this many resource names to add (and remove)
+# per request
+MAX_MEMBERS = 1000
+
+# people.batchCreateContacts takes at most this many people per request
+MAX_BATCH_CREATE = 200
+
+# and people.batchDeleteContacts this many
+MAX_BATCH_DELETE = 500
+
+# people.getBatchGet gets at most this many people per request
+MAX_BATCH_GET = 200
+
+# the most members asked for when getting the people of a ContactGroup, more
+# than an account can have
+MAX_GROUP_MEMBERS = 100000
+
+# the most requests googleapiclient puts in one multipart batch
+MAX_BATCH = MAX_BATCH_LIMIT
+
+# If at least this fraction of an account's contacts will need their full
+# body it is cheaper to list the account with all_person_fields (1000 people
+# per request) than to get the people one request at a time
+FULL_LISTING_FRACTION = 0.02
+
+
+# seconds a request may take before it is given up on (and a read retried)
+DEFAULT_TIMEOUT = 60
+
+# times a request that timed out is made before giving up.  Reads are made
+# again by execute, the writes that can be (they are guarded by an etag, or
+# doing them twice is the same as once) by their methods
+TIMEOUT_TRIES = 5
+
+# reads hedged (see Contacts.execute) only once this many have been timed
+HEDGE_MIN_SAMPLES = 20
+
+
+class RateLimiter():
+    """Let at most rate requests a second through, in bursts of up to rate
+
+    A token bucket, shared by the threads making an account's requests.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Wait until the next request may be made"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.rate, self.tokens + (now - self.last) * self.rate
+            )
+            self.last = now
+            self.tokens -= 1
+            # the lock is held while waiting, so the waits queue up in order
+            if self.tokens < 0:
+                sleep(-self.tokens / self.rate)
+
+
+def iso_key(t):
+    """Return the ISO time t as a string that sorts in time order
+
+    The server sends UTC times like '2016-06-05T18:56:16.972001Z', but the
+    fraction of a second has a varying number of digits (or none), so they
+    can't be compared as they are.  Padding the fraction to microseconds is
+    much cheaper than parsing them.  Anything not in UTC (like the last time
+    in the config) is parsed.
+
+    Returns
+    -------
+    str:
+        The UTC time as 'YYYY-MM-DDTHH:MM:SS.ffffff'
+    """
+    if t.endswith('Z') and len(t) >= 20 and t[19] in '.Z':
+        return t[:19] + '.' + (t[20:-1] + '000000')[:6]
+    return dateutil.parser.isoparse(t).astimezone(
+        datetime.timezone.utc
+    ).strftime('%Y-%m-%dT%H:%M:%S.%f')
+
+
+def tagged_client_data(client_data, tag):
+    """Return a copy of a person's clientData with its sync tag set to tag"""
+    ret = [i for i in client_data if i.get('key', None) != SYNC_TAG]
+    ret.append({'key': SYNC_TAG, 'value': tag})
+    return ret
+
+
+class Info():
+    """What we keep about each contact (or group) of an account
+
+    There are a lot of these so they are slotted, and the tags are interned
+    as every account has the same ones.  updateTime is the ISO string from the
+    server, it is only turned into something comparable when it's asked for.
+    groups is a tuple of the resource names of the labels a contact is in
+    (other than myContacts), also interned.
+    """
+
+    __slots__ = ('etag', 'tag', 'name', 'updateTime', 'groups')
+
+    def __init__(self, etag, tag, name, updateTime, groups=()):
+        self.etag = etag
+        self.tag = sys.intern(tag) if tag is not None else None
+        self.name = name
+        self.updateTime = updateTime
+        self.groups = groups
+
+    @property
+    def updated(self):
+        """The update time as an iso_key"""
+        return iso_key(self.updateTime)
+
 
 class Contacts():
 
-    def __init__(self, keyfile, credfile, user, verbose):
+    def __init__(self, keyfile, credfile, user, verbose, info=True,
+                 timeout=DEFAULT_TIMEOUT, hedge=0, rate=0, codec=None):
+        """
+        Parameters
+        ----------
+        keyfile: str
+            The OAuth client secrets of the app
+        credfile: str
+            Where the user's token is kept (made if it doesn't exist)
+        user: str
+            The account's email
+        info: bool
+            List the contacts and groups (get_info) now
+        timeout: float
+            Seconds a request may take, None to wait forever
+        hedge: float
+            If not 0, a read taking longer than this percentile of the recent
+            reads is made again, and the first answer used (see execute)
+        rate: float
+            If not 0, the most requests a second to make
+        codec: str
+            The JSON codec requests and responses are encoded with, see
+            jsoncodec.CODECS (the fastest installed if None)
+        """
 
         creds = None
 
@@ -117,10 +280,237 @@ class Contacts():
             with open(credfile, 'wb') as token:
                 pickle.dump(creds, token)
 
-        creds = creds
-        self.service = build('people', 'v1', credentials=creds)
+        self.user = user
+        self.creds = creds
+        self.timeout = timeout
+        self.service = build(
+            'people', 'v1', http=self.new_http(), model=CodecJsonModel(codec)
+        )
+        # the http of each thread other than the main one, see execute
+        self.local = threading.local()
+        self.limiter = RateLimiter(rate) if rate else None
+        # a BodyCache for get, set by whoever wants one
+        self.cache = None
+        self.hedge = hedge
+        # how long the recent reads took, and the threads hedged reads use
+        self.latencies = collections.deque(maxlen=200)
+        self.pool = None
+        if hedge:
+            self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=16)
+
+        self.full = False
+        # the token to scan for changes with, see iter_contacts
+        self.sync_token = None
+        # if set, get_info only gets these people instead of listing
+        # everybody, and the Scope that chose them (see scope.py)
+        self.members = None
+        self.scope = None
+        # maps the rns of the people (and groups) written this run to the
+        # etag the server gave them, see wrote.  The photos are written from
+        # other threads too
+        self.written = {}
+        self.written_groups = {}
+        self.written_lock = threading.Lock()
+        # the same, of the last run, see sync.save_watermarks
+        self.last_written = {}
+        self.last_written_groups = {}
+        # the newest update time of the groups listed
+        self.group_watermark = None
+        if info:
+            self.get_info()
+
+    # what only makes sense while running: the service and http, the threads
+    # and locks, the rate limiter and the BodyCache's database
+    _RUNTIME = ('service', 'local', 'limiter', 'cache', 'pool', 'written_lock')
+
+    def __getstate__(self):
+        """What is pickled (see sync.backup), the data without _RUNTIME
+
+        An unpickled Contacts has no service, it's only good for the info and
+        bodies it had.
+        """
+        return {k: v for k, v in self.__dict__.items() if k not in self._RUNTIME}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.service = None
+        self.local = threading.local()
+        self.limiter = None
+        self.cache = None
+        self.pool = None
+        self.written_lock = threading.Lock()
+
+    def new_http(self):
+        """Return a new authorized http for this account
+
+        The http the service was built with mustn't be shared between threads,
+        anything run in another thread needs to execute(http=new_http()).
+        """
+        return AuthorizedHttp(
+            self.creds, http=httplib2.Http(timeout=self.timeout)
+        )
+
+    def execute(self, req, read=False, cost=1):
+        """Execute a request, in any thread
+
+        Requests made in other threads than the main one go through an http of
+        their thread's own (see new_http).  Every request waits its turn with
+        the rate limiter, if there is one.
+
+        Parameters
+        ----------
+        req: HttpRequest
+            The request
+        read: bool
+            If the request only reads (a get or a page of a listing), so can
+            be made again safely.  A read that times out is retried, and with
+            hedge a slow one is made a second time while it is still going.
+        cost: int
+            How many requests req counts as with the rate limiter, for
+            batches
+        """
+        if not read:
+            return self._execute(req, cost)
+        tts=0.5 #500 ms start -> exponential backoff
+        for attempt in range(TIMEOUT_TRIES):
+            try:
+                if self.hedge:
+                    return self._hedged(req)
+                return self._execute(req)
+            except TimeoutError:
+                if attempt == TIMEOUT_TRIES - 1:
+                    raise
+                sleep(tts)
+                tts*=2
+
+    def _execute(self, req, cost=1):
+        if self.limiter:
+            for i in range(cost):
+                self.limiter.wait()
+        if threading.current_thread() is threading.main_thread():
+            return req.execute()
+        if not hasattr(self.local, 'http'):
+            self.local.http = self.new_http()
+        return req.execute(http=self.local.http)
+
+    def _hedged(self, req):
+        """Execute a read, again if it's slow, returning the first answer
+
+        Until HEDGE_MIN_SAMPLES reads have been timed they are just made.
+        Both requests go through the rate limiter.
+        """
+        def timed(r):
+            start = time.perf_counter()
+            ret = self._execute(r)
+            self.latencies.append(time.perf_counter() - start)
+            return ret
+
+        lat = sorted(self.latencies)
+        if len(lat) < HEDGE_MIN_SAMPLES:
+            return timed(req)
+        after = lat[min(len(lat) - 1, int(len(lat) * self.hedge / 100))]
+
+        first = self.pool.submit(timed, req)
+        done, _ = concurrent.futures.wait([first], timeout=after)
+        if done:
+            return first.result()
+        # the request objects aren't made to be executed twice at once
+        again = copy.copy(req)
+        if hasattr(req, 'headers'):
+            again.headers = dict(req.headers)
+        second = self.pool.submit(timed, again)
+        futures = [first, second]
+        while True:
+            done, futures = concurrent.futures.wait(
+                futures, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            ok = [f for f in done if f.exception() is None]
+            if ok:
+                return ok[0].result()
+            if not futures:
+                # both failed
+                return first.result()
+
+    def batch(self, calls, verbose=False, retry_timeouts=False):
+        """Make requests in multipart batches, MAX_BATCH to an http request
+
+        Parameters
+        ----------
+        calls: list
+            Of (make, done, failed) for each request.  make() returns the
+            request, done(response) is called with its response.  If it
+            fails failed(e) (unless failed is None) is called with the
+            HttpError, and it is made again (with make, so it can use a new
+            etag say) in a later batch.
+        retry_timeouts: bool
+            If the requests can safely be made again after a batch timed out
+            (they are guarded by an etag, and failed gets the new one when
+            it has changed), instead of raising the TimeoutError.  Only
+            TIMEOUT_TRIES times in a row
+
+        Returns
+        -------
+        list:
+            What done returned for each call, in order
+
+        """
+        results = [None] * len(calls)
+        finished = set([])
+        todo = list(range(len(calls)))
+        tts=0.5 #500 ms start -> exponential backoff
+        timeouts = 0
+        while todo:
+            failed = []
+
+            def callback(rid, response, exception):
+                i = int(rid)
+                if exception is None:
+                    results[i] = calls[i][1](response)
+                    finished.add(i)
+                    return
+                if verbose:
+                    print("\n","[ERROR] ", exception)
+                if calls[i][2] is not None:
+                    calls[i][2](exception)
+                failed.append(i)
+
+            for n in range(0, len(todo), MAX_BATCH):
+                chunk = todo[n:n + MAX_BATCH]
+                b = self.service.new_batch_http_request()
+                for i in chunk:
+                    b.add(calls[i][0](), callback=callback, request_id=str(i))
+                try:
+                    self.execute(b, cost=len(chunk))
+                except HttpError as e:
+                    # the whole batch failed
+                    if verbose:
+                        print("\n","[ERROR] ", e)
+                    failed.extend(set(chunk) - finished - set(failed))
+                except TimeoutError:
+                    timeouts += 1
+                    if not retry_timeouts or timeouts == TIMEOUT_TRIES:
+                        raise
+                    failed.extend(set(chunk) - finished - set(failed))
+            todo = sorted(set(failed))
+            if todo:
+                # sleep to avoid 429 HTTP error because rate limit with tts
+                sleep(tts)
+                tts*=2
+        return results
+
+    @staticmethod
+    def photo_url(body):
+        """Return the url of the contact photo in a person body, or None
 
-        self.get_info()
+        Default photos (the coloured letter) and photos from the person's
+        profile don't count, only a photo set on the contact itself.
+        """
+        for photo in body.get('photos', []):
+            source = photo.get('metadata', {}).get('source', {})
+            if photo.get('default') or source.get('type', 'CONTACT') != 'CONTACT':
+                continue
+            return photo['url']
+        return None
 
     def __strip_body(self, body):
         """Return a person body without coverPhotos/photos/metadata
@@ -216,67 +606,291 @@ class Contacts():
 
         return ret
 
-    def get_info(self):
+    def get_info(self, full=None):
         """Store a dict of contact info
 
+        Parameters
+        ----------
+        full: bool
+            If True list every field of the contacts and keep their stripped
+            bodies in self.bodies, so get doesn't need to ask the server.  If
+            None use whatever the last call used.
+
         Returns
         -------
         dict:
-            A dict of dicts tag, etag, updated, name
+            An Info (tag, etag, name, updateTime and groups) for each contact
             {
-                'rn0':
-                    {
-                        'etag': str
-                        'tag': the csync_id (possibly None for newly added)
-                        'updated': datetime,
-                        'name': the display name
-                    },
-                'rn1':
-                    {
-                        'etag': str
-                        'tag': the csync_id (possibly None for newly added)
-                        'updated': datetime,
-                        'name': the display name
-                    },
+                'rn0': Info,
+                'rn1': Info,
                 ...
             }
+            where tag is the csync_id (possibly None for newly added)
         """
 
+        if full is not None:
+            self.full = full
+        fields = all_person_fields if self.full else info_person_fields
+
         self.info = {}
-        for p in self.get_all_contacts():
-            tagls = [
-                kv['value']
-                for kv in p.get('clientData', {})
-                if kv.get('key', None) == SYNC_TAG
-            ]
-            if not ('names' in p or 'organizations' in p):
-                continue
+        # the people without a name we don't sync
+        self.skipped = set([])
+        # the newest updated of the people listed
+        self.watermark = None
+        self.bodies = {}
+        # maps rn to photo_url, for the people we have the full body of
+        self.photo_urls = {}
+        # for scan_changes, only a listing of everybody gets one
+        self.sync_token = None
+        if self.members is not None:
+            people = self.iter_people(self.members, fields)
+        else:
+            people = self.iter_contacts(fields, sync_token=True)
+        for p in people:
+            if self.info_add(p) and self.full:
+                self.keep_body(p)
+
+        self.get_info_groups()
+
+    def relist(self, full=True):
+        """List everybody again, with all their fields if full, see get_info
+
+        The watermark and sync token are kept from the first listing, so the
+        next run still finds the people changed since that listing.
+        """
+        marks = self.watermark, self.group_watermark, self.sync_token
+        self.get_info(full)
+        self.watermark, self.group_watermark, self.sync_token = marks
+
+    def keep_body(self, p):
+        """Keep the body of a person got with all_person_fields, see get"""
+        rn = p['resourceName']
+        self.photo_urls[rn] = self.photo_url(p)
+        self.bodies[rn] = self.__strip_body(p)
+        if self.cache is not None:
+            self.cache.put(
+                self.user, rn, p['etag'], self.bodies[rn], self.photo_urls[rn]
+            )
+
+    def refresh(self, rns):
+        """Get these people again, with all their fields, after writing them
+
+        Their info is replaced (or dropped, if they are gone) and their bodies
+        kept, as a full listing would.  The watermark is left alone, the next
+        run still looks for changes after what was listed first.
+        """
+        rns = set(rns)
+        watermark = self.watermark
+        for p in self.iter_people(sorted(rns), all_person_fields):
+            rns.discard(p['resourceName'])
+            with self.written_lock:
+                if p['resourceName'] in self.written:
+                    self.written[p['resourceName']] = p['etag']
+            if self.info_add(p):
+                self.keep_body(p)
+        for rn in rns:
+            self.forget(rn)
+        self.watermark = watermark
+
+    def info_add(self, p):
+        """Add (or replace) the Info of a listed person
 
-            self.info[p['resourceName']] = {
-                'etag': p['etag'],
-                'tag': tagls[0] if tagls else None,
-                'updated': dateutil.parser.isoparse(
-                    p['metadata']['sources'][0]['updateTime']
-                ),
-                'name': (
-                    p['names'][0]['displayName']
-                    if 'names' in p else p['organizations'][0]['name']
+        Returns
+        -------
+        bool:
+            False if the person has no name, so isn't synced
+        """
+        if not ('names' in p or 'organizations' in p):
+            self.info.pop(p['resourceName'], None)
+            self.skipped.add(p['resourceName'])
+            return False
+        self.skipped.discard(p['resourceName'])
+        tagls = [
+            kv['value']
+            for kv in p.get('clientData', {})
+            if kv.get('key', None) == SYNC_TAG
+        ]
+        info = self.info[p['resourceName']] = Info(
+            p['etag'],
+            tagls[0] if tagls else None,
+            (
+                p['names'][0]['displayName']
+                if 'names' in p else p['organizations'][0]['name']
+            ),
+            p['metadata']['sources'][0]['updateTime'],
+            tuple(
+                sys.intern(m['contactGroupMembership'][
+                    'contactGroupResourceName'
+                ])
+                for m in p.get('memberships', [])
+                if 'contactGroupMembership' in m
+                and m['contactGroupMembership'][
+                    'contactGroupResourceName'
+                ] != 'contactGroups/myContacts'
+            )
+        )
+        if self.watermark is None or info.updated > self.watermark:
+            self.watermark = info.updated
+        return True
+
+    def wrote(self, p):
+        """Keep the etag the server gave a person we just wrote, in written
+
+        So the next run can tell our own writes from changes, see
+        sync.save_watermarks, and refresh knows who was written.  Safe to
+        call from another thread.
+        """
+        if 'resourceName' in p:
+            with self.written_lock:
+                self.written[p['resourceName']] = p.get('etag')
+
+    def wrote_group(self, p):
+        """Keep the etag the server gave a group we just wrote, see wrote"""
+        self.written_groups[p['resourceName']] = p['etag']
+
+    def written_etags(self):
+        """Return written, with the etags the server didn't give got
+
+        Changing the members of a label changes its people's etags, but
+        modify_members isn't told them, so they are read now.
+        """
+        unknown = [rn for rn, etag in self.written.items() if etag is None]
+        for p in self.iter_people(unknown, ('metadata',)):
+            self.written[p['resourceName']] = p['etag']
+        return {rn: etag for rn, etag in self.written.items() if etag}
+
+    def index(self):
+        """Return what scan_changes needs to bring this info up to date later
+
+        A (watermark, info, skipped, sync token) tuple, to be pickled.
+        """
+        return self.watermark, self.info, self.skipped, self.sync_token
+
+    def scan_changes(self, index, slack=300):
+        """Bring the info of a previous run (see index) up to date, cheaply
+
+        Instead of listing everybody, only the people added, modified or
+        deleted since the previous run's listing are listed, with the sync
+        token that listing was given (see iter_contacts).  If there is no
+        token, or the server won't take it any more (they expire after a
+        week), the people are listed most recently modified first instead,
+        stopping at the first one that is older than the index (by more than
+        slack seconds, for people changed while it was being listed).  People
+        deleted since can't be seen that way, so if the number of people
+        doesn't add up nothing is kept and False is returned, get_info must
+        be used instead.
+
+        Parameters
+        ----------
+        index: tuple
+            What index returned at the end of the previous run
+        slack: int
+            Seconds before the index's watermark to keep listing for, when
+            there is no sync token
+
+        Returns
+        -------
+        bool:
+            If the info is now up to date
+
+        """
+        watermark, self.info, self.skipped = index[:3]
+        token = index[3] if len(index) > 3 else None
+        self.watermark = watermark
+        self.full = False
+        self.bodies = {}
+        self.photo_urls = {}
+        self.sync_token = None
+
+        if token is None or not self.scan_token(token):
+            if not self.scan_sorted(slack):
+                self.info = {}
+                return False
+
+        self.get_info_groups()
+        return True
+
+    def scan_token(self, token):
+        """List the changes since token into info, see scan_changes
+
+        Returns False if the token has expired.
+        """
+        next_page_token = ''
+        while next_page_token is not None:
+            try:
+                results = self.execute(
+                    self.service.people().connections().list(
+                        resourceName='people/me',
+                        pageSize=1000,
+                        personFields=','.join(info_person_fields),
+                        syncToken=token,
+                        requestSyncToken=True,
+                        pageToken=next_page_token
+                    ),
+                    read=True,
                 )
-            }
+            except HttpError as e:
+                if e.status_code not in (400, 410):
+                    raise
+                return False
+            next_page_token = results.get('nextPageToken')
+            for p in results.get('connections', []):
+                if p.get('metadata', {}).get('deleted'):
+                    self.info.pop(p['resourceName'], None)
+                    self.skipped.discard(p['resourceName'])
+                else:
+                    self.info_add(p)
+        self.sync_token = results.get('nextSyncToken')
+        return True
+
+    def scan_sorted(self, slack):
+        """List the people modified since the watermark into info, newest
+        first, see scan_changes
 
+        Returns False if people have been deleted since.
+        """
+        if self.watermark is None:
+            return False
+        stop = (
+            datetime.datetime.fromisoformat(self.watermark)
+            - datetime.timedelta(seconds=slack)
+        ).strftime('%Y-%m-%dT%H:%M:%S.%f')
+
+        total = None
+        next_page_token = ''
+        # small pages first, most runs only have a few changes
+        page_size = 50
+        while next_page_token is not None:
+            results = self.execute(self.service.people().connections().list(
+                resourceName='people/me',
+                pageSize=page_size,
+                personFields=','.join(info_person_fields),
+                sortOrder='LAST_MODIFIED_DESCENDING',
+                pageToken=next_page_token
+            ), read=True)
+            if total is None:
+                total = results.get('totalItems', 0)
+            next_page_token = results.get('nextPageToken')
+            page_size = min(1000, page_size * 4)
+            for p in results.get('connections', []):
+                if iso_key(p['metadata']['sources'][0]['updateTime']) <= stop:
+                    next_page_token = None
+                    break
+                self.info_add(p)
+        # somebody deleted (and maybe somebody else added) leaves more people
+        # known than there are
+        return len(self.info) + len(self.skipped) == total
+
+    def get_info_groups(self):
+        """Store the Info of each ContactGroup in info_group"""
         self.info_group = {}
+        self.contactGroups = {}
         for p in self.get_contactGroups():
             
             if p["groupType"] != "USER_CONTACT_GROUP":
                 continue
 
-            tagls = [
-                kv['value']
-                for kv in p.get('clientData', {})
-                if kv.get('key', None) == SYNC_TAG
-            ]
-
-            self.info_group_add(p,tagls)
+            self.info_group_add(p)
             """self.info_group[p['resourceName']] = {
                 'etag': p['etag'],
                 'tag': tagls[0] if tagls else None,
@@ -285,46 +899,128 @@ class Contacts():
                 ),
                 'name': p['name']
             }"""
+        self.group_watermark = max(
+            (v.updated for v in self.info_group.values()), default=None
+        )
 
-    def info_group_add(self,p,tagls=None):
-        """add or update a group into the "global" info_group group"""
+    def info_group_add(self, p, tagls=None):
+        """add or update a group into the "global" info_group group
 
-        self.info_group[p['resourceName']] = {
-                'etag': p['etag'],
-                'tag': tagls[0] if tagls else None,
-                'updated': dateutil.parser.isoparse(
-                    p['metadata']['updateTime']
-                ),
-                'name': p['name']
-        }
+        The group itself is kept in contactGroups, so whatever we last listed
+        or wrote can be read back without asking the server again (the server
+        doesn't always return a freshly written clientData on the next get).
+        If tagls isn't given the tag is taken from the group's clientData.
+        """
+
+        if tagls is None:
+            tagls = [
+                kv['value']
+                for kv in p.get('clientData', {})
+                if kv.get('key', None) == SYNC_TAG
+            ]
 
+        self.contactGroups[p['resourceName']] = p
+        self.info_group[p['resourceName']] = Info(
+            p['etag'],
+            tagls[0] if tagls else None,
+            p['name'],
+            p['metadata']['updateTime']
+        )
 
-    def get_all_contacts(
-        self, fields=['names', 'organizations', 'clientData', 'metadata']
-    ):
+
+    def get_all_contacts(self, fields=info_person_fields):
         """Return a list of all the contacts."""
+        return list(self.iter_contacts(fields))
+
+    def iter_contacts(self, fields=info_person_fields, sync_token=False):
+        """Yield all the contacts, getting them a page (1000) at a time
+
+        Only the page being worked through is kept in memory.  With
+        sync_token, once they have all been yielded sync_token is set to the
+        token to list the changes since with (see scan_changes).
+        """
 
         # Keep getting 1000 connections until the nextPageToken becomes None
-        connections_list = []
         next_page_token = ''
         while True:
             if not (next_page_token is None):
                 # Call the People API
-                results = self.service.people().connections().list(
+                opts = {'requestSyncToken': True} if sync_token else {}
+                results = self.execute(self.service.people().connections().list(
                         resourceName='people/me',
                         pageSize=1000,
                         personFields=','.join(fields),
-                        pageToken=next_page_token
-                        ).execute()
-                connections_list += results.get('connections', [])
+                        pageToken=next_page_token,
+                        **opts
+                        ), read=True)
+                yield from results.get('connections', [])
                 next_page_token = results.get('nextPageToken')
+                if sync_token and next_page_token is None:
+                    self.sync_token = results.get('nextSyncToken')
             else:
                 break
-        return connections_list
+
+    def iter_people(self, rns, fields=info_person_fields):
+        """Yield the people rns, getting them MAX_BATCH_GET at a time
+
+        Those that don't exist (any more) are left out.
+        """
+        rns = list(rns)
+        for i in range(0, len(rns), MAX_BATCH_GET):
+            tts=0.5 #500 ms start -> exponential backoff
+            while True:
+                try:
+                    results = self.execute(self.service.people().getBatchGet(
+                        resourceNames=rns[i:i + MAX_BATCH_GET],
+                        personFields=','.join(fields)
+                    ), read=True)
+                    break
+                except HttpError:
+                    # sleep to avoid 429 HTTP error because rate limit with tts
+                    sleep(tts)
+                    tts*=2
+            for r in results.get('responses', []):
+                if 'person' in r:
+                    yield r['person']
+
+    def group_members(self, grns):
+        """Return the resource names of the people in the ContactGroups grns"""
+        members = set([])
+        for grn in grns:
+            tts=0.5 #500 ms start -> exponential backoff
+            while True:
+                try:
+                    g = self.execute(self.service.contactGroups().get(
+                        resourceName=grn,
+                        maxMembers=MAX_GROUP_MEMBERS,
+                        groupFields='name'
+                    ), read=True)
+                    break
+                except HttpError:
+                    sleep(tts)
+                    tts*=2
+            members.update(g.get('memberResourceNames', []))
+        return members
+
+    def fetch_fraction(self, last):
+        """Return the fraction of contacts that are new or updated after last
+
+        These are the people whose full body a sync will need, those our last
+        run wrote (see last_written) don't count.  last is an iso_key.
+        """
+        if not self.info:
+            return 0
+        n = sum(
+            1 for rn, v in self.info.items()
+            if v.tag is None or (
+                v.updated > last and self.last_written.get(rn) != v.etag
+            )
+        )
+        return n / len(self.info)
 
     def tag_to_rn(self, tag):
         """Return the resourceName for this tag, or None"""
-        rn = [rn for rn, v in self.info.items() if v['tag'] == tag]         #TODO: once did not find the tag - the next day he found it!!!! WTF?!
+        rn = [rn for rn, v in self.info.items() if v.tag == tag]         #TODO: once did not find the tag - the next day he found it!!!! WTF?!
         if not rn:
             return None
         assert(len(rn) == 1)
@@ -335,7 +1031,7 @@ class Contacts():
         rn = [
             rn
             for rn, v in self.info.items()
-            if v['name'].lower() == name.lower()
+            if v.name.lower() == name.lower()
         ]
         if not rn:
             return None
@@ -357,18 +1053,49 @@ class Contacts():
             return
 
         if verbose:
-            print(f"{self.info[rn]['name']} ", end='')
+            print(f"{self.info[rn].name} ", end='')
+        self.delete_rn(rn)
+        self.forget(rn)
 
+    def delete_rn(self, rn):
+        """Delete the person with resource name rn, see also forget"""
         tts=0.5 #500 ms start -> exponential backoff
         while True:
             try:
-                self.service.people().deleteContact(resourceName=rn).execute()
+                self.execute(
+                    self.service.people().deleteContact(resourceName=rn)
+                )
                 return
             except HttpError:
                 # sleep to avoid 429 HTTP error because rate limit with tts
                 sleep(tts)
                 tts*=2
 
+    def delete_rns(self, rns):
+        """Delete the people with these resource names, see also forget
+
+        MAX_BATCH_DELETE of them per request.
+        """
+        rns = list(rns)
+        for i in range(0, len(rns), MAX_BATCH_DELETE):
+            tts=0.5 #500 ms start -> exponential backoff
+            while True:
+                try:
+                    self.execute(self.service.people().batchDeleteContacts(
+                        body={'resourceNames': rns[i:i + MAX_BATCH_DELETE]}
+                    ))
+                    break
+                except HttpError:
+                    # sleep to avoid 429 HTTP error because rate limit with tts
+                    sleep(tts)
+                    tts*=2
+
+    def forget(self, rn):
+        """Drop a (deleted) person from what we know of the account"""
+        self.info.pop(rn, None)
+        self.bodies.pop(rn, None)
+        self.photo_urls.pop(rn, None)
+
 
     def update_tag(self, rn: str, tag: str):
         """Update the tag for a contact
@@ -384,29 +1111,44 @@ class Contacts():
         """
 
         tts=0.5 #500 ms start -> exponential backoff
+        timeouts = 0
         while True:
-            # get the current clientData
             try:
-                p = self.service.people().get(
-                    resourceName=rn,
-                    personFields='clientData'
-                ).execute()
-
-                # the clientData without the tag dict
-                wout = [
-                    i
-                    for i in p.get('clientData', [])
-                    if i.get('key', None) != SYNC_TAG
-                ]
-                wout.append({'key': SYNC_TAG, 'value': tag})
+                if timeouts:
+                    self.refresh_etag(rn)
+                # the other clientData must be kept, if we listed the body we
+                # already have it
+                if rn in self.bodies:
+                    client_data = self.bodies[rn].get('clientData', [])
+                else:
+                    client_data = self.execute(self.service.people().get(
+                        resourceName=rn,
+                        personFields='clientData'
+                    )).get('clientData', [])
+                wout = tagged_client_data(client_data, tag)
 
-                self.service.people().updateContact(
+                p = self.execute(self.service.people().updateContact(
                     resourceName=rn,
                     updatePersonFields='clientData',
-                    body={'etag': self.info[rn]['etag'], 'clientData': wout}
-                ).execute()
+                    body={'etag': self.info[rn].etag, 'clientData': wout}
+                ))
+                self.info[rn].etag = p['etag']
+                self.info[rn].tag = sys.intern(tag)
+                self.wrote(p)
+                if rn in self.bodies:
+                    self.bodies[rn]['clientData'] = wout
                 return
-            except HttpError:
+            except TimeoutError:
+                # it may have been made, so the etag is got again first
+                timeouts += 1
+                if timeouts == TIMEOUT_TRIES:
+                    raise
+                sleep(tts)
+                tts*=2
+            except HttpError as e:
+                if e.status_code in (404, 410):
+                    # deleted since it was listed, the next run sees that
+                    return
                 # sleep to avoid 429 HTTP error because rate limit with tts
                 sleep(tts)
                 tts*=2
@@ -424,57 +1166,297 @@ class Contacts():
         while True:
             # get the current clientData
             try:
-                new_contact = self.service.people().createContact(
-                    body=body
-                ).execute()
+                new_contact = self.execute(
+                    self.service.people().createContact(body=body)
+                )
+                self.wrote(new_contact)
                 return new_contact
             except HttpError:
                 # sleep to avoid 429 HTTP error because rate limit with tts
                 sleep(tts)
                 tts*=2
 
-    def update(self, tag: str, body: dict, verbose=False):
-        rn = self.tag_to_rn(tag)
+    def add_many(self, bodies, verbose=False):
+        """Add a person for each body, MAX_BATCH_CREATE per request
 
-        if rn is not None:
+        Parameters
+        ----------
+        bodies: list
+            Of bodies like add takes
+
+        Returns
+        -------
+        list:
+            The people made (their resourceName, etag, clientData and
+            metadata), in the order of bodies
+
+        """
+        made = []
+        for i in range(0, len(bodies), MAX_BATCH_CREATE):
+            body = {
+                'contacts': [
+                    {'contactPerson': b}
+                    for b in bodies[i:i + MAX_BATCH_CREATE]
+                ],
+                'readMask': 'clientData,metadata',
+            }
             tts=0.5 #500 ms start -> exponential backoff
             while True:
                 try:
-                    body.update({'etag': self.info[rn]['etag']})
-                    self.service.people().updateContact(
-                        resourceName=rn,
-                        updatePersonFields=','.join(all_update_person_fields),
-                        body=body
-                    ).execute()
-                    return
+                    r = self.execute(
+                        self.service.people().batchCreateContacts(body=body)
+                    )
+                    break
                 except HttpError as e:
-                    # sleep to avoid 429 HTTP error because rate limit with tts
                     if verbose:
                         print("\n","[ERROR] ", e)
+                    # sleep to avoid 429 HTTP error because rate limit with tts
                     sleep(tts)
                     tts*=2
+            made += [c['person'] for c in r.get('createdPeople', [])]
+        for p in made:
+            self.wrote(p)
+        return made
+
+    def update(self, tag: str, body: dict, verbose=False,
+               fields=all_update_person_fields):
+        """Update the person with this tag to body
+
+        Parameters
+        ----------
+        tag: str
+            The sync tag of the person
+        body: dict
+            The person's new fields
+        fields: list
+            The personFields to update, those missing from body are cleared
+
+        """
+        rn = self.tag_to_rn(tag)
+
+        if rn is not None:
+            self.update_rn(rn, body, verbose, fields)
+
+    def update_rn(self, rn: str, body: dict, verbose=False,
+                  fields=all_update_person_fields):
+        """Update the person with resource name rn to body
+
+        Like update, but for a person we know the resource name of (who may
+        not have a tag yet, body's clientData can give them one).
+        """
+        tts=0.5 #500 ms start -> exponential backoff
+        timeouts = 0
+        while True:
+            try:
+                if timeouts:
+                    self.refresh_etag(rn)
+                # body may be going to other accounts' workers too, so it
+                # mustn't get this account's etag
+                p = self.execute(self.service.people().updateContact(
+                    resourceName=rn,
+                    updatePersonFields=','.join(fields),
+                    body=dict(body, etag=self.info[rn].etag)
+                ))
+                self.info[rn].etag = p['etag']
+                self.wrote(p)
+                return
+            except TimeoutError:
+                # it may have been made, so the etag is got again first
+                timeouts += 1
+                if timeouts == TIMEOUT_TRIES:
+                    raise
+                sleep(tts)
+                tts*=2
+            except HttpError as e:
+                if verbose:
+                    print("\n","[ERROR] ", e)
+                if e.status_code in (404, 410):
+                    # deleted since it was listed, the next run sees that
+                    return
+                # sleep to avoid 429 HTTP error because rate limit with tts
+                sleep(tts)
+                tts*=2
+
+    def refresh_etag(self, rn):
+        """Get the etag of rn again, after a write that timed out
+
+        The write may have been made, then the etag we had is out of date.
+        """
+        p = self.execute(self.service.people().get(
+            resourceName=rn,
+            personFields='metadata'
+        ), read=True)
+        self.info[rn].etag = p['etag']
 
     def get(self, rn, verbose=False):
-        """Return a person body, stripped of resourceName/etag etc"""
+        """Return a person body, stripped of resourceName/etag etc
+
+        From the full listing if there was one, else from the cache if the
+        person's etag hasn't changed since it was cached.
+        """
+        if rn in self.bodies:
+            # from a full listing, callers may replace fields of the copy
+            return dict(self.bodies[rn])
+        if self.cache is not None and rn in self.info:
+            hit = self.cache.get(self.user, rn, self.info[rn].etag)
+            if hit is not None:
+                body, self.photo_urls[rn] = hit
+                return body
+
         tts=0.5 #500 ms start -> exponential backoff
         while True:
             try:
-                p = self.service.people().get(
+                p = self.execute(self.service.people().get(
                     resourceName=rn,
                     personFields=','.join(all_person_fields)
-                ).execute()
-                return self.__strip_body(p)
+                ), read=True)
+                self.photo_urls[rn] = self.photo_url(p)
+                body = self.__strip_body(p)
+                if self.cache is not None:
+                    self.cache.put(
+                        self.user, rn, p['etag'], body, self.photo_urls[rn]
+                    )
+                return body
             except HttpError as e:
                 if verbose:
                     print("\n","[ERROR] ", e)
                 sleep(tts)
                 tts*=2
 
+    def update_photo(self, rn, data, verbose=False):
+        """Set the photo of a contact
+
+        Safe to call from another thread.
+
+        Parameters
+        ----------
+        rn: str
+            The resource name of the person
+        data: bytes
+            The image
+
+        Returns
+        -------
+        str:
+            The url of the contact's new photo, or None if it couldn't be set
+        """
+        tts=0.5 #500 ms start -> exponential backoff
+        timeouts = 0
+        while True:
+            try:
+                p = self.execute(self.service.people().updateContactPhoto(
+                    resourceName=rn,
+                    body={
+                        'photoBytes': base64.b64encode(data).decode(),
+                        'personFields': 'photos,metadata'
+                    }
+                ))
+                self.wrote(p.get('person', {}))
+                return self.photo_url(p.get('person', {}))
+            except TimeoutError:
+                # setting the photo again does no harm
+                timeouts += 1
+                if timeouts == TIMEOUT_TRIES:
+                    raise
+                sleep(tts)
+                tts*=2
+            except HttpError as e:
+                if verbose:
+                    print("\n","[ERROR] ", e)
+                if e.status_code != 429 and e.status_code < 500:
+                    # not going to get any better by trying again
+                    return
+                sleep(tts)
+                tts*=2
+
+    def delete_photo(self, rn, verbose=False):
+        """Remove the photo of a contact, safe to call from another thread"""
+        tts=0.5 #500 ms start -> exponential backoff
+        timeouts = 0
+        while True:
+            try:
+                p = self.execute(self.service.people().deleteContactPhoto(
+                    resourceName=rn,
+                    personFields='metadata'
+                ))
+                self.wrote(p.get('person', {}))
+                return
+            except TimeoutError:
+                # removing the photo again does no harm
+                timeouts += 1
+                if timeouts == TIMEOUT_TRIES:
+                    raise
+                sleep(tts)
+                tts*=2
+            except HttpError as e:
+                if verbose:
+                    print("\n","[ERROR] ", e)
+                if e.status_code != 429 and e.status_code < 500:
+                    # not going to get any better by trying again
+                    return
+                sleep(tts)
+                tts*=2
+
+    def modify_members(self, rn, add=(), remove=(), verbose=False):
+        """Add people to and remove people from a ContactGroup
+
+        Parameters
+        ----------
+        rn: str
+            The resource name of the ContactGroup
+        add: list
+            Resource names of the people to add to it
+        remove: list
+            Resource names of the people to remove from it
+
+        Returns
+        -------
+        int:
+            The number of requests it took (MAX_MEMBERS of each per request)
+
+        """
+        add, remove = list(add), list(remove)
+        nreq = 0
+        for i in range(0, max(len(add), len(remove)), MAX_MEMBERS):
+            body = {}
+            if add[i:i + MAX_MEMBERS]:
+                body['resourceNamesToAdd'] = add[i:i + MAX_MEMBERS]
+            if remove[i:i + MAX_MEMBERS]:
+                body['resourceNamesToRemove'] = remove[i:i + MAX_MEMBERS]
+
+            tts=0.5 #500 ms start -> exponential backoff
+            timeouts = 0
+            while True:
+                try:
+                    self.execute(self.service.contactGroups().members().modify(
+                        resourceName=rn,
+                        body=body
+                    ))
+                    break
+                except TimeoutError:
+                    # adding or removing members again does no harm
+                    timeouts += 1
+                    if timeouts == TIMEOUT_TRIES:
+                        raise
+                    sleep(tts)
+                    tts*=2
+                except HttpError as e:
+                    if verbose:
+                        print("\n","[ERROR] ", e)
+                    # sleep to avoid 429 HTTP error because rate limit with tts
+                    sleep(tts)
+                    tts*=2
+            nreq += 1
+        # their memberships (and etags) have changed, to etags we aren't told
+        with self.written_lock:
+            self.written.update(dict.fromkeys(add + remove))
+        return nreq
+
     def rn_to_tag_contactGroup(self, rn):
         """Return the resourceName for this tag, or None"""
 
         tag = [
-            v['tag']
+            v.tag
             for rn_loc, v in self.info_group.items() if rn_loc == rn
         ]
         if not tag:
@@ -484,36 +1466,40 @@ class Contacts():
 
     def tag_to_rn_contactGroup(self, tag):
         """Return the resourceName for this tag, or None"""
-        rn = [rn for rn, v in self.info_group.items() if v['tag'] == tag]
+        rn = [rn for rn, v in self.info_group.items() if v.tag == tag]
         if not rn:
             return None
         assert(len(rn) == 1)
         return rn[0]
 
     def add_contactGroup(self, body, verbose=False):
-        """Add a person with this body
+        """Add a ContactGroup with this body, see add_contactGroups"""
+        return self.add_contactGroups([body], verbose)[0]
+
+    def add_contactGroups(self, bodies, verbose=False):
+        """Add a ContactGroup for each body, in batches
 
         Parameters
         ----------
-        body: dict
+        bodies: list
+            Of {"contactGroup": {"name": ..., "clientData": ...}}
 
+        Returns
+        -------
+        list:
+            The new groups
 
         """
+        def make(body):
+            body["readGroupFields"] = "clientData,groupType,metadata,name"
+            return lambda: self.service.contactGroups().create(body=body)
 
-        tts=0.5 #500 ms start -> exponential backoff
-        while True:
-            try:
-                body["readGroupFields"] = "clientData,groupType,metadata,name"
-                new_contact = self.service.contactGroups().create(
-                    body=body
-                ).execute()
-                return new_contact
-            except HttpError as e:
-                if verbose:
-                    print("\n","[ERROR] ", e)
-                sleep(tts)
-                tts*=2
+        def done(p):
+            self.info_group_add(p)
+            self.wrote_group(p)
+            return p
 
+        return self.batch([(make(b), done, None) for b in bodies], verbose)
 
     def get_contactGroups(self, verbose=False):
         """Return a list of all the ContactGroup."""
@@ -528,11 +1514,11 @@ class Contacts():
                 while True:
                     try:
                         # Call the People API
-                        results = self.service.contactGroups().list(
+                        results = self.execute(self.service.contactGroups().list(
                             pageSize=1000,
                             pageToken=next_page_token,
                             groupFields="clientData,name,metadata,groupType"
-                        ).execute()
+                        ), read=True)
                         break
                     except HttpError as e:
                         if verbose:
@@ -551,10 +1537,10 @@ class Contacts():
         tts=0.5 #500 ms start -> exponential backoff
         while True:
             try:
-                p = self.service.contactGroups().get(
+                p = self.execute(self.service.contactGroups().get(
                     resourceName=rn,
                     groupFields="clientData,groupType,metadata,name"
-                ).execute()
+                ), read=True)
                 return p
             except HttpError as e:
                 if verbose:
@@ -562,118 +1548,130 @@ class Contacts():
                 sleep(tts)
                 tts*=2
 
-    def get_contactGroup_wait_SYNC_TAG(self, rn, verbose=False):
-        """
-        continues requesting a contact Group until the SYNC_TAG is found
-        ( sometimes, just after updating the clientData with the SYNC_TAG inside, the stored SYNC_TAG is not returned at subsequent get_contactGroups)
-        """
-        cont=None
-        tts=0.5 #500 ms start -> exponential backoff
-        while True:
-                cont = self.get_contactGroup(rn)
-                if "clientData" in cont: 
-                    k = [i for i in cont["clientData"] if "key" in i and i["key"]==SYNC_TAG]
-                    if len(k)>0:
-                        break
-                else:
-                    if verbose:
-                        print("\n","[ERROR] ", "SYNC_TAG missing")
-                    sleep(tts)
-                    tts*=2
-        return cont
-    
-
     def update_contactGroup_tag(self, rn: str, tag: str):
-        """Update the tag for a contact
+        """Update the tag for a contact, see update_contactGroup_tags"""
+        return self.update_contactGroup_tags([(rn, tag)])[0]
+
+    def update_contactGroup_tags(self, rntags, verbose=True):
+        """Give ContactGroups their tags, in batches
 
         Parameters
         ---------
-        rn: str
-            The resource name of ContactGroup to add tag to
+        rntags: list
+            Of (rn, tag), the resource name of a ContactGroup and the tag to
+            give it.  No check on uniques is made, but it better be
 
-        tag: str
-            The tag to add.  No check on uniques is made, but it better be
+        Returns
+        -------
+        list:
+            The groups as returned by the updates, with the new clientData
 
         """
-        # get the current clientData
-        tts=0.5 #500 ms start -> exponential backoff
-        while True:
-            try:
-                p = self.service.contactGroups().get(
-                    resourceName=rn,
-                    groupFields='clientData'
-                ).execute()
-
+        def make(rn, tag):
+            def req():
                 # the clientData without the tag dict
                 wout = [
                     i
-                    for i in p.get('clientData', [])
+                    for i in self.contactGroups[rn].get('clientData', [])
                     if i.get('key', None) != SYNC_TAG
                 ]
                 wout.append({'key': SYNC_TAG, 'value': tag})
-
-                self.service.contactGroups().update(
+                return self.service.contactGroups().update(
                     resourceName=rn,
                     body={
                         "contactGroup": {
-                            'etag': self.info_group[rn]['etag'],
+                            'etag': self.info_group[rn].etag,
                             'clientData': wout
                         },
                         "updateGroupFields": "clientData",
                         "readGroupFields": "clientData,groupType,metadata,name"
                     }
-                ).execute()
-                return
-            except HttpError as e:
-                if e.status_code==409 and "Contact group etag is outdated" in e.reason: #etag "expired" ( or someone has changed something)
-                    #re-get the group
-                    p = self.get_contactGroup(rn)
-                    self.info_group_add(p,None)             #TODO: check if is correct to insert the tag...?  None <-> tag
+                )
+            return req
+
+        def done(p):
+            self.info_group_add(p)
+            self.wrote_group(p)
+            return p
+
+        return self.batch(
+            [(make(rn, tag), done, self.outdated_group(rn)) for rn, tag in rntags],
+            verbose, retry_timeouts=True
+        )
+
+    def outdated_group(self, rn):
+        """Return a batch failed handler getting the group again if its etag is outdated"""
+        def outdated(e):
+            if e.status_code==409 and "Contact group etag is outdated" in e.reason: #etag "expired" ( or someone has changed something)
+                #re-get the group
+                self.info_group_add(self.get_contactGroup(rn))
+        return outdated
 
+    def update_contactGroup(self, tag: str, body: dict):
+        """Rename the ContactGroup with this tag, see update_contactGroups"""
+        return self.update_contactGroups([(tag, body)])[0]
 
-                print("\n","[ERROR] ", e)
-                sleep(tts)
-                tts*=2
+    def update_contactGroups(self, tagbodies, verbose=True):
+        """Rename ContactGroups, in batches
 
-    def update_contactGroup(self, tag: str, body: dict):
-        rn = self.tag_to_rn_contactGroup(tag)
+        Parameters
+        ----------
+        tagbodies: list
+            Of (tag, body), the tag of a ContactGroup and a group with its
+            new name.  Tags this account doesn't have are skipped
 
-        if rn is not None:
-            tts=0.5 #500 ms start -> exponential backoff
-            while True:
-                try:
-                    self.service.contactGroups().update(
-                        resourceName=rn,
-                        body={
-                            "contactGroup": {
-                                'etag': self.info_group[rn]['etag'],
-                                'name': body["name"]
-                            },
-                            "readGroupFields": "clientData,groupType,metadata,name"
-                        }
-                    ).execute()
-                    return
-                except HttpError as e:
-                    print("\n","[ERROR] ", e)
-                    sleep(tts)
-                    tts*=2
+        Returns
+        -------
+        list:
+            The groups as returned by the updates, None for those skipped
+
+        """
+        def make(rn, body):
+            return lambda: self.service.contactGroups().update(
+                resourceName=rn,
+                body={
+                    "contactGroup": {
+                        'etag': self.info_group[rn].etag,
+                        'name': body["name"]
+                    },
+                    "readGroupFields": "clientData,groupType,metadata,name"
+                }
+            )
+
+        def done(p):
+            self.info_group_add(p)
+            self.wrote_group(p)
+            return p
+
+        rns = [self.tag_to_rn_contactGroup(tag) for tag, body in tagbodies]
+        made = iter(self.batch([
+            (make(rn, body), done, self.outdated_group(rn))
+            for rn, (tag, body) in zip(rns, tagbodies) if rn is not None
+        ], verbose, retry_timeouts=True))
+        return [None if rn is None else next(made) for rn in rns]
 
     def delete_contactGroup(self, tag: str):
-        # need to find the resource name
-        rn = self.tag_to_rn_contactGroup(tag)
-        if rn is None:
-            return
+        """Delete the ContactGroup with this tag, see delete_contactGroups"""
+        self.delete_contactGroups([tag])
 
-        # print(f"{self.info_group[rn]['name']} ", end='')
+    def delete_contactGroups(self, tags, verbose=True):
+        """Delete the ContactGroups with these tags (not their people)
 
-        tts=0.5 #500 ms start -> exponential backoff
-        while True:
-            try:
-                self.service.contactGroups().delete(
-                    resourceName=rn, deleteContacts=False
-                ).execute()
-                return
-            except HttpError as e:
-                print("\n","[ERROR] ", e)
-                sleep(tts)
-                tts*=2
+        In batches, tags this account doesn't have are skipped.
+        """
+        def make(rn):
+            return lambda: self.service.contactGroups().delete(
+                resourceName=rn, deleteContacts=False
+            )
+
+        def done(rn):
+            def forget(response):
+                del self.info_group[rn]
+                del self.contactGroups[rn]
+            return forget
+
+        rns = [self.tag_to_rn_contactGroup(tag) for tag in tags]
+        self.batch(
+            [(make(rn), done(rn), None) for rn in rns if rn is not None],
+            verbose
+        )
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""Find the people that look like duplicates within an account
+
+People are put in blocks by their normalised name, emails and phone numbers,
+and everybody sharing a block ends up in the same cluster (a union-find), so
+this is linear in the number of people.
+
+    python dupes.py                    # report the clusters of every account
+    python dupes.py --account me@gmail.com -o dupes.txt
+"""
+
+import re
+import sys
+import argparse
+import unicodedata
+
+from contacts import Contacts, SYNC_TAG
+
+
+# the personFields needed to find duplicates
+DUPE_FIELDS = [
+    'names', 'organizations', 'emailAddresses', 'phoneNumbers', 'clientData',
+    'metadata',
+]
+
+# phone numbers are compared by this many of their last digits, so the same
+# number with and without its country code is a match
+PHONE_DIGITS = 9
+
+
+def norm_name(name):
+    """Return name lowercased, without accents or punctuation, words sorted
+
+    So 'Smith, José' and 'jose smith' are the same.
+    """
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c)).lower()
+    return ' '.join(sorted(re.findall(r'\w+', name)))
+
+
+def norm_email(email):
+    """Return email lowercased, gmail addresses without dots and +suffixes"""
+    email = email.strip().lower()
+    user, _, domain = email.partition('@')
+    if domain in ('gmail.com', 'googlemail.com'):
+        user = user.split('+')[0].replace('.', '')
+        domain = 'gmail.com'
+    return f'{user}@{domain}'
+
+
+def norm_phone(phone):
+    """Return the last PHONE_DIGITS digits of phone, None if it's too short"""
+    digits = re.sub(r'\D', '', phone)
+    if len(digits) < 7:
+        return None
+    return digits[-PHONE_DIGITS:]
+
+
+def block_keys(p):
+    """Return the blocking keys of a person body
+
+    Returns
+    -------
+    set:
+        Of ('name', ...), ('email', ...) and ('phone', ...) tuples
+    """
+    keys = set([])
+    for n in p.get('names', [])[:1]:
+        name = norm_name(n.get('displayName', ''))
+        if name:
+            keys.add(('name', name))
+    for e in p.get('emailAddresses', []):
+        if e.get('value'):
+            keys.add(('email', norm_email(e['value'])))
+    for t in p.get('phoneNumbers', []):
+        phone = norm_phone(t.get('canonicalForm') or t.get('value', ''))
+        if phone:
+            keys.add(('phone', phone))
+    return keys
+
+
+class Clusters():
+    """Union-find of the people of an account, joined by shared block keys"""
+
+    def __init__(self):
+        # maps rn to its parent rn, roots are their own parent
+        self.parent = {}
+        # maps each block key to the first rn that had it
+        self.blocks = {}
+        # maps rn to the keys it shared with somebody before it
+        self.reasons = {}
+
+    def find(self, rn):
+        root = rn
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # path compression
+        while self.parent[rn] != root:
+            self.parent[rn], rn = root, self.parent[rn]
+        return root
+
+    def add(self, rn, keys):
+        """Add a person and join them to everybody they share a key with"""
+        self.parent.setdefault(rn, rn)
+        for k in keys:
+            first = self.blocks.setdefault(k, rn)
+            if first == rn:
+                continue
+            self.reasons.setdefault(rn, set([])).add(k)
+            a, b = self.find(first), self.find(rn)
+            if a != b:
+                self.parent[b] = a
+
+    def clusters(self):
+        """Return the clusters of more than one person, as lists of rns"""
+        groups = {}
+        for rn in self.parent:
+            groups.setdefault(self.find(rn), []).append(rn)
+        return [g for g in groups.values() if len(g) > 1]
+
+
+def find_duplicates(people):
+    """Return the duplicate clusters of an account
+
+    Parameters
+    ----------
+    people: iterable
+        Of person bodies with (at least) the DUPE_FIELDS, they are not kept
+        so this can be a listing generator
+
+    Returns
+    -------
+    (list, dict, Clusters):
+        The clusters (lists of rns), a dict mapping their rns to
+        (name, tag) and the Clusters (for its reasons)
+
+    """
+    c = Clusters()
+    about = {}
+    for p in people:
+        keys = block_keys(p)
+        if not keys:
+            continue
+        rn = p['resourceName']
+        c.add(rn, keys)
+        tag = [
+            kv['value'] for kv in p.get('clientData', [])
+            if kv.get('key') == SYNC_TAG
+        ]
+        name = (
+            p['names'][0].get('displayName', '') if 'names' in p
+            else p.get('organizations', [{}])[0].get('name', '')
+        )
+        about[rn] = (name, tag[0] if tag else None)
+    clusters = c.clusters()
+    inclusters = set(rn for g in clusters for rn in g)
+    return clusters, {rn: about[rn] for rn in inclusters}, c
+
+
+def held_back(acc, new):
+    """Return those of the new (untagged) people of acc that look duplicated
+
+    Parameters
+    ----------
+    acc: Contacts
+        The account, it is listed again with DUPE_FIELDS
+    new: list
+        Resource names of the people about to be replicated
+
+    Returns
+    -------
+    set:
+        The rns in new that share a name, email or phone with somebody else
+        in the account
+    """
+    clusters, _, _ = find_duplicates(acc.iter_contacts(DUPE_FIELDS))
+    new = set(new)
+    return set(rn for g in clusters for rn in g if rn in new)
+
+
+def report(email, clusters, about, c, out):
+    """Write the duplicate clusters of an account, biggest first"""
+    out.write(f'# {email}: {len(clusters)} cluster(s) of duplicates\n')
+    for g in sorted(clusters, key=len, reverse=True):
+        keys = set([])
+        for rn in g:
+            keys |= c.reasons.get(rn, set([]))
+        out.write(
+            f"\n{len(g)} people sharing "
+            f"{', '.join(sorted(f'{k}={v}' for k, v in keys))}\n"
+        )
+        for rn in sorted(g):
+            name, tag = about[rn]
+            out.write(f"    {rn}  {name}  {tag or '(not synced yet)'}\n")
+    out.write('\n')
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    p.add_argument('--account', action='append',
+                   help='Only look in this account (email), can be given '
+                   'more than once')
+    p.add_argument('-o', '--output', default='-',
+                   help='File to write the report to, - for stdout')
+    p.add_argument('-v', '--verbose', action='store_true',
+                   help='Verbose output')
+    # sync's print looks at args.file, the log file isn't used here
+    p.set_defaults(file=False)
+    args = p.parse_args()
+
+    # sync imports this module, so only import it when run
+    import sync
+    sync.args = args
+    cp = sync.load_config(sync.config_dir() / 'config.ini')
+    sections = [
+        s for s in sync.account_sections(cp)
+        if not args.account or cp[s]['user'] in args.account
+    ]
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    total = 0
+    for s in sections:
+        acc = Contacts(cp[s]['keyfile'], cp[s]['credfile'], cp[s]['user'],
+                       args.verbose, info=False,
+                       **sync.request_options(cp[s]))
+        clusters, about, c = find_duplicates(acc.iter_contacts(DUPE_FIELDS))
+        report(acc.user, clusters, about, c, out)
+        total += len(clusters)
+    if out is not sys.stdout:
+        out.close()
+    sys.exit(1 if total else 0)
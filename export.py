@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""Export the contacts of all the accounts as one vCard or CSV file
+
+Contacts are keyed by their sync tag (csync-uid), a person synced to several
+accounts is written once, as the first account in the config has them.
+Contacts without a tag yet are written as they are in each account.
+
+The contacts are listed a page at a time and written as they come, only the
+tags already written are kept in memory.
+
+    python export.py -o contacts.vcf.gz
+    python export.py --format csv --ring work > work.csv
+"""
+
+import io
+import sys
+import csv
+import gzip
+import argparse
+
+import sync
+from contacts import Contacts, SYNC_TAG, all_person_fields
+
+
+# the fields exported, photos are just their url
+EXPORT_FIELDS = [
+    f for f in all_person_fields if f not in ('coverPhotos', 'metadata')
+]
+
+CSV_COLUMNS = [
+    'uid', 'name', 'given', 'family', 'nickname', 'emails', 'phones',
+    'organization', 'title', 'addresses', 'birthday', 'urls', 'notes',
+    'labels', 'photo', 'account',
+]
+
+
+def sync_tag(p):
+    """Return the sync tag of a person body, or None"""
+    for kv in p.get('clientData', []):
+        if kv.get('key', None) == SYNC_TAG:
+            return kv['value']
+    return None
+
+
+def iter_people(accounts):
+    """Yield (uid, account email, person, label names) of every contact
+
+    Parameters
+    ----------
+    accounts: list
+        Of Contacts (made with info=False), in the order they take precedence
+
+    """
+    seen = set([])
+    for acc in accounts:
+        # maps rn to name of the account's labels
+        labels = {
+            g['resourceName']: g['name']
+            for g in acc.get_contactGroups()
+            if g['groupType'] == 'USER_CONTACT_GROUP'
+        }
+        for p in acc.iter_contacts(EXPORT_FIELDS):
+            tag = sync_tag(p)
+            if tag is not None:
+                if tag in seen:
+                    continue
+                seen.add(sys.intern(tag))
+                uid = tag
+            else:
+                uid = f"{acc.user}/{p['resourceName']}"
+            names = [
+                labels[m['contactGroupMembership']['contactGroupResourceName']]
+                for m in p.get('memberships', [])
+                if m.get('contactGroupMembership', {}).get(
+                    'contactGroupResourceName'
+                ) in labels
+            ]
+            yield uid, acc.user, p, names
+
+
+def _first(p, field, key, default=''):
+    """Return key of the first entry of field in p"""
+    for i in p.get(field, []):
+        if key in i:
+            return i[key]
+    return default
+
+
+def _birthday(p, sep='-'):
+    """Return the first birthday as YYYY-MM-DD (--MM-DD with no year), or ''
+
+    sep goes between the year, month and day.
+    """
+    for b in p.get('birthdays', []):
+        d = b.get('date')
+        if d and 'month' in d and 'day' in d:
+            md = f"{d['month']:02d}{sep}{d['day']:02d}"
+            return f"{d['year']:04d}{sep}{md}" if d.get('year') else f"--{md}"
+    return ''
+
+
+def _vcard_escape(value):
+    """Escape a vCard (RFC 6350) text value"""
+    return (
+        str(value).replace('\\', '\\\\').replace('\n', '\\n')
+        .replace(',', '\\,').replace(';', '\\;')
+    )
+
+
+def _fold(line):
+    """Fold a vCard content line to 75 octets, as RFC 6350 asks"""
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return line + '\r\n'
+    out = []
+    limit = 75
+    while data:
+        # don't split a utf-8 character
+        cut = min(limit, len(data))
+        while cut < len(data) and (data[cut] & 0xC0) == 0x80:
+            cut -= 1
+        out.append(data[:cut].decode('utf-8'))
+        data = data[cut:]
+        # the continuation lines start with a space
+        limit = 74
+    return '\r\n '.join(out) + '\r\n'
+
+
+def vcard(uid, email, p, labels):
+    """Return a person as a vCard 4.0"""
+    e = _vcard_escape
+    lines = ['BEGIN:VCARD', 'VERSION:4.0', f'UID:{e(uid)}']
+    name = _first(p, 'names', 'displayName') or _first(
+        p, 'organizations', 'name'
+    )
+    lines.append(f'FN:{e(name)}')
+    for n in p.get('names', [])[:1]:
+        lines.append('N:' + ';'.join(e(n.get(k, '')) for k in [
+            'familyName', 'givenName', 'middleName', 'honorificPrefix',
+            'honorificSuffix'
+        ]))
+    for n in p.get('nicknames', []):
+        lines.append(f"NICKNAME:{e(n['value'])}")
+    for m in p.get('emailAddresses', []):
+        t = f";TYPE={e(m['type'])}" if m.get('type') else ''
+        lines.append(f"EMAIL{t}:{e(m['value'])}")
+    for m in p.get('phoneNumbers', []):
+        t = f";TYPE={e(m['type'])}" if m.get('type') else ''
+        lines.append(f"TEL{t}:{e(m['value'])}")
+    for o in p.get('organizations', []):
+        if o.get('name'):
+            lines.append(f"ORG:{e(o['name'])}")
+        if o.get('title'):
+            lines.append(f"TITLE:{e(o['title'])}")
+    for a in p.get('addresses', []):
+        t = f";TYPE={e(a['type'])}" if a.get('type') else ''
+        lines.append(f'ADR{t}:' + ';'.join(e(a.get(k, '')) for k in [
+            'poBox', 'extendedAddress', 'streetAddress', 'city', 'region',
+            'postalCode', 'country'
+        ]))
+    bday = _birthday(p, sep='')
+    if bday:
+        lines.append(f'BDAY:{bday}')
+    for u in p.get('urls', []):
+        lines.append(f"URL:{u['value']}")
+    for b in p.get('biographies', []):
+        lines.append(f"NOTE:{e(b['value'])}")
+    if labels:
+        lines.append('CATEGORIES:' + ','.join(e(x) for x in labels))
+    photo = Contacts.photo_url(p)
+    if photo:
+        lines.append(f'PHOTO:{photo}')
+    lines.append(f'X-CSYNC-ACCOUNT:{e(email)}')
+    lines.append('END:VCARD')
+    return ''.join(_fold(line) for line in lines)
+
+
+def csv_row(uid, email, p, labels):
+    """Return a person as a row of CSV_COLUMNS, lists are joined with ' ; '"""
+    def values(field, key='value'):
+        return ' ; '.join(i[key] for i in p.get(field, []) if key in i)
+
+    name = _first(p, 'names', 'displayName') or _first(
+        p, 'organizations', 'name'
+    )
+    return [
+        uid,
+        name,
+        _first(p, 'names', 'givenName'),
+        _first(p, 'names', 'familyName'),
+        values('nicknames'),
+        values('emailAddresses'),
+        values('phoneNumbers'),
+        _first(p, 'organizations', 'name'),
+        _first(p, 'organizations', 'title'),
+        values('addresses', 'formattedValue'),
+        _birthday(p),
+        values('urls'),
+        values('biographies'),
+        ' ; '.join(labels),
+        Contacts.photo_url(p) or '',
+        email,
+    ]
+
+
+def export(accounts, out, fmt='vcard'):
+    """Write the contacts of accounts to the text file out
+
+    Returns
+    -------
+    int:
+        The number of contacts written
+    """
+    n = 0
+    if fmt == 'csv':
+        w = csv.writer(out)
+        w.writerow(CSV_COLUMNS)
+        for row in iter_people(accounts):
+            w.writerow(csv_row(*row))
+            n += 1
+    else:
+        for row in iter_people(accounts):
+            out.write(vcard(*row))
+            n += 1
+    return n
+
+
+def open_output(path, compress):
+    """Return the text file to export to, '-' is stdout"""
+    if path == '-':
+        if compress:
+            return io.TextIOWrapper(
+                gzip.GzipFile(fileobj=sys.stdout.buffer, mode='wb'),
+                encoding='utf-8', newline=''
+            )
+        return io.TextIOWrapper(
+            sys.stdout.buffer, encoding='utf-8', newline='', write_through=True
+        )
+    if compress:
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    p.add_argument('--format', choices=['vcard', 'csv'], default=None,
+                   help='Default from the output name (.csv), else vcard')
+    p.add_argument('-o', '--output', default='-',
+                   help='File to write to, - for stdout')
+    p.add_argument('-z', '--gzip', action='store_true',
+                   help='Compress the output (the default for .gz names)')
+    p.add_argument('--ring', action='append',
+                   help='Only export the accounts of this ring, can be given '
+                   'more than once')
+    p.add_argument('-v', '--verbose', action='store_true',
+                   help='Verbose output')
+    # sync's print looks at args.file, the log file isn't used here
+    p.set_defaults(file=False)
+    args = p.parse_args()
+
+    sync.args = args
+    cp = sync.load_config(sync.config_dir() / 'config.ini')
+    sections = [
+        s for ring, ss in sync.ring_sections(cp).items()
+        if not args.ring or ring in args.ring
+        for s in ss
+    ]
+    if not sections:
+        print(f"There are no rings called {', '.join(args.ring)}",
+              file=sys.stderr)
+        sys.exit(2)
+
+    compress = args.gzip or args.output.endswith('.gz')
+    fmt = args.format or (
+        'csv' if args.output.removesuffix('.gz').endswith('.csv') else 'vcard'
+    )
+    accounts = [
+        Contacts(cp[s]['keyfile'], cp[s]['credfile'], cp[s]['user'],
+                 args.verbose, info=False,
+                 **sync.request_options(cp[s]))
+        for s in sections
+    ]
+    with open_output(args.output, compress) as out:
+        n = export(accounts, out, fmt)
+    print(f"exported {n} contacts", file=sys.stderr)
+    sys.exit(0)
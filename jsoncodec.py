@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""The JSON codecs the requests and responses can be encoded with
+
+googleapiclient encodes request bodies and decodes responses with the json
+module.  Full listings and batch responses are big, so Contacts builds its
+service with a CodecJsonModel instead, which uses orjson when it's installed
+(faster, see python bench.py codec) and json otherwise.  Other codecs can be
+added to CODECS.
+"""
+
+import re
+import json
+
+from googleapiclient.model import JsonModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# what json.dumps escapes, and orjson doesn't
+NON_ASCII = re.compile(r'[^\x00-\x7f]')
+
+
+def _escape(m):
+    """Return the JSON escape of a non-ASCII character"""
+    c = ord(m.group())
+    if c < 0x10000:
+        return '\\u%04x' % c
+    c -= 0x10000
+    return '\\u%04x\\u%04x' % (0xd800 | c >> 10, 0xdc00 | c & 0x3ff)
+
+
+def _orjson_dumps(obj):
+    """orjson.dumps as an ASCII str, like json.dumps makes
+
+    googleapiclient takes the length of the str it is given as the length of
+    the request body, so non-ASCII (which can only be in strings) is escaped.
+    """
+    text = orjson.dumps(obj).decode()
+    if text.isascii():
+        return text
+    return NON_ASCII.sub(_escape, text)
+
+
+# maps name to (loads, dumps): loads takes str or bytes, dumps returns an
+# ASCII str
+CODECS = {'json': (json.loads, json.dumps)}
+if orjson is not None:
+    CODECS['orjson'] = (orjson.loads, _orjson_dumps)
+
+# the fastest installed
+DEFAULT_CODEC = 'orjson' if 'orjson' in CODECS else 'json'
+
+
+def get_codec(name=None):
+    """Return the (loads, dumps) of codec name, DEFAULT_CODEC if None
+
+    A codec that isn't installed falls back on json.
+    """
+    return CODECS.get(name or DEFAULT_CODEC, CODECS['json'])
+
+
+class CodecJsonModel(JsonModel):
+    """A googleapiclient JsonModel that uses one of the CODECS"""
+
+    def __init__(self, codec=None, data_wrapper=False):
+        """
+        Parameters
+        ----------
+        codec: str
+            A key of CODECS, DEFAULT_CODEC if None
+        data_wrapper: bool
+            As for JsonModel
+        """
+        super().__init__(data_wrapper)
+        self.loads, self.dumps = get_codec(codec)
+
+    def serialize(self, body_value):
+        if (
+            isinstance(body_value, dict)
+            and "data" not in body_value
+            and self._data_wrapper
+        ):
+            body_value = {"data": body_value}
+        try:
+            return self.dumps(body_value)
+        except TypeError:
+            # something only json knows how to encode (orjson is stricter)
+            return json.dumps(body_value)
+
+    def deserialize(self, content):
+        try:
+            body = self.loads(content)
+        except ValueError:
+            # not json, like JsonModel give back what there was
+            try:
+                body = content.decode("utf-8")
+            except AttributeError:
+                body = content
+        else:
+            if self._data_wrapper and "data" in body:
+                body = body["data"]
+        return body
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+import re
+import pickle
+import hashlib
+import os.path
+import tempfile
+import threading
+import urllib.parse
+import urllib.request
+import concurrent.futures
+
+
+# Read photos in chunks of this many bytes
+CHUNK = 64 * 1024
+
+# Photos bigger than this stay in memory, bigger ones are spooled to disk
+SPOOL = 256 * 1024
+
+# Don't copy photos bigger than this (the People API won't take them anyway)
+MAX_PHOTO = 10 * 1024 * 1024
+
+
+def full_size(url):
+    """Return the url of the photo at url as it was uploaded
+
+    The People API gives the url of a 100px thumbnail.  The size is set by the
+    options after the last "=" of the url (like "=s100"), or by its "sz"
+    query parameter, size 0 is the whole photo.
+    """
+    parts = urllib.parse.urlsplit(url)
+    path, eq, opts = parts.path.rpartition('=')
+    if eq and '/' not in opts:
+        # drop the size options, s0 keeps the rest (cropping and so on)
+        opts = [o for o in opts.split('-') if not re.fullmatch(r'[swh]\d+', o)]
+        return urllib.parse.urlunsplit(
+            parts._replace(path=path + '=' + '-'.join(['s0'] + opts))
+        )
+    query = [
+        (k, v) for k, v in urllib.parse.parse_qsl(parts.query) if k != 'sz'
+    ]
+    return urllib.parse.urlunsplit(
+        parts._replace(query=urllib.parse.urlencode(query + [('sz', '0')]))
+    )
+
+
+def download(url, timeout=60):
+    """Download a photo at its full size, hashing it as it comes
+
+    Parameters
+    ----------
+    url: str
+        Where the photo is, as the People API gives it (see full_size)
+
+    Returns
+    -------
+    (str, file):
+        The sha256 of the photo and a file holding it (rewound), which is only
+        kept in memory if the photo is small.  None if the photo is too big.
+
+    """
+    h = hashlib.sha256()
+    f = tempfile.SpooledTemporaryFile(max_size=SPOOL)
+    with urllib.request.urlopen(full_size(url), timeout=timeout) as resp:
+        size = 0
+        while True:
+            chunk = resp.read(CHUNK)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > MAX_PHOTO:
+                f.close()
+                return None
+            h.update(chunk)
+            f.write(chunk)
+    f.seek(0)
+    return h.hexdigest(), f
+
+
+class PhotoSync():
+    """Copy contact photos to the other accounts, in the background
+
+    For each sync tag we remember the sha256 of the photo we last copied, and
+    the urls (one per account) that photo has.  A contact's photo is only
+    downloaded when its url is one we don't know, and only uploaded to the
+    other accounts when the photo itself (its hash) has changed.  The
+    downloads and uploads run in a thread pool so they don't hold up syncing
+    the contacts' fields, close waits for them to finish.
+
+    The copies and deletes that time out are kept with the state, and done
+    next run by retry (push is only called for the contacts changed then).
+
+    """
+
+    def __init__(self, statefile, workers=4, verbose=False):
+        """
+        Parameters
+        ----------
+        statefile: pathlib.Path
+            Where to keep the hash and urls of each tag's photo between runs
+        workers: int
+            How many photos to copy at the same time
+        """
+        self.statefile = statefile
+        self.verbose = verbose
+        # maps tag to (sha256, set of urls with that photo)
+        self.state = {}
+        # maps tag to the url of the photo to copy (None to delete it) and
+        # the [(email, rn)] of the copies still to do
+        self.pending = {}
+        if os.path.exists(statefile):
+            with open(statefile, 'rb') as f:
+                self.state = pickle.load(f)
+            if isinstance(self.state, tuple):
+                self.state, self.pending = self.state
+        self.lock = threading.Lock()
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.futures = []
+
+        # counts of what was done
+        self.uploaded = 0
+        self.deleted = 0
+
+    def push(self, src, rn, tag, targets, new=False):
+        """Copy the photo of a contact to its copies, if it has changed
+
+        Parameters
+        ----------
+        src: Contacts
+            The account the contact's body was got from
+        rn: str
+            The resource name of the contact in src
+        tag: str
+            The contact's sync tag
+        targets: list
+            Of (Contacts, rn) of the copies of the contact
+        new: bool
+            If the copies were just made, so have no photo whatever we copied
+            before
+
+        """
+        if rn not in src.photo_urls:
+            # we didn't get the body, so don't know
+            return
+        url = src.photo_urls[rn]
+        with self.lock:
+            old = self.state.get(tag)
+            # whatever the last run didn't get done is done over
+            self.pending.pop(tag, None)
+
+        if new:
+            old = None
+        if url is None:
+            if old is not None:
+                self.futures.append(self.pool.submit(self._delete, tag, targets))
+        elif old is None or url not in old[1]:
+            self.futures.append(
+                self.pool.submit(self._copy, tag, url, old, targets)
+            )
+
+    def retry(self, con):
+        """Do the copies and deletes the last run had time out
+
+        Those of the contacts pushed since are left to push.
+
+        Parameters
+        ----------
+        con: dict
+            Maps email to the Contacts of every account
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for tag, (url, targets) in pending.items():
+            targets = [
+                (con[email], rn) for email, rn in targets if email in con
+            ]
+            if not targets:
+                continue
+            if url is None:
+                self.futures.append(self.pool.submit(self._delete, tag, targets))
+            else:
+                self.futures.append(
+                    self.pool.submit(self._copy, tag, url, None, targets)
+                )
+
+    def _left(self, tag, url, targets):
+        """Keep the copies of tag's photo in targets for retry next run"""
+        with self.lock:
+            self.pending[tag] = (url, [(acc.user, rn) for acc, rn in targets])
+
+    def _delete(self, tag, targets):
+        for i, (acc, rn) in enumerate(targets):
+            try:
+                acc.delete_photo(rn, self.verbose)
+            except TimeoutError as e:
+                # still recorded as copied, the rest are deleted next run
+                print("\n", "[ERROR] photo of", rn, e)
+                self._left(tag, None, targets[i:])
+                return
+        with self.lock:
+            self.state.pop(tag, None)
+            self.deleted += 1
+
+    def _copy(self, tag, url, old, targets):
+        try:
+            got = download(url)
+        except OSError as e:
+            print("\n", "[ERROR] photo", url, e)
+            return
+        if got is None:
+            print("\n", "[ERROR] photo too big", url)
+            return
+
+        sha, f = got
+        with f:
+            if old is not None and old[0] == sha:
+                # same photo, a copy we made (the url changes when google
+                # re-encodes it)
+                urls = old[1] | {url}
+            else:
+                data = f.read()
+                urls = {url}
+                for i, (acc, rn) in enumerate(targets):
+                    try:
+                        new = acc.update_photo(rn, data, self.verbose)
+                    except TimeoutError as e:
+                        # not recorded as copied, the rest are copied next run
+                        print("\n", "[ERROR] photo", url, e)
+                        self._left(tag, url, targets[i:])
+                        return
+                    # None if the account gave up on it, there is no url
+                    # to know the copy by
+                    if new is not None:
+                        urls.add(new)
+                with self.lock:
+                    self.uploaded += 1
+        with self.lock:
+            self.state[tag] = (sha, urls)
+
+    def close(self):
+        """Wait for the photos to be copied, and save what we copied"""
+        for f in concurrent.futures.as_completed(self.futures):
+            # let any surprises out
+            f.result()
+        self.pool.shutdown()
+        with open(self.statefile, 'wb') as f:
+            pickle.dump((self.state, self.pending), f)
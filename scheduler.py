@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import time
+import queue
+import itertools
+import threading
+
+
+# priorities of the work, lower goes first.  Deletes and tagging come before
+# the bulk of adds and updates, and labels last as they change the etags the
+# updates need
+DELETE = 0
+TAG = 1
+ADD = 2
+UPDATE = 3
+LABEL = 4
+
+# put on a queue to stop its worker, after everything else
+_STOP = 99
+
+
+class Budget():
+    """How much writing a run may still do, see --max-runtime/--max-writes"""
+
+    def __init__(self, seconds=None, writes=None):
+        """
+        Parameters
+        ----------
+        seconds: float
+            Don't start any writes after this many seconds from now
+        writes: int
+            Don't do more than this many writes, a batch counts as a write
+            for each person it writes
+        """
+        self.deadline = None if not seconds else time.monotonic() + seconds
+        self.writes = writes
+        self.max_writes = writes
+        self.lock = threading.Lock()
+
+    def spend(self, n=1):
+        """Return whether there is budget left for n writes, and use it"""
+        with self.lock:
+            if self.deadline is not None and time.monotonic() > self.deadline:
+                return False
+            if self.writes is not None:
+                if self.writes < n:
+                    return False
+                self.writes -= n
+            return True
+
+    def chunk(self, size):
+        """Return how many writes to put in a batch of up to size
+
+        No more than the whole budget, so a batch can always be done by a
+        run that has its budget left.
+        """
+        if self.max_writes is None:
+            return size
+        return max(1, min(size, self.max_writes))
+
+
+class Scheduler():
+    """Run the writes to each account in that account's own worker thread
+
+    Each account has a priority queue and a worker working through it, so an
+    account that is slow (or being rate limited, the Contacts methods back off
+    on 429s) only holds up its own writes, the other accounts carry on.  The
+    work of an account is done in priority order, and in the order it was
+    submitted within a priority.
+
+    The methods run must use Contacts.execute (so the requests go through an
+    http of the worker's own).  Callbacks are run in the worker too.
+
+    With a Budget, once it has run out the work left is skipped instead (all
+    but the tagging, which the copies already made rely on) and the keys it
+    was submitted with are put in skipped, for the caller to carry over to
+    the next run.  Each piece of work is charged the writes it was submitted
+    with, and those skipped are counted in unwritten.  Work that times out
+    (the Contacts methods have already tried again, see TIMEOUT_TRIES) is
+    skipped the same way, and counted in timeouts, rather than stopping the
+    rest.
+
+    """
+
+    def __init__(self, budget=None):
+        # maps Contacts to its queue, worker thread and seconds spent working
+        self.queues = {}
+        self.workers = {}
+        self.busy = {}
+        self.seq = itertools.count()
+        self.lock = threading.Lock()
+        self.errors = []
+        self.budget = budget
+        self.skipped = []
+        self.unwritten = 0
+        self.timeouts = 0
+
+    def submit(self, acc, priority, fn, *args, callback=None, key=None,
+               writes=1, **kwargs):
+        """Queue fn(*args, **kwargs) to run in acc's worker
+
+        Parameters
+        ----------
+        acc: Contacts
+            The account the work writes to
+        priority: int
+            One of DELETE, TAG, ADD, UPDATE, LABEL
+        callback: function
+            Called with what fn returns, once it has run
+        key: object
+            Put in skipped if the work is skipped for lack of budget, or
+            times out
+        writes: int
+            How many writes fn makes, the people in a batch say, what it is
+            charged to the Budget
+        """
+        if acc not in self.queues:
+            self.queues[acc] = queue.PriorityQueue()
+            self.busy[acc] = 0.0
+            self.workers[acc] = threading.Thread(
+                target=self._work, args=(acc,), daemon=True
+            )
+            self.workers[acc].start()
+        self.queues[acc].put(
+            (priority, next(self.seq), fn, args, kwargs, callback, key,
+             writes)
+        )
+
+    def chunk(self, size):
+        """Return how many writes to submit in a batch of up to size, see
+        Budget.chunk"""
+        if self.budget is None:
+            return size
+        return self.budget.chunk(size)
+
+    def _work(self, acc):
+        q = self.queues[acc]
+        while True:
+            priority, _, fn, args, kwargs, callback, key, writes = q.get()
+            try:
+                if priority == _STOP:
+                    return
+                if self.errors:
+                    # something went wrong, don't make it worse
+                    continue
+                if (self.budget is not None and priority != TAG
+                        and not self.budget.spend(writes)):
+                    with self.lock:
+                        self.skipped.append(key)
+                        self.unwritten += writes
+                    continue
+                start = time.perf_counter()
+                ret = fn(*args, **kwargs)
+                if callback is not None:
+                    callback(ret)
+                self.busy[acc] += time.perf_counter() - start
+            except TimeoutError:
+                # it may or may not have been written, the caller carries it
+                # over like a skip and the next run sees which
+                with self.lock:
+                    self.skipped.append(key)
+                    self.unwritten += writes
+                    self.timeouts += 1
+            except Exception as e:
+                with self.lock:
+                    self.errors.append(e)
+            finally:
+                q.task_done()
+
+    def join(self):
+        """Wait for all the work to be done, and stop the workers
+
+        Raises the first exception any of the work raised.
+        """
+        for acc, q in self.queues.items():
+            q.put((_STOP, next(self.seq), None, (), {}, None, None, 0))
+        for t in self.workers.values():
+            t.join()
+        self.queues, self.workers = {}, {}
+        if self.errors:
+            raise self.errors[0]
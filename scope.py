@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+
+class Scope():
+    """Limit the syncing of an account to the people with some labels
+
+    An account with a scope only has the members of those labels listed (see
+    Contacts.members), copied to the other accounts and kept up to date, and
+    only gets copies of the people that have one of the labels elsewhere.
+    What is in and out of the scope is kept between runs (see state) so that:
+
+    - a person in scope last run that isn't now is only taken for deleted if
+      they can't be found any more, otherwise they left the scope (their
+      labels are synced one last time) and are left alone after that
+    - a person who comes into scope through another account is brought back
+      into it if the account has them outside the scope, instead of being
+      copied to it again
+
+    The first run with a scope (or a different one) lists the whole account
+    to find out what it has outside the scope.
+
+    """
+
+    def __init__(self, names, state=None):
+        """
+        Parameters
+        ----------
+        names: list
+            The names of the labels
+        state: dict
+            What state returned at the end of the last run
+        """
+        self.names = sorted(names)
+        if state is not None and state['names'] != self.names:
+            state = None
+        # maps tag to rn of the people in and outside the scope, as of the
+        # last run.  inside is None until the account has been listed whole
+        self.inside = state['inside'] if state is not None else None
+        self.outside = state['outside'] if state is not None else {}
+        # the resource names of the labels
+        self.grns = set([])
+        # the tags of the people in scope last run that have been deleted
+        self.deleted = set([])
+        # maps tag to rn of the copies made in the account this run
+        self.added = {}
+
+    def load(self, acc):
+        """Get the info of the people in the scope of acc, like get_info
+
+        Returns
+        -------
+        list:
+            The names of the scope's labels acc doesn't have
+        """
+        acc.get_info_groups()
+        self.grns = set(
+            rn for rn, v in acc.info_group.items() if v.name in self.names
+        )
+        unknown = sorted(
+            set(self.names) - set(v.name for v in acc.info_group.values())
+        )
+
+        if self.inside is None:
+            acc.get_info()
+            out = [
+                rn for rn, v in acc.info.items()
+                if not self.grns.intersection(v.groups)
+            ]
+            self.outside = {
+                acc.info[rn].tag: rn for rn in out
+                if acc.info[rn].tag is not None
+            }
+            for rn in out:
+                acc.forget(rn)
+            acc.members = set(acc.info)
+            self.inside = {}
+            return unknown
+
+        acc.members = acc.group_members(self.grns)
+        acc.get_info()
+        tags = set(v.tag for v in acc.info.values())
+        gone = {
+            rn: tag for tag, rn in self.inside.items() if tag not in tags
+        }
+        # those that left the scope are kept in the info this run, so the
+        # labels they lost are synced
+        for p in acc.iter_people(gone):
+            acc.info_add(p)
+            acc.members.add(p['resourceName'])
+            gone.pop(p['resourceName'], None)
+        self.deleted = set(gone.values())
+        return unknown
+
+    def tags(self, acc):
+        """Return the sync tags of the scope's labels in acc"""
+        return set(
+            v.tag for v in acc.info_group.values()
+            if v.name in self.names and v.tag is not None
+        )
+
+    def state(self, acc):
+        """Return what to keep of the scope of acc for the next run"""
+        self.grns = set(
+            rn for rn, v in acc.info_group.items() if v.name in self.names
+        )
+        inside = dict(self.added)
+        outside = {
+            t: rn for t, rn in self.outside.items() if t not in self.deleted
+        }
+        for rn, v in acc.info.items():
+            if v.tag is None:
+                continue
+            if self.grns.intersection(v.groups):
+                inside[v.tag] = rn
+            else:
+                outside[v.tag] = rn
+        for t in inside:
+            outside.pop(t, None)
+        return {'names': self.names, 'inside': inside, 'outside': outside}
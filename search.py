@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""Find people in the accounts, offline, and see if their copies agree
+
+Searches the index each ring keeps when `search = yes` (search-<ring>.sqlite
+next to the config, brought up to date at the end of every sync) by name,
+organization, email, phone or csync-uid.  Nothing is asked of Google.  Every
+word has to match (the start of) a name, organization or email word, an email
+or phone number is matched whole.
+
+    python search.py smith
+    python search.py john@example.com
+    python search.py --ring work +44 20 7946 0000
+"""
+
+import re
+import sys
+import sqlite3
+import argparse
+
+from dupes import norm_name, norm_email, norm_phone
+
+
+def person_terms(body, tag):
+    """Return the search terms of a person body
+
+    The words of their names and organizations, their emails and phone
+    numbers (normalised like dupes.py does) and their sync tag.
+    """
+    terms = set([])
+    for n in body.get('names', []):
+        terms.update(norm_name(n.get('displayName', '')).split())
+    for o in body.get('organizations', []):
+        terms.update(norm_name(o.get('name', '')).split())
+    for e in body.get('emailAddresses', []):
+        if e.get('value'):
+            terms.add(norm_email(e['value']))
+    for t in body.get('phoneNumbers', []):
+        phone = norm_phone(t.get('canonicalForm') or t.get('value', ''))
+        if phone:
+            terms.add(phone)
+    if tag is not None:
+        terms.add(tag)
+    return terms
+
+
+def query_terms(query):
+    """Return the (term, prefix) pairs a query is made of
+
+    A query that looks like a phone number is one term, emails are matched
+    whole and the other words by their start.
+    """
+    if re.fullmatch(r'[\d\s()+.-]+', query) and norm_phone(query):
+        return [(norm_phone(query), False)]
+    ret = []
+    for word in query.split():
+        if '@' in word:
+            ret.append((norm_email(word), False))
+        else:
+            ret += [(w, True) for w in norm_name(word).split()]
+    return ret
+
+
+class SearchIndex():
+    """An inverted index of the contacts of a ring's accounts, on disk
+
+    For each contact it keeps what's shown when it's found (name, emails,
+    phones, sync tag), the etag it was indexed at (so only those changed
+    since need indexing again) and a digest of its content (see
+    sync.body_digest) to tell whether the copies agree.  Each of its terms
+    (see person_terms) points to it.
+
+    """
+
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path: pathlib.Path
+            The database, made if it doesn't exist
+        """
+        self.db = sqlite3.connect(str(path))
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS accounts (account TEXT PRIMARY KEY);"
+            "CREATE TABLE IF NOT EXISTS docs ("
+            "account TEXT, rn TEXT, etag TEXT, tag TEXT, name TEXT, "
+            "emails TEXT, phones TEXT, digest BLOB, "
+            "PRIMARY KEY (account, rn));"
+            "CREATE INDEX IF NOT EXISTS docs_tag ON docs (tag);"
+            "CREATE TABLE IF NOT EXISTS terms ("
+            "term TEXT, account TEXT, rn TEXT);"
+            "CREATE INDEX IF NOT EXISTS terms_term ON terms (term);"
+            "CREATE INDEX IF NOT EXISTS terms_doc ON terms (account, rn);"
+        )
+
+    def set_accounts(self, emails):
+        """Make emails the accounts of the ring, forgetting any others"""
+        old = set(r[0] for r in self.db.execute("SELECT account FROM accounts"))
+        for email in old - set(emails):
+            self.db.execute("DELETE FROM docs WHERE account = ?", (email,))
+            self.db.execute("DELETE FROM terms WHERE account = ?", (email,))
+        self.db.execute("DELETE FROM accounts")
+        self.db.executemany(
+            "INSERT INTO accounts VALUES (?)", [(e,) for e in emails]
+        )
+
+    def version(self):
+        """Return the version of the digests, see set_version"""
+        return self.db.execute("PRAGMA user_version").fetchone()[0]
+
+    def set_version(self, version):
+        """Record the version of sync.body_digest the digests are of"""
+        self.db.execute(f"PRAGMA user_version = {int(version)}")
+
+    def accounts(self):
+        """Return the emails of the ring's accounts"""
+        return [r[0] for r in self.db.execute("SELECT account FROM accounts")]
+
+    def etags(self, account):
+        """Return a dict mapping the rns indexed in account to their etag"""
+        return dict(self.db.execute(
+            "SELECT rn, etag FROM docs WHERE account = ?", (account,)
+        ))
+
+    def put(self, account, rn, etag, tag, body, digest):
+        """Index (again) the contact rn of account, whose body is at etag"""
+        self.drop(account, [rn])
+        self.db.execute(
+            "INSERT INTO docs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                account, rn, etag, tag,
+                (
+                    body['names'][0].get('displayName', '')
+                    if body.get('names')
+                    else body.get('organizations', [{}])[0].get('name', '')
+                ),
+                ', '.join(
+                    e['value'] for e in body.get('emailAddresses', [])
+                    if e.get('value')
+                ),
+                ', '.join(
+                    t['value'] for t in body.get('phoneNumbers', [])
+                    if t.get('value')
+                ),
+                digest,
+            ),
+        )
+        self.db.executemany(
+            "INSERT INTO terms VALUES (?, ?, ?)",
+            [(t, account, rn) for t in person_terms(body, tag)],
+        )
+
+    def drop(self, account, rns):
+        """Forget the contacts rns of account"""
+        for rn in rns:
+            self.db.execute(
+                "DELETE FROM docs WHERE account = ? AND rn = ?", (account, rn)
+            )
+            self.db.execute(
+                "DELETE FROM terms WHERE account = ? AND rn = ?", (account, rn)
+            )
+
+    def search(self, query):
+        """Return the (account, rn) of the contacts matching every query term"""
+        found = None
+        for term, prefix in query_terms(query):
+            if prefix:
+                rows = self.db.execute(
+                    "SELECT account, rn FROM terms "
+                    "WHERE term >= ? AND term < ?",
+                    (term, term + '\uffff'),
+                )
+            else:
+                rows = self.db.execute(
+                    "SELECT account, rn FROM terms WHERE term = ?", (term,)
+                )
+            rows = set(rows)
+            found = rows if found is None else found & rows
+            if not found:
+                break
+        return found or set([])
+
+    def doc(self, account, rn):
+        """Return (tag, name, emails, phones, digest) of a contact"""
+        return self.db.execute(
+            "SELECT tag, name, emails, phones, digest FROM docs "
+            "WHERE account = ? AND rn = ?",
+            (account, rn),
+        ).fetchone()
+
+    def copies(self, tag):
+        """Return a dict mapping account to (rn, digest) of tag's copies"""
+        return {
+            account: (rn, digest)
+            for account, rn, digest in self.db.execute(
+                "SELECT account, rn, digest FROM docs WHERE tag = ?", (tag,)
+            )
+        }
+
+    def close(self):
+        """Save the index"""
+        self.db.commit()
+        self.db.close()
+
+
+def report(index, found, out):
+    """Write where each contact found is and whether its copies agree"""
+    accounts = index.accounts()
+    seen = set([])
+    for account, rn in sorted(found):
+        tag, name, emails, phones, digest = index.doc(account, rn)
+        if tag is None:
+            out.write(f"{name}  (not synced yet)\n")
+            out.write(f"    {account}  {rn}\n")
+            continue
+        if tag in seen:
+            continue
+        seen.add(tag)
+        copies = index.copies(tag)
+        missing = [a for a in accounts if a not in copies]
+        if missing:
+            state = f"missing from {', '.join(missing)}"
+        elif len(set(d for rn, d in copies.values())) > 1:
+            state = "copies differ"
+        else:
+            state = "in sync"
+        out.write(f"{name}  {tag}  {state}\n")
+        if emails or phones:
+            out.write(f"    {'; '.join(i for i in (emails, phones) if i)}\n")
+        for a in accounts:
+            if a in copies:
+                out.write(f"    {a}  {copies[a][0]}\n")
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    p.add_argument('query', nargs='+', help='What to look for')
+    p.add_argument('--ring', action='append',
+                   help='Only look in this ring, can be given more than once')
+    args = p.parse_args()
+
+    # sync imports this module, so only import it when run
+    import sync
+    cdir = sync.config_dir()
+    rings = sorted(
+        f.name[len('search-'):-len('.sqlite')]
+        for f in cdir.glob('search-*.sqlite')
+    )
+    if args.ring:
+        rings = [r for r in rings if r in args.ring]
+    if not rings:
+        print('No search index, put search = yes in the config and sync')
+        sys.exit(2)
+    total = 0
+    for ring in rings:
+        index = SearchIndex(cdir / f'search-{ring}.sqlite')
+        found = index.search(' '.join(args.query))
+        if found and len(rings) > 1:
+            print(f'# ring {ring}')
+        report(index, found, sys.stdout)
+        index.close()
+        total += len(found)
+    sys.exit(0 if total else 1)
@@ -10,23 +10,80 @@ import random
 import string
 import time
 import datetime
-import dateutil
 import pytz
-import copy
+import json
+import hashlib
+import cProfile
+import traceback
+import threading
+import concurrent.futures
 from os.path import exists
-from contacts import Contacts
+from contacts import (
+    Contacts,
+    DEFAULT_TIMEOUT,
+    FULL_LISTING_FRACTION,
+    MAX_BATCH_CREATE,
+    MAX_BATCH_DELETE,
+    content_update_person_fields,
+    iso_key,
+    tagged_client_data,
+)
+from photos import PhotoSync
+from bodycache import BodyCache
+from tracing import Tracer, table
+from scheduler import Scheduler, Budget
+from search import SearchIndex
+from scope import Scope
+from changeset import ChangeSet
+import scheduler
+import dupes
 import pickle
 
+try:
+    import fcntl
+except ImportError:
+    # no locking on windows, don't run overlapping syncs there
+    fcntl = None
+
 
 all_sync_tags = set([])
 logName = "log.txt"
 
+# times the phases of a sync, run_ring gives each ring its own
+tracer = Tracer()
+
+# the ring of the accounts whose config section doesn't name one
+DEFAULT_RING = "default"
+
+# what sync_ring counts
+STATS = [
+    "contacts",
+    "groups deleted",
+    "groups added",
+    "groups updated",
+    "deleted",
+    "added",
+    "held back",
+    "updated",
+    "labels",
+    "photos",
+    "diverged",
+    "carried",
+    "timed out",
+]
+
+# put in front of everything printed, so the output of rings synced at the
+# same time can be told apart
+log_prefix = ""
+
 # redefine print for force flush and save log to file (if args.file is defined)
 old_print = print
 
 
 def _print(*a, **vargs):
     vargs["flush"] = True
+    if log_prefix:
+        a = (log_prefix,) + a
     old_print(*a, **vargs)
     if args.file:
         # highly inefficient, but even if it crashes, I can save the last instruction
@@ -71,6 +128,29 @@ def vprint(*a, **vargs):
         print(*a, **vargs)
 
 
+class SyncError(Exception):
+    """A ring can't be synced until the user fixes something
+
+    What to fix has already been printed, code is the exit status to use.
+    """
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+def config_dir():
+    """Return the directory of the config file (and state), made if need be"""
+    if exists("PORTABLE.md"):
+        cdir = pathlib.Path("conf")
+    else:
+        cdir = pathlib.Path(
+            appdirs.AppDirs("google-contacts-sync", "mcw").user_data_dir
+        )
+    os.makedirs(cdir, mode=0o755, exist_ok=True)
+    return cdir
+
+
 def load_config(cfile):
     """Return the config, or make a default one.
 
@@ -116,17 +196,50 @@ def load_config(cfile):
     return cp
 
 
-def save_config(cp, cfile):
-    """Update the last run, and save"""
-    cp["DEFAULT"] = {
-        # +5s because it happens that the server time of the last updated
-        # element is greater than the one saved on the config.ini (do not ask
-        # me why )
-        "last": (datetime.datetime.utcnow() + datetime.timedelta(seconds=5))
+def account_sections(cp):
+    """Return the names of the account sections in the config"""
+    return [s for s in cp.sections() if s.startswith("account-")]
+
+
+def ring_sections(cp):
+    """Return a dict mapping each ring name to its account sections"""
+    rings = {}
+    for s in account_sections(cp):
+        rings.setdefault(cp[s].get("ring", DEFAULT_RING), []).append(s)
+    return rings
+
+
+def ring_settings(cp, ring):
+    """Return the settings of ring as a dict (last, backupdays, ...)
+
+    The default ring uses the DEFAULT section as always, the others their
+    ring-<name> section (which falls back on DEFAULT).
+    """
+    if ring != DEFAULT_RING and cp.has_section(f"ring-{ring}"):
+        return dict(cp[f"ring-{ring}"])
+    return dict(cp["DEFAULT"])
+
+
+def new_last():
+    """Return the time to save as the last run, ISO format"""
+    # +5s because it happens that the server time of the last updated element
+    # is greater than the one saved on the config.ini (do not ask me why )
+    return (
+        (datetime.datetime.utcnow() + datetime.timedelta(seconds=5))
         .replace(tzinfo=pytz.utc)
-        .isoformat(),
-        "backupdays": cp["DEFAULT"].get("backupdays", 0),
-    }
+        .isoformat()
+    )
+
+
+def save_config(cp, cfile, ring, last):
+    """Update the last run of ring, and save"""
+    cp.remove_option("DEFAULT", "msg")
+    if ring == DEFAULT_RING:
+        cp["DEFAULT"]["last"] = last
+    else:
+        if not cp.has_section(f"ring-{ring}"):
+            cp.add_section(f"ring-{ring}")
+        cp[f"ring-{ring}"]["last"] = last
     with open(cfile, "w") as cfh:
         cp.write(cfh)
 
@@ -137,81 +250,328 @@ def remove_prefix(text, prefix):
     return text  # or whatever
 
 
-# parse command line
-p = argparse.ArgumentParser(
-    description="""
-Sync google contacts.
+# maps (source account, target account) to the membership translation table,
+# see membership_table
+group_tables = {}
 
-If you have previously used github.com/michael-adler/sync-google-contacts which
-uses the csync-uid, after enabling the People API on all your accounts,
-editting your config file (you will be prompted about that), you should be all
-good to go.
 
-If you haven't synced contacts before you will have to go through an --init
-phase, again you will be prompted.
+def membership_table(src, dst):
+    """Return the table translating src's labels to dst's for this run
 
-For full instructions see
-https://github.com/mrmattwilkins/google-contacts-sync
-    """,
-    epilog="""""",
-    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-)
-p.add_argument("--init", action="store_true", help="Initialize by syncing using names")
-p.add_argument(
-    "--rlim", type=int, help="If --init, wait this many seconds between each sync"
-)
-p.add_argument("-v", "--verbose", action="store_true", help="Verbose output")
-p.add_argument("-f", "--file", action="store_true", help="Save output to file")
-args = p.parse_args()
-
-# get the configuration file
-vprint("Loading configuration")
-if exists("PORTABLE.md"):
-    cdir = pathlib.Path("conf")
-else:
-    cdir = pathlib.Path(appdirs.AppDirs("google-contacts-sync", "mcw").user_data_dir)
-
-os.makedirs(cdir, mode=0o755, exist_ok=True)
-cfile = cdir / "config.ini"
-cp = load_config(cfile)
-
-# get the contacts for each user
-vprint("Getting contacts")
-con = {
-    cp[s]["user"]: Contacts(
-        cp[s]["keyfile"], cp[s]["credfile"], cp[s]["user"], args.verbose
-    )
-    for s in cp.sections()
+    Parameters
+    ----------
+    src: Contacts
+        The account the contact body comes from
+    dst: Contacts
+        The account the contact body is going to
+
+    Returns
+    -------
+    dict:
+        Maps the resource name of each of src's labels to the resource name
+        of the label with the same sync tag in dst.  Labels dst doesn't have
+        (or that aren't tagged) are left out.  Built once per pair and run, so
+        it must only be asked for once the ContactGroups are synced.
+    """
+    if (src, dst) not in group_tables:
+        tag2rn = {
+            v.tag: rn for rn, v in dst.info_group.items() if v.tag is not None
+        }
+        group_tables[(src, dst)] = {
+            rn: tag2rn[v.tag]
+            for rn, v in src.info_group.items()
+            if v.tag in tag2rn
+        }
+    return group_tables[(src, dst)]
+
+
+def without_memberships(body):
+    """Return body without its labels (memberships), for a content update"""
+    return {k: v for k, v in body.items() if k != "memberships"}
+
+
+# the keys of a field the server works out from the others (and the
+# account's locale), an update can't set them.  Those starting with
+# "formatted" (formattedType, formattedValue...) are too
+DERIVED_KEYS = {
+    "names": ("displayName", "displayNameLastFirst", "unstructuredName"),
+    "phoneNumbers": ("canonicalForm",),
 }
 
-# backup
-if int(cp["DEFAULT"].get("backupdays", 0)) > 0:
-    os.makedirs(cdir / "backups", mode=0o755, exist_ok=True)
+# changed whenever body_digest does, the digests kept from before are dropped
+DIGEST_VERSION = 2
+
+
+def body_content(body):
+    """Return what an update can set of a contact body, other than its labels
+
+    Only the content_update_person_fields, without the DERIVED_KEYS.
+    """
+    return {
+        f: [
+            {
+                k: v for k, v in i.items()
+                if not k.startswith("formatted")
+                and k not in DERIVED_KEYS.get(f, ())
+            }
+            for i in body[f]
+        ]
+        for f in content_update_person_fields
+        if f in body
+    }
+
+
+def body_digest(body):
+    """Return a digest of a contact body's content (see body_content)
+
+    Stored (see load_digests) for each tag when its body is pushed, so a
+    contact whose only change since is its labels can be recognised and left
+    to sync_memberships.  Copies with the same digest agree in everything a
+    sync can copy.
+    """
+    return hashlib.blake2b(
+        json.dumps(body_content(body), sort_keys=True).encode(),
+        digest_size=8,
+    ).digest()
+
+
+def load_versioned(pfile):
+    """Return what save_versioned put in pfile, {} if it's of another
+    DIGEST_VERSION"""
+    if exists(pfile):
+        with open(pfile, "rb") as f:
+            saved = pickle.load(f)
+        if saved.get("version") == DIGEST_VERSION:
+            return saved["data"]
+    return {}
+
+
+def save_versioned(pfile, data):
+    """Save data made with body_digest in pfile, with the DIGEST_VERSION"""
+    with open(pfile, "wb") as f:
+        pickle.dump({"version": DIGEST_VERSION, "data": data}, f)
+
+
+def load_digests(dfile):
+    """Return the body_digest of each tag, as last pushed, from dfile"""
+    return load_versioned(dfile)
+
+
+def save_digests(dfile, digests):
+    save_versioned(dfile, digests)
+
+
+def translate_memberships(body, table):
+    """Return body ready for another account, given its membership_table
+
+    Only memberships is replaced: myContacts is kept and each label is swapped
+    for the other account's one (or dropped if it has no such label).  The
+    other fields are shared with body, not copied, so don't modify them.
+    """
+    memberships = []
+    for grp in body.get("memberships", []):
+        if "contactGroupMembership" not in grp:
+            continue
+        rn = grp["contactGroupMembership"]["contactGroupResourceName"]
+        if rn == "contactGroups/myContacts":
+            memberships.append(grp)
+        elif rn in table:
+            memberships.append(
+                {
+                    "contactGroupMembership": {
+                        "contactGroupId": remove_prefix(table[rn], "contactGroups/"),
+                        "contactGroupResourceName": table[rn],
+                    }
+                }
+            )
+
+    ret = dict(body)
+    ret["memberships"] = memberships
+    return ret
+
+
+def request_options(settings):
+    """Return the Contacts timeout, hedge, rate and codec given in settings
+
+    timeout (seconds, 0 for none), hedge (a percentile, 0 for no hedging),
+    ratelimit (requests a second, 0 for no limit) and jsoncodec (see
+    jsoncodec.CODECS) can be set in [DEFAULT] or a ring's section.
+    """
+    timeout = float(settings.get("timeout", DEFAULT_TIMEOUT))
+    return {
+        "timeout": timeout or None,
+        "hedge": float(settings.get("hedge", 0)),
+        "rate": float(settings.get("ratelimit", 0)),
+        "codec": settings.get("jsoncodec"),
+    }
+
+
+def load_accounts(accounts, index={}, settings={}, scopes={}):
+    """Return the Contacts of each account, keyed by their user (email)
+
+    Parameters
+    ----------
+    accounts: dict
+        Maps config section name to its settings (user, keyfile, credfile and
+        maybe scope)
+    index: dict
+        Maps email to the Contacts.index of the account at the end of the
+        previous run.  Those accounts are only scanned for changes
+        (Contacts.scan_changes) unless people have been deleted since and
+        their sync token has expired.
+    settings: dict
+        The ring's settings, see request_options
+    scopes: dict
+        Maps email to the Scope.state of the account at the end of the
+        previous run.  Accounts with a scope only get the info of the people
+        in it (except with --init).
+    """
+    con = {}
+    for a in accounts.values():
+        with tracer.span("account load", a["user"]):
+            acc = Contacts(
+                a["keyfile"], a["credfile"], a["user"], args.verbose,
+                info=False, **request_options(settings)
+            )
+            names = [n.strip() for n in a.get("scope", "").split(",")]
+            names = [n for n in names if n]
+            if names and not args.init:
+                acc.scope = Scope(names, scopes.get(a["user"]))
+                unknown = acc.scope.load(acc)
+                if unknown:
+                    print(f"{a['user']}: no labels {unknown} to scope to")
+                vprint(f"{a['user']}: {len(acc.info)} contacts in scope")
+            elif a["user"] in index and acc.scan_changes(index[a["user"]]):
+                vprint(f"{a['user']}: scanned for changes")
+            else:
+                acc.get_info()
+            con[a["user"]] = acc
+    return con
+
+
+def load_index(ifile):
+    """Return the index of each account (see load_accounts) saved in ifile"""
+    if exists(ifile):
+        try:
+            with open(ifile, "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            # a run died writing it, list everybody
+            print(f"can't read {ifile}, listing all contacts")
+    return {}
+
+
+def load_scopes(scfile):
+    """Return the Scope.state of each account saved in scfile"""
+    if exists(scfile):
+        with open(scfile, "rb") as f:
+            return pickle.load(f)
+    return {}
+
+
+def save_scopes(scfile, con):
+    """Save the Scope.state of the accounts in con that have a scope"""
+    with open(scfile, "wb") as f:
+        pickle.dump(
+            {
+                email: acc.scope.state(acc)
+                for email, acc in con.items()
+                if acc.scope is not None
+            },
+            f,
+        )
+
+
+def save_index(ifile, con):
+    """Save the index of each account in con, for the next run to scan from"""
+    with open(ifile, "wb") as f:
+        pickle.dump(
+            {
+                email: acc.index()
+                for email, acc in con.items()
+                if acc.watermark is not None
+            },
+            f,
+        )
+
+
+def load_watermarks(wfile):
+    """Return the watermarks of each account saved in wfile
+
+    Returns
+    -------
+    dict:
+        Maps email to (contacts, groups, written, written groups): the newest
+        update times (iso_keys) listed in that account's contacts and groups
+        by the last run, and what Contacts.written and written_groups were at
+        its end
+    """
+    if exists(wfile):
+        with open(wfile, "rb") as f:
+            # those saved before the writes were kept only have the times
+            return {
+                email: (tuple(v) + ({}, {}))[:4]
+                for email, v in pickle.load(f).items()
+            }
+    return {}
+
+
+def save_watermarks(wfile, con, marks):
+    """Move the watermarks of the accounts in con on, and save them
+
+    An account's contacts and groups are marked with the newest update time
+    listed in them, so anything changed after the listing is found next run.
+    Times come from the server, so the local clock doesn't matter.  Our own
+    writes come after the listing too, they are saved with the etags they
+    left (see Contacts.written_etags), and the next run only takes those
+    whose etag has changed since for changed.
+    """
+    for email, acc in con.items():
+        people, groups = marks.get(email, (None, None, {}, {}))[:2]
+        people = max(
+            [t for t in (people, acc.watermark) if t is not None],
+            default=None,
+        )
+        groups = max(
+            [t for t in (groups, acc.group_watermark) if t is not None],
+            default=None,
+        )
+        marks[email] = (
+            people, groups, acc.written_etags(), dict(acc.written_groups)
+        )
+    with open(wfile, "wb") as f:
+        pickle.dump(marks, f)
+
+
+def backup(con, bdir, backupdays):
+    """Pickle con into bdir/1.bak, keeping backupdays old backups"""
+    os.makedirs(bdir, mode=0o755, exist_ok=True)
 
     # remove last backup
-    lastBackupFile = cdir / "backups" / (cp["DEFAULT"]["backupdays"] + ".bak")
+    lastBackupFile = bdir / (str(backupdays) + ".bak")
     if os.path.exists(lastBackupFile):
         os.remove(lastBackupFile)
 
     # shift backups
-    for i in reversed(range(1, int(cp["DEFAULT"]["backupdays"]))):
-        if os.path.exists(cdir / "backups" / (str(i) + ".bak")):
+    for i in reversed(range(1, backupdays)):
+        if os.path.exists(bdir / (str(i) + ".bak")):
             os.rename(
-                cdir / "backups" / (str(i) + ".bak"),
-                cdir / "backups" / (str(i + 1) + ".bak"),
+                bdir / (str(i) + ".bak"),
+                bdir / (str(i + 1) + ".bak"),
             )
 
     # dump all data
-    with open(cdir / "backups" / "1.bak", "wb") as config_dictionary_file:
+    with open(bdir / "1.bak", "wb") as config_dictionary_file:
         pickle.dump(con, config_dictionary_file)
 
 
-if args.init:
+def init_accounts(con, stats, photos, digests):
+    """Give everybody a sync tag, matching people across accounts by name"""
     print("Setting up syncing using names to identify identical contacts")
 
     # get all the names to see if there are duplicates
     for email, acc in con.items():
-        dups = duplicates([i["name"] for i in acc.info.values()])
+        dups = duplicates([i.name for i in acc.info.values()])
         if dups:
             print("")
             print(
@@ -220,7 +580,13 @@ if args.init:
             )
             print("")
             print("Please remove your duplicates and try again")
-            sys.exit(1)
+            raise SyncError(1)
+
+    # maps each account's names (lowercased) to rn, to match people with
+    name2rn = {
+        acc: {v.name.lower(): rn for rn, v in acc.info.items()}
+        for acc in con.values()
+    }
 
     # keep track of who we have synced so we don't redo them on next account
     done = set([])
@@ -229,23 +595,37 @@ if args.init:
         ndone = 0
         nsync = 0
         for rn, p in acc.info.items():
-            if p["name"] in done:
+            if p.name in done:
                 ndone += 1
             else:
-                if p["tag"] is None:
-                    p["tag"] = new_tag()
-                    acc.update_tag(rn, p["tag"])
+                if p.tag is None:
+                    acc.update_tag(rn, new_tag())
                 newcontact = acc.get(rn)
+                targets = []
                 for otheremail, otheracc in con.items():
                     if otheracc == acc:
                         continue
-                    rn = otheracc.name_to_rn(p["name"])
-                    if rn:
-                        otheracc.update_tag(rn, p["tag"])
-                        otheracc.update(p["tag"], newcontact, args.verbose)
+                    orn = name2rn[otheracc].get(p.name.lower())
+                    if orn:
+                        # newcontact's clientData has the tag, so one update
+                        # tags the person and copies the body.  Their labels
+                        # are left alone, the groups aren't synced yet
+                        otheracc.update_rn(
+                            orn,
+                            without_memberships(newcontact),
+                            args.verbose,
+                            fields=content_update_person_fields,
+                        )
+                        otheracc.info[orn].tag = p.tag
+                        stats["updated"] += 1
                     else:
-                        otheracc.add(newcontact)
-                done.add(p["name"])
+                        orn = otheracc.add(newcontact)["resourceName"]
+                        stats["added"] += 1
+                    targets.append((otheracc, orn))
+                digests[p.tag] = body_digest(newcontact)
+                if photos:
+                    photos.push(acc, rn, p.tag, targets, new=True)
+                done.add(p.name)
                 nsync += 1
                 # back-off a bit so google doesn't rate limit us
                 if args.rlim and args.rlim > 0:
@@ -259,449 +639,1447 @@ if args.init:
             )
         print("")
 
-    # update the last updated field
-    save_config(cp, cfile)
-    sys.exit(0)
 
-# if an account has no sync tags, the user needs to do a --init
-vprint("Checking no new accounts")
-checked_email = {}
-new_con = {}
+def missing_tags(con, groups=False):
+    """Find the sync tags each account is missing (so were deleted there)
 
-for email, acc in con.items():
-    if all([v["tag"] is None for v in acc.info.values()]):
-        new_con[email] = acc
-    else:
-        checked_email[email] = acc
+    Contacts and groups without a tag yet are ignored, they are additions.
+    An account with a Scope hasn't got everybody, its deletions are those
+    the Scope found.
+
+    Parameters
+    ----------
+    con: dict
+        Maps email to Contacts
+    groups: bool
+        Look at the ContactGroups (info_group) instead of the contacts (info)
 
+    Returns
+    -------
+    (set, dict):
+        All the tags in the accounts, and a dict mapping each email to the set
+        of tags the other accounts have and it doesn't
 
-if len(checked_email) == 0:
-    print(
-        "all emails have no sync tags.  It looks like this is the first time "
-        "running this script for this account.  You need to pass --init "
-        "for me to assign the sync tag to each contact"
-    )
-    sys.exit(2)
+    """
+    tags = {}
+    for email, acc in con.items():
+        info = acc.info_group if groups else acc.info
+        tags[email] = set(v.tag for v in info.values() if v.tag is not None)
+    alltags = set().union(*tags.values())
+    return alltags, {
+        email: (
+            con[email].scope.deleted
+            if con[email].scope is not None and not groups
+            else alltags - t
+        )
+        for email, t in tags.items()
+    }
 
-con = checked_email
 
+def changed_since(con, since, changes, groups=False):
+    """Find who has been modified since since, ignoring those made this run
 
-# ======================================
-# Sync ContactGroup
-# ======================================
-vprint("ContactGroups synchronization...")
-all_sync_tags_ContactGroups = set([])
-for email, acc in con.items():
-    all_sync_tags_ContactGroups.update(
-        [v["tag"] for v in acc.info_group.values() if v["tag"] is not None]
-    )
+    Parameters
+    ----------
+    con: dict
+        Maps email to Contacts
+    since: dict
+        Maps each email to the iso_key to look for changes after, see
+        load_watermarks
+    changes: ChangeSet
+        Of the run, those new this run are modified but don't need
+        syncing.  Neither do those the last run wrote and nobody has since
+        (see save_watermarks), nor those without a tag (held back as
+        duplicates, see sync_contacts)
+    groups: bool
+        Look at the ContactGroups (info_group) instead of the contacts (info)
 
+    Returns
+    -------
+    dict:
+        Maps tag to [(acc, rn, updated)] of the accounts it was modified in
 
-# deletions are detected by missing tags, store the tags to delete in here
-vprint("ContactGroups - Checking what to delete")
-todel = set([])
-for email, acc in con.items():
-    # tags in acc
-    tags = set(v["tag"] for v in acc.info_group.values() if v["tag"] is not None)
-    rm = all_sync_tags_ContactGroups - tags
-    if rm:
-        print(f"{email}: {len(rm)} ContactGroup(s) deleted")
-    todel.update(rm)
-if todel:
+    """
+    t2aru = {}
     for email, acc in con.items():
-        print(f"removing ContactGroups from {email}: ", end="")
-        for tag in todel:
-            acc.delete_contactGroup(tag)
-        vprint("")
+        info = acc.info_group if groups else acc.info
+        ours = acc.last_written_groups if groups else acc.last_written
+        new = (changes.groups if groups else changes).new(acc)
+        tru = [
+            (v.tag, rn, v.updated)
+            for rn, v in info.items()
+            if v.updated > since[email] and v.tag is not None
+            and rn not in new and ours.get(rn) != v.etag
+        ]
+        for t, rn, u in tru:
+            t2aru.setdefault(t, []).append((acc, rn, u))
+    return t2aru
 
 
-# if there was anything deleted, get all contact info again (so those removed
-# are gone from our cached lists)
-if todel:
-    for acc in con.values():
-        acc.get_info()
+def label_tags(acc, rn):
+    """Return the sync tags of the labels of acc's contact rn"""
+    return set(
+        acc.info_group[g].tag for g in acc.info[rn].groups
+        if g in acc.info_group
+    )
 
 
-# new group won't have a tag
-vprint("ContactGroups - Checking for new ContactGroup")
-added = []
-for email, acc in con.items():
-    # maps tag to (rn, name)
-    toadd = [(rn, v["name"]) for rn, v in acc.info_group.items() if v["tag"] is None]
-    if toadd:
-        vprint(f"{email}: these are new {list(i[1] for i in toadd)}")
-    for rn, name in toadd:
-        # assign a new tag to this ContactGroup
-        tag = new_tag()
-        acc.update_contactGroup_tag(rn, tag)
-        newcontact = acc.get_contactGroup_wait_SYNC_TAG(rn,args.verbose)
+def scope_copies(con, changes):
+    """Find the people that have come into the scope of an account
 
-      
-        
+    Those with one of its scope's labels in another account, that it hasn't
+    got in scope.  If it has them outside the scope they are brought back
+    into its info (so their labels get synced) and listed in changes, the
+    others need copying.
 
+    Returns
+    -------
+    dict:
+        Maps each account with a Scope to a dict mapping the tags it needs a
+        copy of to the (Contacts, rn) of their newest copy
+    """
+    newest = {}
+    for acc in con.values():
+        for rn, v in acc.info.items():
+            if v.tag is None or changes.is_deleted(v.tag):
+                continue
+            if v.tag not in newest or v.updated > newest[v.tag][2]:
+                newest[v.tag] = (acc, rn, v.updated)
 
-        
+    tocopy = {}
+    for other in con.values():
+        if other.scope is None:
+            continue
+        want = other.scope.tags(other)
+        missing = {
+            tag: (acc, rn) for tag, (acc, rn, _) in newest.items()
+            if not changes.has(other, tag) and want & label_tags(acc, rn)
+        }
+        back = {
+            other.scope.outside[t]: t for t in missing
+            if t in other.scope.outside
+        }
+        for p in other.iter_people(back):
+            other.info_add(p)
+            other.members.add(p["resourceName"])
+            changes.listed(other, p["resourceName"])
+            missing.pop(back[p["resourceName"]], None)
+        if back:
+            vprint(f"{other.user}: {len(back)} contact(s) back in scope")
+        tocopy[other] = missing
+    return tocopy
+
+
+def sync_memberships(con, t2aru, changes, stats, sched):
+    """Give the changed contacts the same labels in every account
+
+    The labels (memberships) of each contact in the account it was last
+    modified in are compared, by the groups' sync tags, with the labels of its
+    copies.  The differences are applied per label with
+    contactGroups.members.modify, so labelling many people takes a few
+    requests instead of a contact update each.
 
-        print(newcontact)
-        # record this is a new ContactGroup so we won't try syncing them laster
-        added.append((acc, rn))
+    Parameters
+    ----------
+    con: dict
+        Maps email to Contacts
+    t2aru: dict
+        The changed contacts, see changed_since
+    changes: ChangeSet
+        Of the run, to find each contact's copies and each label by its tag,
+        the copies made this run already have the labels
+    sched: Scheduler
+        To queue the changes on, each with the key ("label", tags) naming the
+        contacts it is for
 
-        # now add them to all the other accounts
-        for otheremail, other in con.items():
-            if other == acc:
+    """
+    # maps (acc, group rn) to ([rns to add], [rns to remove], {tags})
+    todo = {}
+    for tag, val in t2aru.items():
+        acc, rn = max(val, key=lambda x: x[2])[:2]
+        want = label_tags(acc, rn) - {None}
+        changed = False
+        for other in con.values():
+            orn = changes.rn(other, tag)
+            if other == acc or orn is None or changes.is_new(other, orn):
                 continue
-            vprint(f"adding {name} to {otheremail}")
-
-            tmp = {
-                "contactGroup": {
-                    "name": newcontact["name"],
-                    "clientData": newcontact["clientData"],
-                }
-            }
-            p = other.add_contactGroup(tmp)
-            added.append((other, p["resourceName"]))
+            have = label_tags(other, orn) - {None}
+            for i, gtags in enumerate([want - have, have - want]):
+                for gtag in gtags:
+                    grn = changes.groups.rn(other, gtag)
+                    if grn is not None:
+                        job = todo.setdefault((other, grn), ([], [], set([])))
+                        job[i].append(orn)
+                        job[2].add(tag)
+                        changed = True
+        if changed:
+            stats["labels"] += 1
+
+    for (other, grn), (add, remove, tags) in todo.items():
+        vprint(
+            f"{other.info_group[grn].name}: adding {len(add)}, "
+            f"removing {len(remove)}"
+        )
+        # each person added or removed counts as a write
+        members = [(rn, True) for rn in add] + [(rn, False) for rn in remove]
+        n = sched.chunk(len(members))
+        for i in range(0, len(members), n):
+            part = members[i:i + n]
+            sched.submit(
+                other,
+                scheduler.LABEL,
+                other.modify_members,
+                grn,
+                [rn for rn, adding in part if adding],
+                [rn for rn, adding in part if not adding],
+                verbose=args.verbose,
+                key=("label", sorted(tags)),
+                writes=len(part),
+            )
 
-# updates.  we want to see who has been modified since last run.  of course
-# anyone just added will have been modified, so ignore those in added
-lastupdate = dateutil.parser.isoparse(cp["DEFAULT"]["last"])
 
-# maps tag to [(acc, rn, updated)] where update must be newer than our last run
-t2aru = {}
+def sync_groups(con, since, changes, stats):
+    """Sync the ContactGroups (labels) between the accounts in con
 
-for email, acc in con.items():
-    tru = [
-        (v["tag"], rn, v["updated"])
-        for rn, v in acc.info_group.items()
-        if v["updated"] > lastupdate and (acc, rn) not in added
-    ]
-    for t, rn, u in tru:
-        t2aru.setdefault(t, []).append((acc, rn, u))
-
-vprint(f"ContactGroups - There are {len(t2aru)} contactGroups to update")
-for tag, val in t2aru.items():
-    # find the account with most recent update
-    newest = max(val, key=lambda x: x[2])
-    acc, rn = newest[:2]
-    vprint(f"{acc.info_group[rn]['name']}: ", end="")
-    contactGroup = acc.get_contactGroup(rn)
-    for otheremail, otheracc in con.items():
-        if otheracc == acc:
-            continue
-        vprint(f"{otheremail} ", end="")
-        otheracc.update_contactGroup(tag, contactGroup)
-    vprint("")
-
-# ======================================
-# Sync Contact
-# ======================================
-vprint("Contacts synchronization...")
-# we need a full set of tags so we can detect changes.  ignore those that don't
-# have a tag yet, they will be additions
-
-# TODO: remove this code - for test purpose -> print all data from all accounts
-# for email, acc in con.items():
-#    vprint(email)
-#    for key, data in acc.info.items():
-#        name=data["name"]
-#        tag=data["tag"]
-#        etag=data["etag"]
-#        vprint(name," - ",tag," - ",etag," - ",key)
-
-
-for email, acc in con.items():
-    all_sync_tags.update([v["tag"] for v in acc.info.values() if v["tag"] is not None])
-
-# deletions are detected by missing tags, store the tags to delete in here
-vprint("Checking what to delete")
-todel = set([])
-for email, acc in con.items():
-    # tags in acc
-    tags = set(v["tag"] for v in acc.info.values() if v["tag"] is not None)
-    rm = all_sync_tags - tags
-    if rm:
-        vprint(f"{email}: {len(rm)} contact(s) deleted")
-    todel.update(rm)
-if todel:
+    since maps each email to when to look for changed groups after, see
+    load_watermarks.  What is done is recorded in changes.groups, the run's
+    ChangeSet of the ContactGroups.
+    """
+    vprint("ContactGroups synchronization...")
+    groups = changes.groups
+
+    # deletions are detected by missing tags
+    vprint("ContactGroups - Checking what to delete")
+    gone = set([])
+    for email, rm in missing_tags(con, groups=True)[1].items():
+        if rm:
+            print(f"{email}: {len(rm)} ContactGroup(s) deleted")
+        gone.update(rm)
+    if gone:
+        for email, acc in con.items():
+            print(f"removing ContactGroups from {email}: ", end="")
+            groups.delete(acc, [t for t in gone if groups.has(acc, t)])
+            with tracer.span("group deletes", email):
+                try:
+                    acc.delete_contactGroups(gone)
+                except TimeoutError as e:
+                    # their tags are still missing, the next run deletes
+                    # them again
+                    print("\n", "[ERROR] ", e)
+            vprint("")
+        stats["groups deleted"] += len(gone)
+
+    # if there was anything deleted, get all contact info again (so those
+    # removed are gone from our cached lists)
+    if gone:
+        for email, acc in con.items():
+            with tracer.span("group deletes", email):
+                acc.relist(full=None)
+
+    # new group won't have a tag
+    vprint("ContactGroups - Checking for new ContactGroup")
     for email, acc in con.items():
-        vprint(f"removing contacts from {email}: ", end="")
-        for tag in todel:
-            acc.delete(tag, verbose=args.verbose)
-        vprint("")
-
-# if there was anything deleted, get all contact info again (so those removed
-# are gone from our cached lists)
-if todel:
-    for acc in con.values():
-        acc.get_info()
-
-# new people won't have a tag
-vprint("Checking for new people")
-added = []
-for email, acc in con.items():
-    # maps tag to (rn, name)
-    toadd = [(rn, v["name"]) for rn, v in acc.info.items() if v["tag"] is None]
-    if toadd:
-        vprint(f"{email}: these are new {list(i[1] for i in toadd)}")
-    for rn, name in toadd:
-        # assign a new tag to this person
-        tag = new_tag()
-        acc.update_tag(rn, tag)
-        newcontact = acc.get(rn)
-
-        # record this is a new person so we won't try syncing them laster
-        added.append((acc, rn))
-
-        # ADD PERSON WITH LABEL ( ContactGroup )
-        #
-        # Before adding a new person, check which ContactGroup he is in
-        # if it is only in the standard one (myContacts - it has no label)
-        #   I continue as old code
-        # if it is 1 or more -> get the label sync tag
-        #   I look for the tag in the list of labels of the other account (I
-        #   retrieve the ResourceName)
-        # set the correct resource name
-        # get RN of the contactGroup - labels ( except myContacts)
-        groupRNs = [
-            grp["contactGroupMembership"]["contactGroupResourceName"]
-            for grp in newcontact["memberships"]
-            if (
-                "contactGroupMembership" in grp
-                and grp["contactGroupMembership"]["contactGroupResourceName"]
-                != "contactGroups/myContacts"
-            )
-        ]
-        # get syncTag for each RN
-        groupTags = [acc.rn_to_tag_contactGroup(groupRN) for groupRN in groupRNs]
-
-        # remove all contactGroup ( label ) ( except myContacts)
-        newcontact["memberships"] = [
-            grp
-            for grp in newcontact["memberships"]
-            if (
-                "contactGroupMembership" in grp
-                and grp["contactGroupMembership"]["contactGroupResourceName"]
-                == "contactGroups/myContacts"
-            )
+        # maps tag to (rn, name)
+        toadd = [
+            (rn, v.name) for rn, v in acc.info_group.items() if v.tag is None
         ]
-
-        p = None
-
-        # now add them to all the other accounts
-        for otheremail, other in con.items():
-            if other == acc:
-                continue
-            vprint(f"adding {name} to {otheremail}")
-
-            # if there are tags to sync
-            if len(groupTags) > 0:
-                newcontactCopy = copy.deepcopy(newcontact)
-                for groupTag in groupTags:
-                    # retrieving the RN of other client based on the sync tag
-                    groupRN_other = other.tag_to_rn_contactGroup(groupTag)
-                    # add it to contact
-
-                    groupID_other = remove_prefix(groupRN_other, "contactGroups/")
-                    newcontactCopy["memberships"].append(
+        if not toadd:
+            continue
+        vprint(f"{email}: these are new {list(i[1] for i in toadd)}")
+        with tracer.span("group adds", email):
+            # assign a new tag to these ContactGroups.  The copies are made
+            # first and the group tagged last, so if a write times out the
+            # group is still new next run (and a copy already made is taken
+            # for deleted, as its tag is missing from the group)
+            tags = [(rn, new_tag()) for rn, name in toadd]
+
+            # add them to all the other accounts
+            try:
+                for otheremail, other in con.items():
+                    if other == acc:
+                        continue
+                    vprint(f"adding {[i[1] for i in toadd]} to {otheremail}")
+                    made = other.add_contactGroups([
                         {
-                            "contactGroupMembership": {
-                                "contactGroupId": groupID_other,
-                                "contactGroupResourceName": groupRN_other,
+                            "contactGroup": {
+                                "name": acc.contactGroups[rn]["name"],
+                                "clientData": tagged_client_data(
+                                    acc.contactGroups[rn].get("clientData", []),
+                                    tag,
+                                ),
                             }
                         }
-                    )
-
-                p = other.add(newcontactCopy)
-
-            else:  # if there aren't any, I just add
-                p = other.add(newcontact)
-            added.append((other, p["resourceName"]))
+                        for rn, tag in tags
+                    ])
+                    for p in made:
+                        rn = p["resourceName"]
+                        groups.add(other, rn, other.info_group[rn].tag)
+
+                # now tag them, the updates return the tagged groups, no need
+                # to read them back
+                acc.update_contactGroup_tags(tags)
+            except TimeoutError as e:
+                print("\n", "[ERROR] ", e)
+                continue
 
-# updates.  we want to see who has been modified since last run.  of course
-# anyone just added will have been modified, so ignore those in added
+            # record these are new ContactGroups so we won't try syncing them
+            # laster
+            for rn, tag in tags:
+                groups.tag(acc, rn, tag)
+                groups.add(acc, rn)
+            stats["groups added"] += len(toadd)
+
+    # updates.  we want to see who has been modified since last run.  of
+    # course anyone just added will have been modified, changed_since
+    # ignores those
+
+    t2aru = changed_since(con, since, changes, groups=True)
+
+    vprint(f"ContactGroups - There are {len(t2aru)} contactGroups to update")
+    with tracer.span("group updates"):
+        # maps account to the (tag, group) to update it to
+        toupdate = {acc: [] for acc in con.values()}
+        for tag, val in t2aru.items():
+            # find the account with most recent update
+            newest = max(val, key=lambda x: x[2])
+            acc, rn = newest[:2]
+            vprint(f"{acc.info_group[rn].name}: ", end="")
+            contactGroup = acc.contactGroups[rn]
+            for otheremail, otheracc in con.items():
+                if otheracc == acc:
+                    continue
+                vprint(f"{otheremail} ", end="")
+                toupdate[otheracc].append((tag, contactGroup))
+                if groups.has(otheracc, tag):
+                    groups.update(otheracc, groups.rn(otheracc, tag))
+            vprint("")
+            stats["groups updated"] += 1
+        for otheremail, otheracc in con.items():
+            if toupdate[otheracc]:
+                with tracer.span("group updates", otheremail):
+                    otheracc.update_contactGroups(toupdate[otheracc])
+
+
+def sync_contacts(con, since, changes, stats, photos, digests,
+                  holddupes=False, budget=None, carry=None):
+    """Sync the contacts between the accounts in con
+
+    since maps each email to when to look for changed contacts after, see
+    load_watermarks.  What is done is recorded in changes, the run's
+    ChangeSet.
+
+    The changes are worked out here, the writes they need are queued on a
+    Scheduler so each account is written to at its own pace.
+
+    With holddupes, new people that look like a duplicate of somebody else in
+    their account (see dupes.py) are left alone, not tagged nor copied, until
+    they are merged or deleted.
+
+    Accounts with a Scope only get copies of the people with one of its
+    labels, and have those that come into the scope copied to them.
+
+    With a budget, the writes it has no room for are skipped and returned as
+    the carry over for the next run, which passes it back in as carry: the
+    copies not made yet are made first (and aren't taken for deletions), the
+    contacts whose updates or labels weren't written are synced again.
+    Writes that time out are carried over the same way, and so are the tags
+    of new people (which the budget never skips), the copies made already
+    have them.
 
-lastupdate = dateutil.parser.isoparse(cp["DEFAULT"]["last"])
+    Returns
+    -------
+    dict:
+        The carry over, {"add": {tag: (source email, {target emails})},
+        "changed": {tags}, "tag": {tag: (source email, rn)}}
 
-# maps tag to [(acc, rn, updated)] where update must be newer than our last run
-t2aru = {}
+    """
+    vprint("Contacts synchronization...")
+    sched = Scheduler(budget)
+    carry = carry or new_carry()
+
+    # the tags the last run didn't get written, put back before the deletions
+    # are looked for, so the copies that have them aren't taken for deleted
+    for tag, (src, rn) in carry["tag"].items():
+        acc = con.get(src)
+        if acc is not None and rn in acc.info and acc.info[rn].tag is None:
+            acc.info[rn].tag = tag
+            changes.tag(acc, rn, tag)
+            sched.submit(
+                acc, scheduler.TAG, acc.update_tag, rn, tag,
+                key=("tag", tag, src, rn),
+            )
 
-for email, acc in con.items():
-    tru = [
-        (v["tag"], rn, v["updated"])
-        for rn, v in acc.info.items()
-        if v["updated"] > lastupdate and (acc, rn) not in added
-    ]
-    for t, rn, u in tru:
-        t2aru.setdefault(t, []).append((acc, rn, u))
-
-vprint(f"There are {len(t2aru)} contacts to update")
-for tag, val in t2aru.items():
-    # find the account with most recent update
-    newest = max(val, key=lambda x: x[2])
-    acc, rn = newest[:2]
-    vprint(f"{acc.info[rn]['name']}: ", end="")
-    contact = acc.get(rn)
-
-    # before sending the update
-    # I take all the RNs of the labels  (except myContacts)
-    # get the label sync tag
-    # for each tag, get the RN in the other account
-
-    # get RN of the contactGroup - labels (except myContacts)
-    groupRNs = [
-        grp["contactGroupMembership"]["contactGroupResourceName"]
-        for grp in contact["memberships"]
-        if (
-            "contactGroupMembership" in grp
-            and grp["contactGroupMembership"]["contactGroupResourceName"]
-            != "contactGroups/myContacts"
-        )
-    ]
-    # get syncTag for each RN
-    groupTags = [acc.rn_to_tag_contactGroup(groupRN) for groupRN in groupRNs]
-
-    # remove all contactGroup ( label ) ( except myContacts)
-    contact["memberships"] = [
-        grp
-        for grp in contact["memberships"]
-        if (
-            "contactGroupMembership" in grp
-            and grp["contactGroupMembership"]["contactGroupResourceName"]
-            == "contactGroups/myContacts"
+    # deletions are detected by missing tags
+    vprint("Checking what to delete")
+    ring_sync_tags, missing = missing_tags(con)
+    all_sync_tags.update(ring_sync_tags)
+    # the copies carried over from the last run aren't missing, just not made
+    for tag, (src, emails) in carry["add"].items():
+        for email in emails:
+            if email in missing:
+                missing[email].discard(tag)
+    gone = set([])
+    for email, rm in missing.items():
+        if rm:
+            vprint(f"{email}: {len(rm)} contact(s) deleted")
+        gone.update(rm)
+    if gone:
+        for email, acc in con.items():
+            vprint(f"removing contacts from {email}: ", end="")
+            with tracer.span("contact deletes", email):
+                tags = [t for t in gone if changes.has(acc, t)]
+                rns = [changes.rn(acc, t) for t in tags]
+                changes.delete(acc, tags)
+                for rn in rns:
+                    vprint(f"{acc.info[rn].name} ", end="")
+                    # forget them now, so they are gone from our cached lists
+                    acc.forget(rn)
+                n = sched.chunk(MAX_BATCH_DELETE)
+                for i in range(0, len(rns), n):
+                    sched.submit(
+                        acc, scheduler.DELETE, acc.delete_rns, rns[i:i + n],
+                        writes=len(rns[i:i + n]),
+                    )
+            vprint("")
+        stats["deleted"] += len(gone)
+
+    # the people that have come into the scopes of accounts
+    tocopy = scope_copies(con, changes)
+
+    # the photos are copied once the writes are done, they mustn't change the
+    # etags of the people being updated.  (src, rn, tag, targets, new)
+    topush = []
+
+    def add_copy(acc, rn, tag, other, body, targets):
+        """Queue making a copy of acc's rn in other"""
+
+        def made(p):
+            targets.append((other, p["resourceName"]))
+            changes.add(other, p["resourceName"])
+            if other.scope is not None:
+                other.scope.added[tag] = p["resourceName"]
+
+        sched.submit(
+            other,
+            scheduler.ADD,
+            other.add,
+            translate_memberships(body, membership_table(acc, other)),
+            callback=made,
+            key=("add", tag, acc.user, other.user),
         )
-    ]
 
-    for otheremail, otheracc in con.items():
-        if otheracc == acc:
-            continue
-        vprint(f"{otheremail} ", end="")
-
-        if len(groupTags) > 0:
-            contactCopy = copy.deepcopy(contact)
-            for groupTag in groupTags:
-                # retrieving the RN of the other client based on the sync tag
-                rn = otheracc.tag_to_rn_contactGroup(groupTag)
-                # might be None if tag was starred or other system group
-                if not rn:
-                    continue
-                gid = remove_prefix(rn, "contactGroups/")
-                contactCopy["memberships"].append(
-                    {
-                        "contactGroupMembership": {
-                            "contactGroupId": gid,
-                            "contactGroupResourceName": rn,
-                        }
-                    }
+    # the copies the last run didn't get to go first
+    if carry["add"]:
+        vprint(f"Making {len(carry['add'])} contact(s) carried over")
+    with tracer.span("contact adds"):
+        for tag, (src, emails) in carry["add"].items():
+            acc = con.get(src)
+            rn = changes.rn(acc, tag) if acc is not None else None
+            if rn is None:
+                # gone since
+                continue
+            contact = acc.get(rn)
+            targets = []
+            for other in con.values():
+                if other.user in emails and not changes.has(other, tag):
+                    vprint(f"adding {acc.info[rn].name} to {other.user}")
+                    add_copy(acc, rn, tag, other, contact, targets)
+            topush.append((acc, rn, tag, targets, True))
+
+    # and the people that have come into the scope of an account
+    with tracer.span("contact adds"):
+        bysource = {}
+        for other, missing in tocopy.items():
+            for tag, (acc, rn) in missing.items():
+                bysource.setdefault((acc, rn, tag), []).append(other)
+        for (acc, rn, tag), others in bysource.items():
+            contact = acc.get(rn)
+            targets = []
+            for other in others:
+                vprint(f"adding {acc.info[rn].name} to {other.user} (scope)")
+                add_copy(acc, rn, tag, other, contact, targets)
+            topush.append((acc, rn, tag, targets, True))
+            stats["added"] += 1
+
+    # new people won't have a tag
+    vprint("Checking for new people")
+    for email, acc in con.items():
+        # maps tag to (rn, name)
+        toadd = [(rn, v.name) for rn, v in acc.info.items() if v.tag is None]
+        if toadd and holddupes:
+            with tracer.span("duplicate check", email):
+                held = dupes.held_back(acc, [rn for rn, _ in toadd])
+            if held:
+                print(
+                    f"{email}: not copying {len(held)} new contact(s) that "
+                    f"look like duplicates "
+                    f"{list(name for rn, name in toadd if rn in held)}, "
+                    f"merge them (see dupes.py)"
+                )
+                toadd = [(rn, name) for rn, name in toadd if rn not in held]
+                stats["held back"] += len(held)
+        if toadd:
+            vprint(f"{email}: these are new {list(i[1] for i in toadd)}")
+        with tracer.span("contact adds", email):
+            for rn, name in toadd:
+                # assign a new tag to this person, the copies get it from
+                # newcontact's clientData
+                tag = new_tag()
+                newcontact = acc.get(rn)
+                newcontact["clientData"] = tagged_client_data(
+                    newcontact.get("clientData", []), tag
+                )
+                sched.submit(
+                    acc, scheduler.TAG, acc.update_tag, rn, tag,
+                    key=("tag", tag, email, rn),
                 )
 
-            otheracc.update(tag, contactCopy, verbose=args.verbose)
+                # record this is a new person so we won't try syncing them laster
+                changes.tag(acc, rn, tag)
+                changes.add(acc, rn)
+                stats["added"] += 1
+
+                # now add them to all the other accounts, with their labels
+                # (ContactGroups) swapped for the other account's ones
+                targets = []
+                labels = label_tags(acc, rn)
+                for otheremail, other in con.items():
+                    if other == acc:
+                        continue
+                    if other.scope is not None and not (
+                        other.scope.tags(other) & labels
+                    ):
+                        continue
+                    vprint(f"adding {name} to {otheremail}")
+                    add_copy(acc, rn, tag, other, newcontact, targets)
+                digests[tag] = body_digest(newcontact)
+                topush.append((acc, rn, tag, targets, True))
+
+    # updates.  we want to see who has been modified since last run.  of
+    # course anyone just added will have been modified, changed_since
+    # ignores those
+
+    t2aru = changed_since(con, since, changes)
+    # and those whose updates or labels the last run didn't get to
+    for tag in carry["changed"]:
+        if tag not in t2aru:
+            aru = [
+                (acc, changes.rn(acc, tag),
+                 acc.info[changes.rn(acc, tag)].updated)
+                for acc in con.values()
+                if changes.has(acc, tag)
+            ]
+            if aru:
+                t2aru[tag] = aru
+
+    vprint(f"There are {len(t2aru)} contacts to update")
+    with tracer.span("contact updates"):
+        for tag, val in t2aru.items():
+            # find the account with most recent update
+            newest = max(val, key=lambda x: x[2])
+            acc, rn = newest[:2]
+            vprint(f"{acc.info[rn].name}: ", end="")
+            contact = acc.get(rn)
+            targets = [
+                (otheracc, changes.rn(otheracc, tag))
+                for otheracc in con.values()
+                if otheracc != acc and changes.has(otheracc, tag)
+            ]
+
+            # the labels are left to sync_memberships, if they are all that
+            # changed there is nothing to update
+            digest = body_digest(contact)
+            if digests.get(tag) == digest:
+                vprint("only labels changed")
+            else:
+                contact = without_memberships(contact)
+                for otheracc, orn in targets:
+                    vprint(f"{otheracc.user} ", end="")
+                    changes.update(otheracc, orn)
+                    sched.submit(
+                        otheracc,
+                        scheduler.UPDATE,
+                        otheracc.update_rn,
+                        orn,
+                        contact,
+                        verbose=args.verbose,
+                        fields=content_update_person_fields,
+                        key=("update", [tag]),
+                    )
+                vprint("")
+                digests[tag] = digest
+                stats["updated"] += 1
+            topush.append((acc, rn, tag, targets, False))
+
+    with tracer.span("label updates"):
+        sync_memberships(con, t2aru, changes, stats, sched)
+
+    vprint("Waiting for the writes to be done")
+    with tracer.span("contact writes"):
+        sched.join()
+    for acc, secs in sched.busy.items():
+        tracer.add("contact writes", acc.user, secs)
+
+    carry = new_carry()
+    for key in sched.skipped:
+        if key is None:
+            # a delete, the next run finds the tags missing again
+            continue
+        if key[0] == "add":
+            _, tag, src, email = key
+            carry["add"].setdefault(tag, (src, set([])))[1].add(email)
+        elif key[0] == "tag":
+            _, tag, src, rn = key
+            carry["tag"][tag] = (src, rn)
         else:
-            otheracc.update(tag, contact, verbose=args.verbose)
-    vprint("")
-
-
-if len(new_con) != 0:
+            if key[0] == "update":
+                # so the content is pushed again next time
+                for tag in key[1]:
+                    digests.pop(tag, None)
+            carry["changed"].update(key[1])
+    stats["carried"] += sched.unwritten
+    stats["timed out"] += sched.timeouts
+
+    if photos:
+        for src, rn, tag, targets, new in topush:
+            photos.push(src, rn, tag, targets, new=new)
+    return carry
+
+
+def new_carry():
+    """Return an empty carry over, see sync_contacts"""
+    return {"add": {}, "changed": set([]), "tag": {}}
+
+
+def load_carry(cfile):
+    """Return the carry over left by the last run, see sync_contacts"""
+    if exists(cfile):
+        with open(cfile, "rb") as f:
+            # those left before tags were carried over have no "tag"
+            return dict(new_carry(), **pickle.load(f))
+    return new_carry()
+
+
+def save_carry(cfile, carry):
+    """Save the carry over for the next run, removing cfile if there is none"""
+    if carry["add"] or carry["changed"] or carry["tag"]:
+        with open(cfile, "wb") as f:
+            pickle.dump(carry, f)
+    elif exists(cfile):
+        os.remove(cfile)
+
+
+def load_seeding(sfile):
+    """Return the emails of the accounts whose seeding was interrupted"""
+    if exists(sfile):
+        with open(sfile, "rb") as f:
+            return pickle.load(f)
+    return set([])
+
+
+def seed_new_accounts(con, new_con, stats, photos, digests, sfile,
+                      budget=None):
+    """Copy the groups and contacts of the synced accounts to new_con
+
+    The groups are made first, then the contacts are made MAX_BATCH_CREATE at
+    a time, each new account in a worker of its own.  While this goes on the
+    new accounts are recorded in sfile, so if it's interrupted (or the budget
+    runs out) the next run carries on (see load_seeding) making only the
+    groups and contacts a new account doesn't have yet.  A new account with a
+    Scope only gets the people with one of its labels.
+    """
     vprint("There are new accounts!")
-    # there are new mail registered
-    # get_info of all  the first "con" ( one is equal to another )
-    # use the info of this "con" as source and create:
-    # the contactGroup
-    # the contacts
+    with open(sfile, "wb") as f:
+        pickle.dump(set(new_con), f)
 
-    source = con[next(iter(con))]
-    source.get_info()
+    # one that has everybody, if there is one
+    source = next(
+        (acc for acc in con.values() if acc.scope is None),
+        con[next(iter(con))],
+    )
+    # every contact gets pushed, so list them with all their fields, unless
+    # that was done already
+    if not source.full:
+        source.relist()
 
     # ======================================
     # Sync ContactGroup
     # ======================================
-    toadd = [(rn, v["name"]) for rn, v in source.info_group.items()]
-    if toadd:
-        vprint(f"contactsGroup to add: {list(i[1] for i in toadd)}")
-    for rn, name in toadd:
-        newcontact = source.get_contactGroup(rn)
-
-        # now add them to all the other accounts
-        for otheremail, other in new_con.items():
-            vprint(f"adding {name} to {otheremail}")
-            tmp = {
-                "contactGroup": {
-                    "name": newcontact["name"],
-                    "clientData": newcontact["clientData"],
+    for otheremail, other in new_con.items():
+        have = set(v.tag for v in other.info_group.values())
+        toadd = [
+            (rn, v.name) for rn, v in source.info_group.items()
+            if v.tag not in have
+        ]
+        if toadd:
+            vprint(f"contactsGroup to add: {list(i[1] for i in toadd)}")
+        try:
+            other.add_contactGroups([
+                {
+                    "contactGroup": {
+                        "name": source.contactGroups[rn]["name"],
+                        "clientData": source.contactGroups[rn]["clientData"],
+                    }
                 }
-            }
-            p = other.add_contactGroup(tmp)
+                for rn, name in toadd
+            ])
+        except TimeoutError as e:
+            # sfile is kept, the next run makes the groups still missing
+            print("\n", "[ERROR] ", e)
+            return
+        stats["groups added"] += len(toadd)
 
-    # get the ContactGroup just inserted
-    for newMail, newacc in new_con.items():
-        newacc.get_info()
     # ======================================
     # Sync Contact
     # ======================================
+    sched = Scheduler(budget)
+    # maps tag to the (account, rn) of the copies made so far, for the photos
+    targets = {}
+    start = time.perf_counter()
+    total = 0
+    done = 0
+    lock = threading.Lock()
+
+    def progress(made, other, chunk):
+        nonlocal done
+        with lock:
+            for (rn, tag), p in zip(chunk, made):
+                targets.setdefault(tag, []).append((other, p["resourceName"]))
+            done += len(made)
+            secs = time.perf_counter() - start
+            eta = secs * (total - done) / done if done else 0
+            print(
+                f"seeding: {done}/{total} contacts made, "
+                f"{eta / 60:.1f} minutes to go"
+            )
 
-    toadd = [(rn, v["name"]) for rn, v in source.info.items()]
-    if toadd:
-        vprint(f"{email}: contacts to add: {list(i[1] for i in toadd)}")
-    for rn, name in toadd:
-        newcontact = source.get(rn)
-        # ADD PERSON WITH LABEL ( ContactGroup )
-        #
-        # Before adding a new person, check which ContactGroup he is in
-        # if it is only in the standard one (myContacts - it has no label)
-        #   I continue as old code
-        # if it is 1 or more -> get the label sync tag
-        #   I look for the tag in the list of labels of the other account (I
-        #   retrieve the ResourceName)
-        # set the correct resource name
-        # get RN of the contactGroup - labels ( except myContacts)
-        groupRNs = [
-            grp["contactGroupMembership"]["contactGroupResourceName"]
-            for grp in newcontact["memberships"]
-            if (
-                "contactGroupMembership" in grp
-                and grp["contactGroupMembership"]["contactGroupResourceName"]
-                != "contactGroups/myContacts"
+    toadd = {}
+    for otheremail, other in new_con.items():
+        have = set(v.tag for v in other.info.values())
+        want = None
+        if other.scope is not None:
+            have |= set(other.scope.outside)
+            want = other.scope.tags(other)
+        toadd[other] = [
+            (rn, v.tag) for rn, v in source.info.items()
+            if v.tag not in have
+            and (want is None or want & label_tags(source, rn))
+        ]
+        vprint(f"{otheremail}: {len(toadd[other])} contacts to add")
+        total += len(toadd[other])
+    for other, rntags in toadd.items():
+        table = membership_table(source, other)
+        n = sched.chunk(MAX_BATCH_CREATE)
+        for i in range(0, len(rntags), n):
+            chunk = rntags[i:i + n]
+            sched.submit(
+                other,
+                scheduler.ADD,
+                other.add_many,
+                [
+                    translate_memberships(source.get(rn), table)
+                    for rn, tag in chunk
+                ],
+                callback=lambda made, other=other, chunk=chunk: (
+                    progress(made, other, chunk)
+                ),
+                writes=len(chunk),
             )
+    with tracer.span("contact writes"):
+        sched.join()
+
+    for rn, v in source.info.items():
+        if v.tag in targets:
+            stats["added"] += 1
+            # the accounts synced already may not have what the source was
+            # changed to since it was first listed, the next run compares
+            # it with the digest they were synced to
+            digests.setdefault(v.tag, body_digest(source.get(rn)))
+            if photos:
+                photos.push(source, rn, v.tag, targets[v.tag], new=True)
+    if sched.skipped:
+        print(
+            f"seeding: out of budget or timed out, {sched.unwritten} "
+            f"contact(s) left for the next run"
+        )
+        stats["carried"] += sched.unwritten
+        stats["timed out"] += sched.timeouts
+    else:
+        os.remove(sfile)
+
+
+# audit_ring puts the contacts' sync tags into this many buckets
+AUDIT_BUCKETS = 256
+
+
+def load_audit_cache(afile):
+    """Return the content digests of the last audit, see content_digests"""
+    return load_versioned(afile)
+
+
+def content_digests(acc, cache):
+    """Return the body_digest of each tagged contact of acc, by tag
+
+    Only the contacts whose etag has changed since the last audit have their
+    body looked at, listing the account with all its fields if that's
+    cheaper than getting them one at a time.
+
+    Parameters
+    ----------
+    acc: Contacts
+        The account
+    cache: dict
+        Maps rn to (etag, digest) as of the last audit, updated here
+    """
+    def stale():
+        return [
+            rn for rn, v in acc.info.items()
+            if v.tag is not None and cache.get(rn, (None,))[0] != v.etag
         ]
-        # get syncTag for each RN
-        groupTags = [source.rn_to_tag_contactGroup(groupRN) for groupRN in groupRNs]
-
-        # remove all contactGroup ( label ) ( except myContacts)
-        newcontact["memberships"] = [
-            grp
-            for grp in newcontact["memberships"]
-            if (
-                "contactGroupMembership" in grp
-                and grp["contactGroupMembership"]["contactGroupResourceName"]
-                == "contactGroups/myContacts"
+
+    rns = stale()
+    if (rns and not acc.full
+            and len(rns) >= FULL_LISTING_FRACTION * len(acc.info)):
+        acc.get_info(full=True)
+        rns = stale()
+    for rn in rns:
+        cache[rn] = (acc.info[rn].etag, body_digest(acc.get(rn)))
+    for rn in set(cache) - set(acc.info):
+        del cache[rn]
+    return {
+        v.tag: cache[rn][1] for rn, v in acc.info.items() if v.tag is not None
+    }
+
+
+def bucket_tree(acc, digests):
+    """Return the contacts of acc as buckets of leaves, and their digests
+
+    Each tagged contact is a leaf of its content digest (see content_digests)
+    and the sync tags of its labels.  The leaves are put into AUDIT_BUCKETS
+    buckets by a hash of their tag, so accounts with the same contacts have
+    the same digest for each bucket.
+
+    Returns
+    -------
+    (dict, dict):
+        Maps bucket to {tag: (digest, labels)}, and bucket to its digest
+    """
+    g2tag = {rn: v.tag for rn, v in acc.info_group.items() if v.tag is not None}
+    leaves = {}
+    for rn, v in acc.info.items():
+        if v.tag is None:
+            continue
+        labels = tuple(sorted(g2tag[g] for g in v.groups if g in g2tag))
+        b = int.from_bytes(
+            hashlib.blake2b(v.tag.encode(), digest_size=4).digest(), "big"
+        ) % AUDIT_BUCKETS
+        leaves.setdefault(b, {})[v.tag] = (digests[v.tag], labels)
+    tops = {
+        b: hashlib.blake2b(
+            json.dumps(
+                [[t, d.hex(), g] for t, (d, g) in sorted(ls.items())]
+            ).encode(),
+            digest_size=8,
+        ).digest()
+        for b, ls in leaves.items()
+    }
+    return leaves, tops
+
+
+def audit_ring(con, stats, digests, cache, repair=False):
+    """Check the accounts in con hold the same contacts, and fix them
+
+    The contacts of each account are compared a bucket at a time (see
+    bucket_tree), only the buckets whose digests differ are looked into.
+    That saves comparing every contact, not fetching them: the buckets are
+    made from the content digests of all the contacts, it's their cache
+    (see content_digests) that keeps the fetches down to the contacts
+    changed since the last audit.  A contact is out of sync if an account is
+    missing it or its copies differ in content or labels.  With repair the
+    newest copy (by updateTime) is copied to the accounts that differ or miss
+    it, so this undoes deletes that haven't been synced yet.
+
+    Parameters
+    ----------
+    con: dict
+        Maps email to Contacts, the accounts already synced
+    digests: dict
+        The body_digest of each tag as last pushed, updated for the repairs
+    cache: dict
+        Maps email to the content_digests cache of that account
+
+    """
+    dig = {}
+    trees = {}
+    for email, acc in con.items():
+        with tracer.span("audit digests", email):
+            dig[acc] = content_digests(acc, cache.setdefault(email, {}))
+            trees[acc] = bucket_tree(acc, dig[acc])
+        tags = [v.tag for v in acc.info.values() if v.tag is not None]
+        if len(tags) != len(dig[acc]):
+            print(
+                f"{email}: {len(tags) - len(dig[acc])} contacts share their "
+                f"sync tag with another, merge them"
             )
+    for email in set(cache) - set(con):
+        del cache[email]
+
+    buckets = set().union(*(tops for leaves, tops in trees.values()))
+    bad = [
+        b for b in buckets
+        if len(set(tops.get(b) for leaves, tops in trees.values())) > 1
+    ]
+    vprint(f"{len(bad)} of {len(buckets)} buckets differ")
+
+    # maps tag to (missing, content differs, labels differ)
+    diverged = {}
+    for b in bad:
+        vals = {acc: leaves.get(b, {}) for acc, (leaves, tops) in trees.items()}
+        for tag in set().union(*vals.values()):
+            leafs = [v.get(tag) for v in vals.values()]
+            present = [x for x in leafs if x is not None]
+            problems = (
+                len(present) != len(leafs),
+                len(set(d for d, g in present)) > 1,
+                len(set(g for d, g in present)) > 1,
+            )
+            if any(problems):
+                diverged[tag] = problems
+    stats["diverged"] = len(diverged)
+    print(f"{len(diverged)} contacts are out of sync")
+    if not diverged or not repair:
+        for tag, (missing, content, labels) in diverged.items():
+            what = [
+                w for w, p in zip(
+                    ["missing from some accounts", "content differs",
+                     "labels differ"],
+                    [missing, content, labels],
+                ) if p
+            ]
+            vprint(f"{tag}: {', '.join(what)}")
+        return
+
+    vprint("Repairing")
+    sched = Scheduler()
+    changes = ChangeSet()
+    relabel = {}
+    for tag, (missing, content, labels) in diverged.items():
+        copies = [
+            (acc, changes.rn(acc, tag), acc.info[changes.rn(acc, tag)].updated)
+            for acc in con.values() if changes.has(acc, tag)
         ]
+        src, srn, _ = max(copies, key=lambda x: x[2])
+        body = src.get(srn)
+        vprint(f"repairing {src.info[srn].name} from {src.user}")
+        for acc, rn, _ in copies:
+            if dig[acc][tag] != dig[src][tag]:
+                changes.update(acc, rn)
+                sched.submit(
+                    acc,
+                    scheduler.UPDATE,
+                    acc.update_rn,
+                    rn,
+                    without_memberships(body),
+                    fields=content_update_person_fields,
+                )
+                stats["updated"] += 1
+        for other in con.values():
+            if not changes.has(other, tag):
+                sched.submit(
+                    other,
+                    scheduler.ADD,
+                    other.add,
+                    translate_memberships(body, membership_table(src, other)),
+                    callback=lambda p, other=other: changes.add(
+                        other, p["resourceName"]
+                    ),
+                )
+                stats["added"] += 1
+        if labels:
+            relabel[tag] = copies
+        digests[tag] = body_digest(body)
+    sync_memberships(con, relabel, changes, stats, sched)
+    with tracer.span("contact writes"):
+        sched.join()
+    if sched.timeouts:
+        # still diverged, the next audit repairs them
+        print(f"repairing: {sched.timeouts} write(s) timed out")
+        stats["timed out"] += sched.timeouts
+
+
+def finish_photos(photos, stats, con):
+    """Wait for the photos to be copied
+
+    Those the last run had time out are copied (or deleted) first, con maps
+    email to the Contacts of every account.
+    """
+    if photos:
+        photos.retry(con)
+        vprint("Waiting for photos to be copied")
+        photos.close()
+        stats["photos"] = photos.uploaded + photos.deleted
 
-        p = None
-
-        # now add them to all the other accounts
-        for otheremail, other in new_con.items():
-            vprint(f"adding {name} to {otheremail}")
-            # if there are tags to sync
-            if len(groupTags) > 0:
-                newcontactCopy = copy.deepcopy(newcontact)
-                for groupTag in groupTags:
-                    # retrieving the RN of other client based on the sync tag
-                    groupRN_other = other.tag_to_rn_contactGroup(groupTag)
-                    # add it to contact
-
-                    groupID_other = remove_prefix(groupRN_other, "contactGroups/")
-                    newcontactCopy["memberships"].append(
-                        {
-                            "contactGroupMembership": {
-                                "contactGroupId": groupID_other,
-                                "contactGroupResourceName": groupRN_other,
-                            }
-                        }
+
+def update_search(sfile, con):
+    """Bring the SearchIndex in sfile up to date with the accounts in con
+
+    Only the contacts whose etag has changed since they were indexed have
+    their bodies read, so after the first time this costs little.  The people
+    written to this run are got again first (see Contacts.refresh), so the
+    index has the copies just made and the new etags.
+    """
+    index = SearchIndex(sfile)
+    if index.version() != DIGEST_VERSION:
+        # the digests are of another body_digest, index everybody again
+        index.set_accounts([])
+        index.set_version(DIGEST_VERSION)
+    index.set_accounts(list(con))
+    for email, acc in con.items():
+        known = index.etags(email)
+        if acc.written:
+            acc.refresh(acc.written)
+        stale = [rn for rn, v in acc.info.items() if known.get(rn) != v.etag]
+        # many bodies are cheaper listed than got one by one
+        if len([rn for rn in stale if rn not in acc.bodies]) >= (
+            FULL_LISTING_FRACTION * max(1, len(acc.info))
+        ):
+            acc.relist()
+            stale = [
+                rn for rn, v in acc.info.items() if known.get(rn) != v.etag
+            ]
+        index.drop(email, [rn for rn in known if rn not in acc.info])
+        vprint(f"{email}: indexing {len(stale)} contact(s) for search")
+        for rn in stale:
+            body = acc.get(rn)
+            v = acc.info[rn]
+            index.put(email, rn, v.etag, v.tag, body, body_digest(body))
+    index.close()
+
+
+def close_cache(cache):
+    """Save the BodyCache (if there is one)"""
+    if cache is not None:
+        vprint(f"body cache: {cache.hits} hits, {cache.misses} misses")
+        cache.close()
+
+
+def sync_ring(ring, accounts, settings, cdir):
+    """Sync the accounts of one ring
+
+    Parameters
+    ----------
+    ring: str
+        Name of the ring
+    accounts: dict
+        Maps config section name to its settings (user, keyfile, credfile)
+    settings: dict
+        The ring's settings, see ring_settings
+    cdir: pathlib.Path
+        The config directory, the ring keeps its backups and state in here
+
+    Returns
+    -------
+    (str, dict):
+        The new last time for the ring (ISO format), and counts of what was
+        done (see STATS)
+
+    """
+    stats = dict.fromkeys(STATS, 0)
+    group_tables.clear()
+    # how much writing this run may do, see --max-runtime and --max-writes
+    budget = None
+    if args.max_runtime or args.max_writes is not None:
+        budget = Budget(args.max_runtime, args.max_writes)
+
+    # get the contacts for each user, only scanning for the changes since the
+    # last run if we can
+    vprint("Getting contacts")
+    changescan = configparser.ConfigParser.BOOLEAN_STATES[
+        settings.get("changescan", "no").lower()
+    ]
+    ifile = cdir / f"index-{ring}.pickle"
+    index = load_index(ifile) if changescan and not args.init else {}
+    # what was in and out of the scope of the accounts that have one
+    scfile = cdir / f"scopes-{ring}.pickle"
+    con = load_accounts(accounts, index, settings, load_scopes(scfile))
+    everyone = dict(con)
+
+    # the bodies of the contacts read in earlier runs, see Contacts.get
+    bodycache = None
+    cachemb = float(settings.get("bodycache", 64))
+    if cachemb > 0:
+        bodycache = BodyCache(
+            cdir / f"bodies-{ring}.sqlite", int(cachemb * 2**20)
+        )
+        for acc in con.values():
+            acc.cache = bodycache
+    stats["contacts"] = sum(len(acc.info) for acc in con.values())
+
+    backupdays = int(settings.get("backupdays", 0))
+    if backupdays > 0:
+        bdir = cdir / "backups"
+        if ring != DEFAULT_RING:
+            bdir = bdir / ring
+        with tracer.span("backup"):
+            backup(con, bdir, backupdays)
+
+    if args.audit or args.repair:
+        # the accounts that are new, or still being seeded, have nothing to
+        # compare yet
+        seeding = load_seeding(cdir / f"seeding-{ring}.pickle")
+        # nor have those with a scope got everybody
+        con = {
+            email: acc for email, acc in con.items()
+            if email not in seeding and acc.scope is None
+            and any(v.tag is not None for v in acc.info.values())
+        }
+        afile = cdir / f"audit-{ring}.pickle"
+        cache = load_audit_cache(afile)
+        dfile = cdir / f"digests-{ring}.pickle"
+        digests = load_digests(dfile)
+        with tracer.span("audit"):
+            audit_ring(con, stats, digests, cache, repair=args.repair)
+        save_versioned(afile, cache)
+        save_digests(dfile, digests)
+        # this wasn't a sync, the next one still starts from the last
+        close_cache(bodycache)
+        return settings["last"], stats
+
+    # contact photos are copied in the background while the rest is synced
+    photos = None
+    if configparser.ConfigParser.BOOLEAN_STATES[
+        settings.get("photos", "yes").lower()
+    ]:
+        photos = PhotoSync(cdir / f"photos-{ring}.pickle", verbose=args.verbose)
+
+    # what each contact's body was when last pushed, see body_digest
+    dfile = cdir / f"digests-{ring}.pickle"
+    digests = load_digests(dfile)
+
+    # each account is looked at for changes after its own watermarks, those
+    # without any yet (new ones, or from before there were watermarks) after
+    # the ring's last run
+    wfile = cdir / f"watermarks-{ring}.pickle"
+    marks = load_watermarks(wfile)
+    lastupdate = iso_key(settings["last"])
+    since = {}
+    gsince = {}
+    for email, acc in con.items():
+        people, groups, written, written_groups = marks.get(
+            email, (None, None, {}, {})
+        )
+        since[email] = people or lastupdate
+        gsince[email] = groups or lastupdate
+        acc.last_written, acc.last_written_groups = written, written_groups
+
+    # if many people will need their full body (always the case for --init) it
+    # is cheaper to list everybody with all their fields than to get them one
+    # by one
+    for email, acc in con.items():
+        many = acc.fetch_fraction(since[email]) >= FULL_LISTING_FRACTION
+        if args.init or many:
+            vprint(f"{email}: listing contacts with all their fields")
+            with tracer.span("full listing", email):
+                acc.get_info(full=True)
+
+    if args.init:
+        with tracer.span("init"):
+            init_accounts(con, stats, photos, digests)
+        with tracer.span("photos"):
+            finish_photos(photos, stats, everyone)
+        save_digests(dfile, digests)
+        save_watermarks(wfile, everyone, marks)
+        close_cache(bodycache)
+        return new_last(), stats
+
+    # if an account has no sync tags, the user needs to do a --init.  Those
+    # with no tags, or still being seeded, are new
+    vprint("Checking no new accounts")
+    checked_email = {}
+    new_con = {}
+    sfile = cdir / f"seeding-{ring}.pickle"
+    seeding = load_seeding(sfile)
+
+    for email, acc in con.items():
+        # (an account with a scope may have all its synced people outside it)
+        if email in seeding or (
+            all([v.tag is None for v in acc.info.values()])
+            and not (acc.scope is not None and acc.scope.outside)
+        ):
+            new_con[email] = acc
+        else:
+            checked_email[email] = acc
+
+    if len(checked_email) == 0:
+        print(
+            "all emails have no sync tags.  It looks like this is the first "
+            "time running this script for this account.  You need to pass "
+            "--init for me to assign the sync tag to each contact"
+        )
+        raise SyncError(2)
+
+    con = checked_email
+
+    # what the run does to each account, for the phases to look up
+    changes = ChangeSet()
+    sync_groups(con, gsince, changes, stats)
+    holddupes = configparser.ConfigParser.BOOLEAN_STATES[
+        settings.get("holddupes", "no").lower()
+    ]
+    # the writes the last run had no budget for, see sync_contacts.  They
+    # are kept until they're done, so last can move on regardless
+    cfile = cdir / f"carry-{ring}.pickle"
+    carry = sync_contacts(
+        con, since, changes, stats, photos, digests, holddupes, budget,
+        load_carry(cfile),
+    )
+    save_carry(cfile, carry)
+    if len(new_con) != 0:
+        with tracer.span("seeding"):
+            seed_new_accounts(
+                con, new_con, stats, photos, digests, sfile, budget
+            )
+    if stats["carried"]:
+        print(
+            f"out of budget or timed out, {stats['carried']} write(s) left "
+            f"for next run"
+        )
+    with tracer.span("photos"):
+        finish_photos(photos, stats, everyone)
+    if configparser.ConfigParser.BOOLEAN_STATES[
+        settings.get("search", "no").lower()
+    ]:
+        with tracer.span("search index"):
+            update_search(cdir / f"search-{ring}.sqlite", everyone)
+    save_digests(dfile, digests)
+    save_watermarks(wfile, everyone, marks)
+    save_scopes(scfile, everyone)
+    if changescan:
+        save_index(ifile, everyone)
+    close_cache(bodycache)
+
+    return new_last(), stats
+
+
+def run_ring(ring, accounts, settings, cdir, a):
+    """Sync one ring, catching its failures so the other rings carry on
+
+    This is what runs in the worker processes, so it is given the command
+    line arguments a.  A ring is never synced by two processes at once, if
+    its lock is held (an overlapping run) it is skipped.
+
+    With --profile the ring's cProfile stats and the time and peak memory of
+    each phase are written to profile-<ring>.pstats and profile-<ring>.txt in
+    cdir.
+
+    Returns
+    -------
+    (str, str or None, dict, int, str or None, list):
+        The ring, its new last time (None if it failed), the counts of what
+        was done, the exit status, an error message if it failed and the
+        phase timings (see Tracer.rows).
+
+    """
+    global args, log_prefix, tracer
+    args = a
+    if a.jobs > 1:
+        log_prefix = f"[{ring}]"
+    tracer = Tracer(memory=a.profile)
+
+    start = time.time()
+    with open(cdir / f"ring-{ring}.lock", "w") as lock:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return ring, None, {}, 3, "already being synced, skipped", []
+        profile = cProfile.Profile() if a.profile else None
+        try:
+            if profile:
+                profile.enable()
+            newlast, stats = sync_ring(ring, accounts, settings, cdir)
+        except SyncError as e:
+            return ring, None, {}, e.code, "needs attention, see above", []
+        except Exception:
+            print(traceback.format_exc())
+            return ring, None, {}, 1, traceback.format_exc(limit=0).strip(), []
+        finally:
+            if profile:
+                profile.disable()
+                profile.dump_stats(cdir / f"profile-{ring}.pstats")
+                with open(cdir / f"profile-{ring}.txt", "w") as f:
+                    f.write(
+                        table([(ring,) + r for r in tracer.rows()], memory=True)
+                        + "\n"
                     )
 
-                p = other.add(newcontactCopy)
-            else:  # if there aren't any, I just add
-                p = other.add(newcontact)
+    stats["seconds"] = round(time.time() - start, 1)
+    return ring, newlast, stats, 0, None, tracer.rows()
+
+
+def print_summary(results):
+    """Print a table of what was done in each ring, and the totals"""
+    cols = ["ring", "status"] + STATS + ["seconds"]
+    rows = []
+    totals = dict.fromkeys(STATS + ["seconds"], 0)
+    for ring, newlast, stats, code, err, spans in results:
+        rows.append(
+            [ring, "ok" if err is None else err]
+            + [str(stats.get(k, "")) for k in STATS + ["seconds"]]
+        )
+        for k in totals:
+            totals[k] += stats.get(k, 0)
+    nfail = sum(1 for r in results if r[4] is not None)
+    rows.append(
+        ["total", f"{nfail} failed"]
+        + [str(round(totals[k], 1)) for k in STATS + ["seconds"]]
+    )
+
+    widths = [max(len(c), *(len(r[i]) for r in rows)) for i, c in enumerate(cols)]
+    for r in [cols] + rows:
+        print("  ".join(c.ljust(w) for c, w in zip(r, widths)).rstrip())
+
+
+def main():
+    global args
+
+    # parse command line
+    p = argparse.ArgumentParser(
+        description="""
+Sync google contacts.
+
+If you have previously used github.com/michael-adler/sync-google-contacts which
+uses the csync-uid, after enabling the People API on all your accounts,
+editting your config file (you will be prompted about that), you should be all
+good to go.
+
+If you haven't synced contacts before you will have to go through an --init
+phase, again you will be prompted.
+
+Accounts are synced in rings, each account section can name its ring with
+ring = name (the default is a ring called default).  The rings are synced
+independently of each other, --jobs of them at a time.
+
+For full instructions see
+https://github.com/mrmattwilkins/google-contacts-sync
+    """,
+        epilog="""""",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    p.add_argument(
+        "--init", action="store_true", help="Initialize by syncing using names"
+    )
+    p.add_argument(
+        "--rlim", type=int, help="If --init, wait this many seconds between each sync"
+    )
+    p.add_argument(
+        "--audit",
+        action="store_true",
+        help="Instead of syncing, check every contact is the same in all the "
+        "accounts",
+    )
+    p.add_argument(
+        "--repair",
+        action="store_true",
+        help="Like --audit, and copy the newest version of the contacts that "
+        "differ to the accounts that differ (or miss them)",
+    )
+    p.add_argument(
+        "--max-runtime",
+        type=float,
+        help="Stop writing to the accounts of a ring after this many seconds, "
+        "the writes left are done first thing next run",
+    )
+    p.add_argument(
+        "--max-writes",
+        type=int,
+        help="Write at most this many changes per ring (a person deleted, "
+        "added, updated or added to or removed from a label each), the rest "
+        "are done first thing next run",
+    )
+    p.add_argument(
+        "--ring",
+        action="append",
+        help="Only sync this ring, can be given more than once",
+    )
+    p.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of rings to sync at the same time, each in its own process",
+    )
+    p.add_argument(
+        "--profile",
+        action="store_true",
+        help="Write cProfile stats and the time and peak memory of each phase "
+        "to profile-<ring>.pstats/.txt in the config directory",
+    )
+    p.add_argument("-v", "--verbose", action="store_true", help="Verbose output")
+    p.add_argument("-f", "--file", action="store_true", help="Save output to file")
+    args = p.parse_args()
+
+    # get the configuration file
+    vprint("Loading configuration")
+    cdir = config_dir()
+    cfile = cdir / "config.ini"
+    with tracer.span("config load"):
+        cp = load_config(cfile)
+    # the rings are timed by their own tracers
+    rows = [("",) + r for r in tracer.rows()]
+
+    rings = ring_sections(cp)
+    if args.ring:
+        unknown = set(args.ring) - set(rings)
+        if unknown:
+            print(f"There are no rings called {', '.join(sorted(unknown))}")
+            sys.exit(2)
+        rings = {r: s for r, s in rings.items() if r in args.ring}
+
+    todo = [
+        (
+            ring,
+            {s: dict(cp[s]) for s in sections},
+            ring_settings(cp, ring),
+            cdir,
+            args,
+        )
+        for ring, sections in rings.items()
+    ]
+
+    if args.jobs > 1 and len(todo) > 1:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs)
+        results = (f.result() for f in concurrent.futures.as_completed(
+            [pool.submit(run_ring, *t) for t in todo]
+        ))
+    else:
+        pool = None
+        results = (run_ring(*t) for t in todo)
+
+    done = []
+    for result in results:
+        ring, newlast, stats, code, err, spans = result
+        # update the last updated field as soon as the ring is done
+        if newlast is not None:
+            save_config(cp, cfile, ring, newlast)
+        done.append(result)
+        if len(todo) > 1:
+            print(
+                f"ring {ring} {'done' if err is None else 'FAILED: ' + err} "
+                f"({len(done)}/{len(todo)})"
+            )
+    if pool is not None:
+        pool.shutdown()
+
+    if len(todo) > 1:
+        print_summary(done)
+    if args.verbose or args.profile:
+        for r in done:
+            rows += [(r[0],) + s for s in r[5]]
+        print(table(rows, memory=args.profile))
+
+    sys.exit(max([r[3] for r in done], default=0))
 
 
-# update the last updated field
-save_config(cp, cfile)
+if __name__ == "__main__":
+    main()
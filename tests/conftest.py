@@ -0,0 +1,16 @@
+import sys
+import pathlib
+
+import pytest
+
+# the modules are at the top of the repo, not in a package
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+@pytest.fixture
+def portable(tmp_path, monkeypatch):
+    """Run in an empty directory with a PORTABLE.md, so the config is in conf/"""
+    (tmp_path / 'PORTABLE.md').touch()
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
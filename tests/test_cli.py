@@ -0,0 +1,24 @@
+import sys
+import subprocess
+
+import pytest
+
+from conftest import ROOT
+
+
+def run(script, *args):
+    return subprocess.run(
+        [sys.executable, str(ROOT / script), *args],
+        capture_output=True, text=True, timeout=60,
+    )
+
+
+@pytest.mark.parametrize('script', ['export.py', 'dupes.py'])
+def test_verbose_without_config(portable, script):
+    # with no config one is made and the tool exits, having printed (through
+    # sync's print) what it loaded
+    r = run(script, '-v')
+    assert 'Traceback' not in r.stderr
+    assert r.returncode == 1
+    assert 'Made config file' in r.stdout
+    assert (portable / 'conf' / 'config.ini').exists()
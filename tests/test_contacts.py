@@ -0,0 +1,30 @@
+import pickle
+
+import google.oauth2.credentials
+
+from contacts import Contacts, Info
+
+
+def make_contacts(tmp_path, **kwargs):
+    """Return a Contacts with a made up token, nothing is asked of Google"""
+    credfile = tmp_path / 'token'
+    with open(credfile, 'wb') as f:
+        pickle.dump(google.oauth2.credentials.Credentials('token'), f)
+    return Contacts('keyfile.json', str(credfile), 'a@example.com', False,
+                    info=False, **kwargs)
+
+
+def test_pickle(tmp_path):
+    # sync.backup pickles the accounts, with everything they use at runtime
+    acc = make_contacts(tmp_path, hedge=95, rate=10)
+    acc.cache = object()
+    acc.info = {'people/1': Info('e1', 'tag1', 'Ann', '2024-01-01T00:00:00Z')}
+    acc.bodies = {'people/1': {'names': [{'displayName': 'Ann'}]}}
+
+    copy = pickle.loads(pickle.dumps(acc))
+    assert copy.user == 'a@example.com'
+    assert copy.info['people/1'].tag == 'tag1'
+    assert copy.bodies == acc.bodies
+    assert copy.service is None and copy.cache is None
+    # and it can be backed up again
+    pickle.dumps(copy)
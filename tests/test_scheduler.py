@@ -0,0 +1,58 @@
+import threading
+
+import scheduler
+from scheduler import Budget, Scheduler
+
+
+def blocked(budget=None):
+    """Return a Scheduler, an account and an Event its worker waits for
+
+    So the work submitted before the Event is set is done in priority order.
+    """
+    sched = Scheduler(budget)
+    acc = object()
+    go = threading.Event()
+    sched.submit(acc, scheduler.DELETE, go.wait, writes=0)
+    return sched, acc, go
+
+
+def test_budget():
+    sched, acc, go = blocked(Budget(writes=3))
+    done = []
+    for priority, name, writes in [
+        (scheduler.LABEL, 'label', 2),
+        (scheduler.UPDATE, 'update', 1),
+        (scheduler.ADD, 'add1', 2),
+        (scheduler.TAG, 'tag', 5),
+        (scheduler.ADD, 'add2', 1),
+    ]:
+        sched.submit(acc, priority, done.append, name, key=name, writes=writes)
+    assert sched.chunk(10) == 3
+    go.set()
+    sched.join()
+
+    # the tagging is never skipped nor charged, the rest take the budget in
+    # priority order and the writes left are carried in that order
+    assert done == ['tag', 'add1', 'add2']
+    assert sched.skipped == ['update', 'label']
+    assert sched.unwritten == 3
+    assert sched.timeouts == 0
+
+
+def test_timeout():
+    sched, acc, go = blocked()
+
+    def slow():
+        raise TimeoutError('timed out')
+
+    done = []
+    sched.submit(acc, scheduler.ADD, slow, key='add', writes=4)
+    sched.submit(acc, scheduler.UPDATE, done.append, 'update', key='update')
+    go.set()
+    sched.join()
+
+    # skipped like a write there's no budget for, the rest carry on
+    assert done == ['update']
+    assert sched.skipped == ['add']
+    assert sched.unwritten == 4
+    assert sched.timeouts == 1
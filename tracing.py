@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import time
+import contextlib
+import tracemalloc
+
+
+class Tracer():
+    """Time the phases of a sync, and optionally their peak memory use
+
+    Wrap each phase (and each account within it) in a span:
+
+        with tracer.span("contact adds", "me@gmail.com"):
+            ...
+
+    Spans with the same phase and account are added together, see rows.
+    Spans can be nested, an outer span's time and memory peak include those of
+    the spans inside it.
+
+    """
+
+    def __init__(self, memory=False):
+        """
+        Parameters
+        ----------
+        memory: bool
+            Also record the peak memory of each span with tracemalloc (which
+            slows things down a lot)
+        """
+        self.memory = memory
+        # maps (phase, account) to [count, seconds, peak bytes]
+        self.spans = {}
+        # peak memory seen so far by each of the currently open spans
+        self.peaks = []
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def span(self, phase, account=None):
+        """Time the code run in the with block as part of phase (and account)"""
+        if self.memory:
+            if self.peaks:
+                self.peaks[-1] = max(
+                    self.peaks[-1], tracemalloc.get_traced_memory()[1]
+                )
+            tracemalloc.reset_peak()
+            self.peaks.append(0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            secs = time.perf_counter() - start
+            peak = 0
+            if self.memory:
+                peak = max(self.peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if self.peaks:
+                    self.peaks[-1] = max(self.peaks[-1], peak)
+                tracemalloc.reset_peak()
+
+            s = self.spans.setdefault((phase, account), [0, 0.0, 0])
+            s[0] += 1
+            s[1] += secs
+            s[2] = max(s[2], peak)
+
+    def add(self, phase, account, secs):
+        """Count secs (timed some other way, in another thread say) as a span"""
+        s = self.spans.setdefault((phase, account), [0, 0.0, 0])
+        s[0] += 1
+        s[1] += secs
+
+    def rows(self):
+        """Return the spans as a list of (phase, account, count, seconds, peak)
+
+        In the order the phases were first entered.
+        """
+        return [(p, a, c, s, m) for (p, a), (c, s, m) in self.spans.items()]
+
+
+def table(rows, memory=False):
+    """Return rows of (ring, phase, account, count, seconds, peak) as text"""
+    cols = ["ring", "phase", "account", "count", "seconds"]
+    if memory:
+        cols.append("peak MB")
+    lines = []
+    for ring, phase, account, count, secs, peak in rows:
+        line = [ring, phase, account or "", str(count), f"{secs:.2f}"]
+        if memory:
+            line.append(f"{peak / 2**20:.1f}")
+        lines.append(line)
+
+    widths = [
+        max([len(c)] + [len(r[i]) for r in lines]) for i, c in enumerate(cols)
+    ]
+    return "\n".join(
+        "  ".join(c.ljust(w) for c, w in zip(r, widths)).rstrip()
+        for r in [cols] + lines
+    )